@@ -0,0 +1,247 @@
+"""
+Persistent, content-addressed cache for embedding vectors, and a small in-memory LRU cache for query results.
+
+Vectors are keyed by the embedding model plus a hash of the normalized input text, so the same string is only sent
+to the embedding API once. Lookups go through an in-memory LRU tier first and fall back to a SQLite file that is
+shared between processes. The SQLite tier is bounded by EMBEDDING_CACHE_MAX_ENTRIES; the least recently used
+entries are evicted when it grows beyond that.
+"""
+
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional
+
+from graphutils.config import EMBEDDING_CACHE_PATH, EMBEDDING_CACHE_MAX_ENTRIES, EMBEDDING_CACHE_MEMORY_ENTRIES
+
+
+def embedding_cache_key(model: str, text: str) -> str:
+    """
+    Returns the content address of an embedding.
+
+    Args:
+        model (str): The embedding model name.
+        text (str): The normalized input text.
+
+    Returns:
+        str: Hex digest identifying the (model, text) pair.
+    """
+    return hashlib.sha256(f'{model}\x00{text}'.encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """
+    Two tier (memory LRU + SQLite) cache for embedding vectors.
+
+    Attributes:
+        path (str): Location of the SQLite file.
+        max_entries (int): Maximal number of vectors kept on disk.
+        memory_entries (int): Maximal number of vectors kept in memory.
+        memory_hits (int): Lookups answered by the memory tier.
+        disk_hits (int): Lookups answered by the SQLite tier.
+        misses (int): Lookups that were not cached.
+    """
+
+    def __init__(self, path=EMBEDDING_CACHE_PATH, max_entries=EMBEDDING_CACHE_MAX_ENTRIES,
+                 memory_entries=EMBEDDING_CACHE_MEMORY_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self.memory_entries = memory_entries
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.execute('''
+            CREATE TABLE IF NOT EXISTS embedding (
+                key TEXT PRIMARY KEY,
+                model TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                last_access REAL NOT NULL
+            )
+        ''')
+        self._connection.execute('CREATE INDEX IF NOT EXISTS embedding_last_access ON embedding (last_access)')
+        self._connection.commit()
+
+    def _remember(self, key: str, vector: List[float]):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def get_many(self, model: str, texts: Iterable[str]) -> Dict[str, List[float]]:
+        """
+        Looks up the vectors of many texts at once.
+
+        Args:
+            model (str): The embedding model name.
+            texts (Iterable[str]): The normalized input texts.
+
+        Returns:
+            Dict[str, List[float]]: The cached vectors keyed by input text. Texts that are not cached are missing.
+        """
+        keys = {embedding_cache_key(model, text): text for text in texts}
+        found = {}
+
+        with self._lock:
+            disk_keys = []
+            for key, text in keys.items():
+                if key in self._memory:
+                    self._memory.move_to_end(key)
+                    found[text] = self._memory[key]
+                    self.memory_hits += 1
+                else:
+                    disk_keys.append(key)
+
+            # sqlite limits the number of bound variables per statement
+            for start in range(0, len(disk_keys), 500):
+                chunk = disk_keys[start:start + 500]
+                rows = self._connection.execute(
+                    f'SELECT key, vector FROM embedding WHERE key IN ({",".join("?" * len(chunk))})', chunk
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array('d', blob).tolist()
+                    found[keys[key]] = vector
+                    self._remember(key, vector)
+                if rows:
+                    self._connection.executemany(
+                        'UPDATE embedding SET last_access = ? WHERE key = ?',
+                        [(time.time(), key) for key, _ in rows]
+                    )
+                    self._connection.commit()
+                self.disk_hits += len(rows)
+
+            self.misses += len(keys) - len(found)
+
+        return found
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """
+        Looks up the vector of a single text, returns None if it is not cached.
+        """
+        return self.get_many(model, [text]).get(text)
+
+    def set_many(self, model: str, vectors: Dict[str, List[float]]):
+        """
+        Stores vectors in both tiers and evicts the least recently used entries if the disk tier is full.
+
+        Args:
+            model (str): The embedding model name.
+            vectors (Dict[str, List[float]]): Vectors keyed by normalized input text.
+        """
+        now = time.time()
+        rows = []
+        with self._lock:
+            for text, vector in vectors.items():
+                key = embedding_cache_key(model, text)
+                self._remember(key, list(vector))
+                rows.append((key, model, array('d', vector).tobytes(), now))
+            self._connection.executemany(
+                'INSERT OR REPLACE INTO embedding (key, model, vector, last_access) VALUES (?, ?, ?, ?)', rows
+            )
+            self._evict()
+            self._connection.commit()
+
+    def set(self, model: str, text: str, vector: List[float]):
+        self.set_many(model, {text: vector})
+
+    def _evict(self):
+        size = self._connection.execute('SELECT COUNT(*) FROM embedding').fetchone()[0]
+        if size <= self.max_entries:
+            return
+        # evict a tenth more than necessary so the next inserts do not trigger another eviction immediately
+        overflow = size - int(self.max_entries * 0.9)
+        self._connection.execute('''
+            DELETE FROM embedding WHERE key IN (
+                SELECT key FROM embedding ORDER BY last_access ASC LIMIT ?
+            )
+        ''', (overflow,))
+        logging.info(f'Evicted {overflow} entries from the embedding cache')
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+            self._connection.execute('DELETE FROM embedding')
+            self._connection.commit()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        Returns the hit/miss counters of this process and the current size of both tiers.
+        """
+        with self._lock:
+            size = self._connection.execute('SELECT COUNT(*) FROM embedding').fetchone()[0]
+            return {
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'memory_entries': len(self._memory),
+                'disk_entries': size,
+            }
+
+
+_embedding_cache = None
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """
+    Returns the process wide embedding cache, or None if caching is disabled (EMBEDDING_CACHE_PATH is empty).
+    The cache is opened lazily so importing this module does not touch the file system.
+    """
+    global _embedding_cache
+    if _embedding_cache is None and EMBEDDING_CACHE_PATH:
+        _embedding_cache = EmbeddingCache()
+    return _embedding_cache
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache whose entries expire after `ttl` seconds.
+
+    Attributes:
+        max_entries (int): Maximal number of entries.
+        ttl (float): Seconds an entry stays valid, None keeps entries until they are evicted.
+    """
+
+    def __init__(self, max_entries, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_many(self, keys: Iterable) -> Dict:
+        """
+        Returns the cached values of the keys that are cached and not expired.
+        """
+        now = time.monotonic()
+        found = {}
+        with self._lock:
+            for key in keys:
+                entry = self._entries.get(key)
+                if entry is None:
+                    continue
+                if self.ttl is not None and now - entry[0] > self.ttl:
+                    del self._entries[key]
+                    continue
+                self._entries.move_to_end(key)
+                found[key] = entry[1]
+        return found
+
+    def set_many(self, values: Dict):
+        now = time.monotonic()
+        with self._lock:
+            for key, value in values.items():
+                self._entries[key] = (now, value)
+                self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -1,8 +1,35 @@
 
+import os
+
 EMBEDDING_DIMENSIONS = 1536
 EMBEDDING_MODEL = "text-embedding-ada-002"
-EMBEDDING_FETCHING_PROCESSES = 1 # concurrent requests for fetching embeddings
+EMBEDDING_FETCHING_CONCURRENCY = 8 # concurrent requests for fetching embeddings
+EMBEDDING_REQUESTS_PER_MINUTE = int(os.getenv("EMBEDDING_REQUESTS_PER_MINUTE", 3000)) # api request quota
+EMBEDDING_TOKENS_PER_MINUTE = int(os.getenv("EMBEDDING_TOKENS_PER_MINUTE", 1000000)) # api token quota
+EMBEDDING_MAX_ATTEMPTS = 10 # attempts per embedding request before giving up
 EMBEDDING_DB_CHUNK_SIZE = 100 # chunk size for embeddings db ingress
+EMBEDDING_STAGE_SIZE = 1000 # nodes embedded and written per stage of get_embeddings_for_model
+EMBEDDING_BATCH_SIZE = 2048 # maximal number of inputs per embedding request
+EMBEDDING_BATCH_MAX_TOKENS = 100000 # maximal number of tokens per embedding request
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3") # empty disables the cache
+EMBEDDING_CACHE_MAX_ENTRIES = 200000 # vectors kept in the sqlite cache before lru eviction
+EMBEDDING_CACHE_MEMORY_ENTRIES = 2048 # vectors kept in the in-memory lru tier
+EMBEDDING_SEARCH_ENGINE = os.getenv("EMBEDDING_SEARCH_ENGINE", "faiss") # "faiss" (in-process) or "neo4j" (vector index)
+EMBEDDING_SEARCH_CANDIDATES = 50 # nearest embeddings fetched per lookup before grouping by node
+EMBEDDING_SEARCH_REFRESH_INTERVAL = 60 # seconds between checks for new embeddings in the in-process index
+EMBEDDING_SEARCH_COMPRESSION = os.getenv("EMBEDDING_SEARCH_COMPRESSION", "") # "", "sq8" (int8) or "pca" (reduced dimensions)
+EMBEDDING_SEARCH_PCA_DIMENSIONS = 256 # dimensions of the "pca" compressed index
+EMBEDDING_SEARCH_RERANK_FACTOR = 4 # compressed candidates per requested result, re-ranked with the full vectors
+EMBEDDING_SEARCH_TRAINING_SIZE = 50000 # vectors sampled to train the compressed index
+EMBEDDING_SNAPSHOT_PATH = os.getenv("EMBEDDING_SNAPSHOT_PATH", "") # memory-mapped embedding snapshot, empty disables it
 CHAT_GPT_MODEL = "gpt-4o"
+ONTOLOGY_FOLDER = os.getenv("ONTOLOGY_FOLDER", "Ontology") # folder of the .owl files used by the ontology tooling
+ONTOLOGY_STORE_NAME = "ontology_store.sqlite3" # owlready2 quadstore kept inside the ontology folder
+ONTOLOGY_HIERARCHY_CACHE_ENTRIES = 10000 # subclass/superclass lists cached per process
+ONTOLOGY_HIERARCHY_CACHE_TTL = 600 # seconds a cached hierarchy is used, bounds staleness after imports in other processes
+MATCHING_RESULT_CACHE_ENTRIES = 128 # matching results cached per process, keyed by the canonical request
+MATCHING_RESULT_CACHE_TTL = 300 # seconds a cached matching result is used, bounds staleness after writes in other processes
+ONTOLOGY_ENRICHMENT_CONCURRENCY = 8 # concurrent label generation requests in update_ontology
+ONTOLOGY_ENRICHMENT_CHECKPOINT_INTERVAL = 50 # generated classes between saves of the ontology file
 
 
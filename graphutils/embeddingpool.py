@@ -0,0 +1,209 @@
+"""
+Concurrent, rate-limit aware fetching of embeddings.
+
+AsyncEmbeddingPool sends the batches of `request_embeddings` concurrently from one asyncio event loop instead of
+forking worker processes that mostly wait on HTTP. Two token buckets keep the pool within the requests per minute
+and tokens per minute quota of the API, and the number of requests in flight is halved whenever the API answers
+with 429 and grows back slowly while requests succeed. Results are returned in the order of the input texts.
+"""
+
+import asyncio
+import logging
+import math
+import random
+import time
+from typing import List, Sequence
+
+from django.conf import settings
+from openai import AsyncOpenAI, RateLimitError, APIConnectionError, APITimeoutError, InternalServerError
+
+from graphutils.config import EMBEDDING_MODEL, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_TOKENS, \
+    EMBEDDING_FETCHING_CONCURRENCY, EMBEDDING_REQUESTS_PER_MINUTE, EMBEDDING_TOKENS_PER_MINUTE, \
+    EMBEDDING_MAX_ATTEMPTS
+from graphutils.embeddings import _build_batches, _estimate_tokens, _lookup_cached, _cache_vectors, \
+    _merge_embeddings, request_embeddings
+
+
+class TokenBucket:
+    """
+    Token bucket refilled continuously with `per_minute` tokens per minute, holding at most one minute of tokens.
+    """
+
+    def __init__(self, per_minute):
+        self.capacity = per_minute
+        self.rate = per_minute / 60
+        self.tokens = per_minute
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self, amount=1):
+        """
+        Waits until `amount` tokens are available and takes them. Waiters are served in order.
+        """
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class AdaptiveConcurrency:
+    """
+    Limits the number of requests in flight. The limit is halved on rate limit errors (multiplicative decrease)
+    and raised by one after `limit` consecutive successes (additive increase), up to `max_concurrency`.
+    """
+
+    def __init__(self, max_concurrency):
+        self.max_concurrency = max_concurrency
+        self.limit = max_concurrency
+        self.active = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.active < self.limit)
+            self.active += 1
+
+    async def __aexit__(self, *exc):
+        async with self._condition:
+            self.active -= 1
+            self._condition.notify_all()
+
+    async def on_success(self):
+        async with self._condition:
+            self._successes += 1
+            if self._successes >= self.limit and self.limit < self.max_concurrency:
+                self.limit += 1
+                self._successes = 0
+                self._condition.notify_all()
+
+    async def on_rate_limit(self):
+        async with self._condition:
+            self.limit = max(1, self.limit // 2)
+            self._successes = 0
+            logging.info(f'Embedding requests were rate limited, reducing concurrency to {self.limit}')
+
+
+class AsyncEmbeddingPool:
+    """
+    Sends embedding requests concurrently within the API quota.
+
+    Attributes:
+        embedding_client: The asynchronous OpenAI client (httpx based) used for the requests.
+        concurrency (AdaptiveConcurrency): The limit of requests in flight.
+        requests (TokenBucket): The requests per minute budget.
+        tokens (TokenBucket): The tokens per minute budget.
+    """
+
+    def __init__(self, max_concurrency=EMBEDDING_FETCHING_CONCURRENCY,
+                 requests_per_minute=EMBEDDING_REQUESTS_PER_MINUTE,
+                 tokens_per_minute=EMBEDDING_TOKENS_PER_MINUTE,
+                 max_batch_size=EMBEDDING_BATCH_SIZE,
+                 max_tokens=EMBEDDING_BATCH_MAX_TOKENS,
+                 embedding_client=None):
+        """
+        Initialize the pool. It has to be created inside the event loop it is used in.
+
+        Args:
+            max_concurrency (int): The maximal number of requests in flight.
+            requests_per_minute (int): The request quota of the API.
+            tokens_per_minute (int): The token quota of the API.
+            max_batch_size (int): The maximal number of texts per request.
+            max_tokens (int): The maximal number of tokens per request.
+            embedding_client: The asynchronous client, defaults to an AsyncOpenAI client without built-in retries.
+        """
+        # retries are handled here, so rate limit errors reach the concurrency limiter
+        self.embedding_client = embedding_client or AsyncOpenAI(max_retries=0)
+        self.concurrency = AdaptiveConcurrency(max_concurrency)
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_batch_size = max_batch_size
+        self.max_tokens = max_tokens
+
+    async def _request_batch(self, texts: List[str]) -> List[List[float]]:
+        """
+        Requests one batch, waiting for the rate limits and retrying rate limit and transient errors with
+        exponential backoff. Other errors (e.g. invalid input) are raised immediately.
+        """
+        tokens = sum(_estimate_tokens(text) for text in texts)
+        for attempt in range(EMBEDDING_MAX_ATTEMPTS):
+            await self.requests.acquire()
+            await self.tokens.acquire(tokens)
+            try:
+                async with self.concurrency:
+                    embedding_response = await self.embedding_client.embeddings.create(
+                        input=texts, model=EMBEDDING_MODEL, user=settings.OPENAI_API_KEY
+                    )
+            except RateLimitError as e:
+                await self.concurrency.on_rate_limit()
+                if attempt == EMBEDDING_MAX_ATTEMPTS - 1:
+                    raise
+                retry_after = e.response.headers.get('retry-after') if e.response is not None else None
+                await asyncio.sleep(float(retry_after) if retry_after else self._backoff(attempt))
+                continue
+            except (APIConnectionError, APITimeoutError, InternalServerError):
+                if attempt == EMBEDDING_MAX_ATTEMPTS - 1:
+                    raise
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            await self.concurrency.on_success()
+            return [item.embedding for item in sorted(embedding_response.data, key=lambda item: item.index)]
+
+    @staticmethod
+    def _backoff(attempt):
+        return min(60, 2 ** attempt) * random.uniform(0.5, 1)
+
+    async def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        """
+        Embeds the (already normalized) texts and returns the vectors in input order. The texts are split into
+        enough batches to keep all concurrent slots busy; every finished batch is written to the embedding cache
+        right away.
+        """
+        if not texts:
+            return []
+        batch_size = min(self.max_batch_size, math.ceil(len(texts) / self.concurrency.max_concurrency))
+        batches = [[texts[i] for i in batch] for batch in _build_batches(texts, batch_size, self.max_tokens)]
+
+        async def run(batch):
+            vectors = await self._request_batch(batch)
+            _cache_vectors(dict(zip(batch, vectors)))
+            return vectors
+
+        # gather keeps the order of the batches, independent of the order they finish in
+        results = await asyncio.gather(*[run(batch) for batch in batches])
+        return [vector for vectors in results for vector in vectors]
+
+
+def request_embeddings_concurrently(texts: Sequence[str], **kwargs) -> List[List[float]]:
+    """
+    Retrieve the embeddings of many texts with concurrent, rate limited requests.
+
+    Works like `request_embeddings`: cached texts are not requested and the result has the order of the input.
+    If an event loop is already running in this thread, the sequential `request_embeddings` is used instead.
+
+    Args:
+        texts (Sequence[str]): The input texts to get the embeddings for.
+        **kwargs: Additional keyword arguments to pass to AsyncEmbeddingPool.
+
+    Returns:
+        List[List[float]]: One embedding per input text.
+    """
+    try:
+        asyncio.get_running_loop()
+        return request_embeddings(texts)
+    except RuntimeError:
+        pass
+
+    cleaned, embeddings, missing = _lookup_cached(texts)
+
+    async def run():
+        return await AsyncEmbeddingPool(**kwargs).embed(missing)
+
+    requested = dict(zip(missing, asyncio.run(run()))) if missing else {}
+    return _merge_embeddings(cleaned, embeddings, requested)
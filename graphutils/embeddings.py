@@ -1,22 +1,27 @@
 import logging
-from typing import List
+import threading
+import time
+from typing import List, Sequence
 
 from openai import OpenAI
 
 client = OpenAI()
 from tenacity import wait_random_exponential, retry, stop_after_attempt
 
-from graphutils.config import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS
+from graphutils.cache import get_embedding_cache
+from graphutils.config import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_BATCH_SIZE, EMBEDDING_BATCH_MAX_TOKENS, \
+    EMBEDDING_SEARCH_CANDIDATES, EMBEDDING_SEARCH_REFRESH_INTERVAL, EMBEDDING_SNAPSHOT_PATH, \
+    EMBEDDING_SEARCH_COMPRESSION, EMBEDDING_SEARCH_PCA_DIMENSIONS, EMBEDDING_SEARCH_RERANK_FACTOR, \
+    EMBEDDING_SEARCH_TRAINING_SIZE
 from django.conf import settings
+from neomodel import db
 
-@retry(wait=wait_random_exponential(min=1, max=2), stop=stop_after_attempt(10))
 def request_embedding(text: str) -> List[float]:
     """
     Retrieve the embedding of the given text using OpenAI's API.
 
-    This function attempts to generate an embedding for the input text using OpenAI's Embedding API.
-    If the request fails, it will retry up to 6 times, with an exponential backoff strategy for waiting
-    between retries.
+    The persistent embedding cache is checked first, so a text is only sent to the API the first time it is
+    embedded with the current EMBEDDING_MODEL.
 
     Args:
         text (str): The input text to get the embedding for.
@@ -25,116 +30,592 @@ def request_embedding(text: str) -> List[float]:
         List[float]: A list of floating-point numbers representing the embedding.
     """
     # Replace newlines in the input text with spaces, as they can negatively affect performance.
-    text = str(text).replace("\n", " ").strip().replace("'", "")
+    text = _clean_text(text)
+    cache = get_embedding_cache()
+    if cache is not None:
+        vector = cache.get(EMBEDDING_MODEL, text)
+        if vector is not None:
+            return vector
+    vector = _request_embedding(text)
+    if cache is not None:
+        cache.set(EMBEDDING_MODEL, text, vector)
+    return vector
+
+
+@retry(wait=wait_random_exponential(min=1, max=2), stop=stop_after_attempt(10))
+def _request_embedding(text: str) -> List[float]:
+    """
+    Retrieve the embedding of the given, already normalized text from OpenAI's API.
+
+    If the request fails, it will retry up to 10 times, with an exponential backoff strategy for waiting
+    between retries.
+    """
     # Call the OpenAI Embedding API to create an embedding for the input text.
     # The API response contains the embedding data in a nested structure.
-    # print(settings.OPENAI_API_KEY)
     embedding_response = client.embeddings.create(input=[text], model=EMBEDDING_MODEL, user = settings.OPENAI_API_KEY)
     # Extract the embedding data from the response and return it as a list of floating-point numbers.
     return embedding_response.data[0].embedding
 
 
+def _clean_text(text) -> str:
+    """
+    Normalizes an input string the same way for single and batched embedding requests.
+    """
+    return str(text).replace("\n", " ").strip().replace("'", "")
+
+
+def _estimate_tokens(text: str) -> int:
+    """
+    Cheap upper estimate of the number of tokens of a text. English text averages about four characters per token,
+    three keeps a safety margin for chemical names and formulas.
+    """
+    return len(text) // 3 + 1
+
+
+def _build_batches(texts: Sequence[str], max_batch_size: int, max_tokens: int) -> List[List[int]]:
+    """
+    Groups the indices of the input texts into batches that stay below the item and token budget of a single
+    embedding request. Every batch holds at least one text, so an oversized text is sent on its own.
+
+    Args:
+        texts: The cleaned input texts.
+        max_batch_size (int): The maximal number of texts per request.
+        max_tokens (int): The maximal number of tokens per request.
+
+    Returns:
+        List[List[int]]: Batches of indices into `texts`, in input order.
+    """
+    batches, batch, batch_tokens = [], [], 0
+    for i, text in enumerate(texts):
+        tokens = _estimate_tokens(text)
+        if batch and (len(batch) >= max_batch_size or batch_tokens + tokens > max_tokens):
+            batches.append(batch)
+            batch, batch_tokens = [], 0
+        batch.append(i)
+        batch_tokens += tokens
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+@retry(wait=wait_random_exponential(min=1, max=2), stop=stop_after_attempt(10))
+def _request_embedding_batch(texts: List[str], embedding_client) -> List[List[float]]:
+    """
+    Requests the embeddings of one batch. The retry is scoped to the batch, so a failing request only repeats
+    the inputs of that batch instead of the whole input list.
+    """
+    embedding_response = embedding_client.embeddings.create(input=texts, model=EMBEDDING_MODEL,
+                                                            user=settings.OPENAI_API_KEY)
+    # the API does not guarantee the order of the returned items, the index field maps them back to the input
+    return [item.embedding for item in sorted(embedding_response.data, key=lambda item: item.index)]
+
+
+def request_embeddings(texts: Sequence[str],
+                       max_batch_size: int = EMBEDDING_BATCH_SIZE,
+                       max_tokens: int = EMBEDDING_BATCH_MAX_TOKENS,
+                       embedding_client=None) -> List[List[float]]:
+    """
+    Retrieve the embeddings of many texts using OpenAI's API.
+
+    Cached texts are answered from the embedding cache, the remaining texts are packed into as few requests as the
+    item and token budget allow. Each request is retried on its own with the same backoff strategy as
+    `request_embedding`. The returned list has the same order as the input.
+
+    Args:
+        texts (Sequence[str]): The input texts to get the embeddings for.
+        max_batch_size (int): The maximal number of texts sent in one request.
+        max_tokens (int): The maximal number of tokens sent in one request.
+        embedding_client: The client to send the requests with, defaults to the module's OpenAI client.
+
+    Returns:
+        List[List[float]]: One embedding per input text.
+    """
+    embedding_client = embedding_client or client
+    cleaned, embeddings, missing = _lookup_cached(texts)
+
+    requested = {}
+    for batch in _build_batches(missing, max_batch_size, max_tokens):
+        logging.debug(f'Requesting {len(batch)} embeddings in one request')
+        batch_texts = [missing[i] for i in batch]
+        batch_vectors = dict(zip(batch_texts, _request_embedding_batch(batch_texts, embedding_client)))
+        _cache_vectors(batch_vectors)
+        requested.update(batch_vectors)
+
+    return _merge_embeddings(cleaned, embeddings, requested)
+
+
+def _lookup_cached(texts: Sequence[str]):
+    """
+    Normalizes the texts and looks them up in the embedding cache.
+
+    Returns:
+        tuple: The cleaned texts, the cached vector of every text (None if not cached) and the unique uncached
+        texts. Only the first occurrence of every uncached text has to be requested, duplicates are filled in
+        by `_merge_embeddings`.
+    """
+    cleaned = [_clean_text(text) for text in texts]
+    cache = get_embedding_cache()
+    cached = cache.get_many(EMBEDDING_MODEL, cleaned) if cache is not None else {}
+    embeddings = [cached.get(text) for text in cleaned]
+    missing = list(dict.fromkeys(text for text, vector in zip(cleaned, embeddings) if vector is None))
+    return cleaned, embeddings, missing
+
+
+def _cache_vectors(vectors):
+    cache = get_embedding_cache()
+    if cache is not None:
+        cache.set_many(EMBEDDING_MODEL, vectors)
+
+
+def _merge_embeddings(cleaned, embeddings, requested):
+    return [vector if vector is not None else requested[text] for text, vector in zip(cleaned, embeddings)]
+
+
+class EmbeddingIndexUnavailable(ValueError):
+    """
+    Raised if the in-process embedding index of a model cannot be built, e.g. because faiss is not installed or
+    the model has no embeddings.
+    """
+
+
+class EmbeddingSearch:
+    """
+    Loads embeddings for a model into RAM and enables fast search using FAISS.
+    The index is fetched and built on instance creation and kept in sync with the database by `refresh`.
+
+    Vectors are held as a normalized float32 matrix, so the inner product search of the index returns cosine
+    similarities. If a snapshot is given, its memory-mapped matrix is searched in place and only embeddings that
+    were stored after the snapshot are fetched from the database into the FAISS index.
+
+    Attributes:
+        Model: The Django model class to fetch embeddings for.
+        id_property (str): The property to use as the identifier.
+        model_ids (list): The identifier of the node every indexed vector belongs to.
+        snapshot (EmbeddingSnapshot): The memory-mapped snapshot the search starts from, if any.
+        fingerprint (tuple): The fingerprint of the indexed pairs when the index was last synced.
+    """
+
+    def __init__(self, Model, fetch_filter="true", id_property='uid', snapshot=None):
+        """
+        Initialize the EmbeddingSearch instance.
+
+        Args:
+            Model: The Django model class to fetch embeddings for.
+            fetch_filter (str): The filter to apply when fetching embeddings from the database.
+            id_property (str): The property to use as the identifier.
+            snapshot (EmbeddingSnapshot): Memory-mapped embeddings to start from instead of fetching all of them.
+        """
+
+        # import here to avoid loading faiss for everything django does
+        try:
+            import faiss
+        except ImportError as e:
+            raise EmbeddingIndexUnavailable(f'faiss is not installed: {e}') from e
+
+        self.Model = Model
+        self.fetch_filter = fetch_filter
+        self.id_property = id_property
+        self.snapshot = snapshot
+        self.model_ids = list(snapshot.ids) if snapshot is not None else []
+        # (node id, embedding uid) of every indexed row; embeddings are shared by nodes with the same input,
+        # so the embedding uid alone does not identify a row
+        self.indexed_pairs = set(zip(snapshot.ids, snapshot.embedding_uids)) if snapshot is not None else set()
+        self._inputs = []  # inputs of the rows in the FAISS index, snapshot inputs are read from the snapshot
+        self.fingerprint = None
+        self.last_refresh = 0
+        self._lock = threading.Lock()
+
+        logging.info(f'Creating embedding index for label {Model.__label__}')
+        self.index = faiss.IndexFlatIP(EMBEDDING_DIMENSIONS)
+        self.refresh(force=True)
+
+        if not self.model_ids:
+            raise EmbeddingIndexUnavailable(f'no embeddings found for {Model.__label__}')
+
+    @property
+    def _base(self):
+        return len(self.snapshot) if self.snapshot is not None else 0
+
+    def _input(self, i):
+        return self.snapshot.input(i) if i < self._base else self._inputs[i - self._base]
+
+    def _match(self):
+        return f'''
+            MATCH (n:{self.Model.__label__})<-[:FOR]-(emb:ModelEmbedding)
+            WHERE COALESCE(n.disable_embedding, false)=false AND {self.fetch_filter}
+            AND size(emb.vector) = $dimensions
+        '''
 
+    def _fetch(self, exclude_pairs=None, updated_since=None):
+        """
+        Fetches the embeddings of the model from the database.
 
-# class  EmbeddingSearch:
-#     """
-#     Loads embeddings for a model into RAM and enables fast search using FAISS.
-#     The index is fetched and built on instance creation.
-#
-#     Attributes:
-#         Model: The Django model class to fetch embeddings for.
-#         id_property (str): The property to use as the identifier.
-#     """
-#
-#     def __init__(self, Model, fetch_filter="true", id_property='uid'):
-#         """
-#         Initialize the EmbeddingSearch instance.
-#
-#         Args:
-#             Model: The Django model class to fetch embeddings for.
-#             fetch_filter (str): The filter to apply when fetching embeddings from the database.
-#             id_property (str): The property to use as the identifier.
-#         """
-#
-#         # import here to avoid loading faiss for everything django does
-#         import faiss
-#         import numpy as np
-#
-#         self.Model = Model
-#         self.id_property = id_property
-#
-#         logging.info(f'Fetching embeddings for label {Model.__label__}')
-#         query = f'''
-#             MATCH (n:{Model.__label__})<-[:FOR]-(emb:ModelEmbedding)
-#             WHERE COALESCE(n.disable_embedding, false)=false AND {fetch_filter}
-#             RETURN n.{id_property} as {id_property}, emb.vector as vector
-#         '''
-#         # Fetch embeddings from the database
-#         result, meta = db.cypher_query(query)
-#
-#         if not len(result):
-#             raise ValueError(f'no embeddings found for {Model.__label__}')
-#
-#         logging.info(f'Creating embedding index for label {Model.__label__}')
-#
-#         # Create FAISS index
-#         self.index = faiss.IndexFlatIP(EMBEDDING_DIMENSIONS)
-#         self.index.add(np.array([
-#             np.array(row[1]) for row in result
-#         ]))
-#
-#         self.model_ids = [row[0] for row in result]
-#
-#
-#     def find_vector(self, vector, n=1, include_similarities=False):
-#         """
-#         Find the closest embeddings in the index to the input vector.
-#
-#         Args:
-#             vector (np.array): The input vector to find the closest embeddings for.
-#             n (int): The number of closest embeddings to return.
-#             include_similarities (bool): Whether to include similarities in the output.
-#
-#         Returns:
-#             If `include_similarities` is False, returns a list of ids or a single id (if n=1).
-#             If `include_similarities` is True, returns a list of tuples (id, similarity) or a tuple (id, similarity) if n=1.
-#         """
-#
-#         import numpy as np
-#
-#         D, I = self.index.search(np.array([vector]), n)
-#         ids = [self.model_ids[i] for i in I[0]]
-#
-#         if include_similarities:
-#             return ids[0], D[0][0] if n == 1 else [(ids[i], D[0][i]) for i in range(len(ids))]
-#
-#         return ids[0] if n == 1 else ids
-#
-#
-#     def find_string(self, query, return_model=False, include_similarity=False, **kwargs):
-#         """
-#         Find the closest embeddings in the index to the input query.
-#
-#         Args:
-#             query (str): The input string to find the closest embeddings for.
-#             return_model (bool): Whether to return a model instance instead of the id.
-#             include_similarity (bool): Whether to include similarities in the output.
-#             **kwargs: Additional keyword arguments to pass to the `find_vector` method.
-#
-#         Returns:
-#             Depending on the input arguments, returns:
-#             - An instance of the model or an id
-#             - A list of tuples (model instance, similarity) or a list of tuples (id, similarity)
-#         """
-#
-#         if not query:
-#             return (None, 0) if include_similarity else None
-#         res = self.find_vector(request_embedding(query), include_similarities=include_similarity, **kwargs)
-#
-#         if include_similarity:
-#             if return_model:
-#                 return self.Model.nodes.get(**{self.id_property: res[0]}), res[1]
-#             else:
-#                 return res
-#         else:
-#             return self.Model.nodes.get(**{self.id_property: res}) if return_model else res
\ No newline at end of file
+        Args:
+            exclude_pairs (list): [node id, embedding uid] pairs that are already indexed and should not be
+                fetched again.
+            updated_since (float): Fetch excluded pairs anyway if their embedding was updated after this time.
+
+        Returns:
+            list: Rows of (node id, embedding uid, input, vector).
+        """
+        logging.info(f'Fetching embeddings for label {self.Model.__label__}')
+        pairs_filter = ''
+        if exclude_pairs:
+            pairs_filter = f'AND (NOT [n.{self.id_property}, emb.uid] IN $exclude_pairs'
+            pairs_filter += ' OR emb.updated > $updated_since)' if updated_since is not None else ')'
+        query = f'''
+            {self._match()}
+            {pairs_filter}
+            RETURN DISTINCT n.{self.id_property} as {self.id_property}, emb.uid as embedding_uid,
+                   emb.input as input, emb.vector as vector
+        '''
+        result, meta = db.cypher_query(query, {
+            'dimensions': EMBEDDING_DIMENSIONS,
+            'exclude_pairs': exclude_pairs or [],
+            'updated_since': updated_since
+        })
+        return result
+
+    def _fingerprint(self):
+        """
+        Returns the number of (node, embedding) pairs, a hash of the pairs and the latest `updated` time of their
+        embeddings (0 if no embedding has one). Only the fingerprint is sent back, not the pairs.
+        """
+        query = f'''
+            {self._match()}
+            WITH DISTINCT toString(n.{self.id_property}) + ' ' + emb.uid AS pair, emb.updated AS updated
+            RETURN count(pair), apoc.util.md5(apoc.coll.sort(collect(pair))), COALESCE(max(updated), 0)
+        '''
+        result, meta = db.cypher_query(query, {'dimensions': EMBEDDING_DIMENSIONS})
+        return tuple(result[0])
+
+    def _add(self, rows):
+        rows = [row for row in rows if row[3] and len(row[3]) == EMBEDDING_DIMENSIONS
+                and (row[0], row[1]) not in self.indexed_pairs]
+        if rows:
+            matrix = normalize_vectors([row[3] for row in rows])
+            self.index.add(matrix)
+            self.model_ids += [row[0] for row in rows]
+            self.indexed_pairs.update((row[0], row[1]) for row in rows)
+            self._inputs += [row[2] for row in rows]
+            self._added(matrix)
+        self.last_refresh = time.time()
+
+    def _added(self, matrix):
+        """
+        Hook called with the normalized vectors of every batch of rows added to the index.
+        """
+        pass
+
+    def _rebuild(self):
+        """
+        Drops the snapshot and the index and fetches all embeddings from the database again.
+        """
+        logging.info(f'Rebuilding embedding index for label {self.Model.__label__}')
+        self.index.reset()
+        self.snapshot = None
+        self.model_ids, self._inputs, self.indexed_pairs = [], [], set()
+        self._add(self._fetch())
+
+    def vectors(self, rows):
+        """
+        Returns the full precision vectors of the given rows, read from the snapshot or the FAISS index.
+        """
+        import numpy as np
+
+        rows = np.asarray(rows, dtype=np.int64)
+        matrix = np.empty((len(rows), EMBEDDING_DIMENSIONS), dtype=np.float32)
+        from_snapshot = rows < self._base
+        if from_snapshot.any():
+            matrix[from_snapshot] = self.snapshot.vectors[rows[from_snapshot]]
+        if (~from_snapshot).any():
+            matrix[~from_snapshot] = self.index.reconstruct_batch(rows[~from_snapshot] - self._base)
+        return matrix
+
+    def refresh(self, force=False):
+        """
+        Syncs the index with the database. A fingerprint query, a hash of the (node, embedding) pairs and the latest
+        `updated` time of their embeddings, decides whether anything needs to be fetched. New pairs are added to
+        the index; if an indexed embedding was updated or a pair was removed, the index is rebuilt from the
+        database.
+
+        Args:
+            force (bool): Check the database even if the refresh interval has not passed yet.
+        """
+        if not force and time.time() - self.last_refresh < EMBEDDING_SEARCH_REFRESH_INTERVAL:
+            return
+        with self._lock:
+            fingerprint = self._fingerprint()
+            if fingerprint == self.fingerprint:
+                self.last_refresh = time.time()
+                return
+            count = fingerprint[0]
+            if count < len(self.model_ids):
+                self._rebuild()
+            else:
+                # before the first sync (e.g. of a snapshot) it is unknown which indexed embeddings are up to date
+                updated_since = self.fingerprint[2] if self.fingerprint is not None else None
+                rows = self._fetch(exclude_pairs=[list(pair) for pair in self.indexed_pairs],
+                                   updated_since=updated_since)
+                if any((row[0], row[1]) in self.indexed_pairs for row in rows):
+                    self._rebuild()
+                else:
+                    self._add(rows)
+                    # pairs were removed while others were added
+                    if len(self.model_ids) != count:
+                        self._rebuild()
+            self.fingerprint = fingerprint
+
+    def search_many(self, vectors, n=EMBEDDING_SEARCH_CANDIDATES):
+        """
+        Find the closest embeddings in the index to each of the input vectors with one matrix search.
+
+        Args:
+            vectors: The input vectors (list of lists or a matrix).
+            n (int): The number of closest embeddings to return per vector.
+
+        Returns:
+            list: One list of tuples (id, cosine similarity, input string) per vector, best match first.
+        """
+        import numpy as np
+
+        queries = normalize_vectors(vectors)
+        candidates = [[] for _ in range(len(queries))]
+        if self._base:
+            scores = queries @ self.snapshot.vectors.T
+            if scores.shape[1] > n:
+                top = np.argpartition(-scores, n - 1, axis=1)[:, :n]
+            else:
+                top = np.tile(np.arange(scores.shape[1]), (len(queries), 1))
+            for q in range(len(queries)):
+                candidates[q] += [(float(scores[q, i]), int(i)) for i in top[q]]
+        if self.index.ntotal:
+            D, I = self.index.search(queries, n)
+            for q in range(len(queries)):
+                candidates[q] += [(float(d), self._base + int(i)) for d, i in zip(D[q], I[q]) if i >= 0]
+
+        return [
+            [(self.model_ids[i], d, self._input(i)) for d, i in sorted(query_candidates, reverse=True)[:n]]
+            for query_candidates in candidates
+        ]
+
+    def search(self, vector, n=EMBEDDING_SEARCH_CANDIDATES):
+        """
+        Find the closest embeddings in the index to the input vector.
+
+        Args:
+            vector: The input vector.
+            n (int): The number of closest embeddings to return.
+
+        Returns:
+            list: Tuples of (id, cosine similarity, input string), best match first.
+        """
+        return self.search_many([vector], n)[0]
+
+    def find_vector(self, vector, n=1, include_similarities=False):
+        """
+        Find the closest embeddings in the index to the input vector.
+
+        Args:
+            vector (np.array): The input vector to find the closest embeddings for.
+            n (int): The number of closest embeddings to return.
+            include_similarities (bool): Whether to include similarities in the output.
+
+        Returns:
+            If `include_similarities` is False, returns a list of ids or a single id (if n=1).
+            If `include_similarities` is True, returns a list of tuples (id, similarity) or a tuple (id, similarity) if n=1.
+        """
+        results = [(model_id, similarity) for model_id, similarity, _ in self.search(vector, n)]
+
+        if include_similarities:
+            return results[0] if n == 1 else results
+
+        return results[0][0] if n == 1 else [model_id for model_id, _ in results]
+
+    def find_string(self, query, return_model=False, include_similarity=False, **kwargs):
+        """
+        Find the closest embeddings in the index to the input query.
+
+        Args:
+            query (str): The input string to find the closest embeddings for.
+            return_model (bool): Whether to return a model instance instead of the id.
+            include_similarity (bool): Whether to include similarities in the output.
+            **kwargs: Additional keyword arguments to pass to the `find_vector` method.
+
+        Returns:
+            Depending on the input arguments, returns:
+            - An instance of the model or an id
+            - A list of tuples (model instance, similarity) or a list of tuples (id, similarity)
+        """
+
+        if not query:
+            return (None, 0) if include_similarity else None
+        res = self.find_vector(request_embedding(query), include_similarities=include_similarity, **kwargs)
+
+        if include_similarity:
+            if return_model:
+                return self.Model.nodes.get(**{self.id_property: res[0]}), res[1]
+            else:
+                return res
+        else:
+            return self.Model.nodes.get(**{self.id_property: res}) if return_model else res
+
+
+COMPRESSION_MIN_ROWS = 1024  # labels with fewer embeddings are searched exactly
+
+
+class CompressedEmbeddingSearch(EmbeddingSearch):
+    """
+    EmbeddingSearch that scans a compressed copy of the vectors and re-ranks the best candidates with the full
+    vectors.
+
+    Two compressions are supported:
+     - 'sq8': int8 scalar quantization of every dimension (4x smaller than float32)
+     - 'pca': PCA projection to EMBEDDING_SEARCH_PCA_DIMENSIONS dimensions (1536 -> 256 is 6x smaller)
+
+    For every query EMBEDDING_SEARCH_RERANK_FACTOR times the requested number of candidates are taken from the
+    compressed index and scored exactly against their full vectors. With a snapshot the full vectors are read from
+    the shared memory map, so the memory of each worker is dominated by the compressed index.
+    """
+
+    def __init__(self, Model, compression=EMBEDDING_SEARCH_COMPRESSION, **kwargs):
+        """
+        Initialize the CompressedEmbeddingSearch instance.
+
+        Args:
+            Model: The Django model class to fetch embeddings for.
+            compression (str): 'sq8' or 'pca'.
+            **kwargs: Additional keyword arguments to pass to EmbeddingSearch.
+        """
+        if compression not in ('sq8', 'pca'):
+            raise ValueError(f'unknown embedding compression {compression}')
+        self.compression = compression
+        self.compressed = None
+        self._ready = False
+        super().__init__(Model, **kwargs)
+        self._ready = True
+        self._build_compressed()
+
+    def _build_compressed(self):
+        """
+        Trains the compressed index on (a sample of) the current vectors and adds all of them. Small labels are not
+        compressed, as training needs enough samples and the exact search is fast for them anyway.
+        """
+        import faiss
+        import numpy as np
+
+        if len(self.model_ids) < COMPRESSION_MIN_ROWS:
+            self.compressed = None
+            return
+
+        if self.compression == 'sq8':
+            compressed = faiss.IndexScalarQuantizer(EMBEDDING_DIMENSIONS, faiss.ScalarQuantizer.QT_8bit,
+                                                    faiss.METRIC_INNER_PRODUCT)
+        else:
+            compressed = faiss.IndexPreTransform(
+                faiss.PCAMatrix(EMBEDDING_DIMENSIONS, EMBEDDING_SEARCH_PCA_DIMENSIONS),
+                faiss.IndexFlatIP(EMBEDDING_SEARCH_PCA_DIMENSIONS)
+            )
+
+        rows = len(self.model_ids)
+        sample = np.random.default_rng(0).choice(rows, min(rows, EMBEDDING_SEARCH_TRAINING_SIZE), replace=False)
+        compressed.train(self.vectors(np.sort(sample)))
+        for start in range(0, rows, EMBEDDING_SEARCH_TRAINING_SIZE):
+            compressed.add(self.vectors(np.arange(start, min(start + EMBEDDING_SEARCH_TRAINING_SIZE, rows))))
+        self.compressed = compressed
+
+    def _added(self, matrix):
+        # while the instance is created, the rows are picked up by _build_compressed
+        if self.compressed is not None:
+            self.compressed.add(matrix)
+        elif self._ready:
+            self._build_compressed()
+
+    def _rebuild(self):
+        # the rows fetched by the rebuild train and fill a new compressed index in _added
+        self.compressed = None
+        super()._rebuild()
+
+    def search_many(self, vectors, n=EMBEDDING_SEARCH_CANDIDATES):
+        """
+        Find the closest embeddings to each of the input vectors: candidates from the compressed index,
+        re-ranked by their exact cosine similarity.
+
+        Args:
+            vectors: The input vectors (list of lists or a matrix).
+            n (int): The number of closest embeddings to return per vector.
+
+        Returns:
+            list: One list of tuples (id, cosine similarity, input string) per vector, best match first.
+        """
+        import numpy as np
+
+        if self.compressed is None:
+            return super().search_many(vectors, n)
+
+        queries = normalize_vectors(vectors)
+        _, I = self.compressed.search(queries, n * EMBEDDING_SEARCH_RERANK_FACTOR)
+        results = []
+        for query, candidates in zip(queries, I):
+            candidates = candidates[candidates >= 0]
+            scores = self.vectors(candidates) @ query
+            order = np.argsort(-scores)[:n]
+            results.append([
+                (self.model_ids[candidates[i]], float(scores[i]), self._input(int(candidates[i]))) for i in order
+            ])
+        return results
+
+
+def normalize_vectors(vectors):
+    """
+    Converts vectors to a contiguous float32 matrix with unit length rows.
+    """
+    import numpy as np
+
+    matrix = np.ascontiguousarray(np.asarray(vectors, dtype=np.float32))
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    return matrix / norms
+
+
+def _load_snapshot(Model):
+    """
+    Opens the snapshot of a model from EMBEDDING_SNAPSHOT_PATH, returns None if there is no usable snapshot.
+    """
+    if not EMBEDDING_SNAPSHOT_PATH:
+        return None
+    from graphutils.snapshot import EmbeddingSnapshot
+    try:
+        return EmbeddingSnapshot(EMBEDDING_SNAPSHOT_PATH, Model.__label__)
+    except (OSError, ValueError) as e:
+        logging.warning(f'Ignoring embedding snapshot for {Model.__label__}: {e}')
+        return None
+
+
+_embedding_searches = {}
+_embedding_searches_lock = threading.Lock()
+
+
+def get_embedding_search(Model):
+    """
+    Returns the EmbeddingSearch of a model. The index is built once per process (i.e. once per gunicorn worker),
+    starting from the memory-mapped snapshot at EMBEDDING_SNAPSHOT_PATH if there is one, and refreshed with new
+    embeddings at most every EMBEDDING_SEARCH_REFRESH_INTERVAL seconds. If EMBEDDING_SEARCH_COMPRESSION is set,
+    a CompressedEmbeddingSearch is used.
+
+    Args:
+        Model: The Django model class to search embeddings for.
+
+    Returns:
+        EmbeddingSearch: The search instance of the model.
+    """
+    with _embedding_searches_lock:
+        search = _embedding_searches.get(Model.__label__)
+        if search is None:
+            if EMBEDDING_SEARCH_COMPRESSION:
+                search = CompressedEmbeddingSearch(Model, snapshot=_load_snapshot(Model))
+            else:
+                search = EmbeddingSearch(Model, snapshot=_load_snapshot(Model))
+            _embedding_searches[Model.__label__] = search
+    search.refresh()
+    return search
@@ -127,6 +127,9 @@ class DummyPaginator:
     def build_query_fragment(self):
         return f' SKIP {self.skip} LIMIT {self.limit}'
 
+    def build_params(self):
+        return {}
+
 class NeoPaginator:
 
     def __init__(self, request, max_limit=20, default_limit=20):
@@ -137,6 +140,9 @@ class NeoPaginator:
     def build_query_fragment(self):
         return f' SKIP {self.start} LIMIT {self.limit}'
 
+    def build_params(self):
+        return {}
+
     def build_query(self, query):
         return f'{query} {self.build_query_fragment()}'
 
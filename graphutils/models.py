@@ -12,6 +12,7 @@ graphutils model classes:
 """
 
 import json
+import logging
 import uuid
 
 from django.apps import apps
@@ -22,7 +23,9 @@ from neomodel import UniqueIdProperty, StringProperty, ArrayProperty, AliasPrope
 from neomodel.properties import validator, BooleanProperty
 from neomodel import db
 
-from graphutils.embeddings import request_embedding
+from graphutils.config import EMBEDDING_SEARCH_ENGINE, EMBEDDING_SEARCH_CANDIDATES
+from graphutils.embeddings import request_embedding, request_embeddings, get_embedding_search, \
+    EmbeddingIndexUnavailable
 
 
 # from graphutils.embeddings import request_embedding
@@ -33,37 +36,106 @@ class EmbeddingNodeSet(NodeSet):
         super().__init__(cls)
 
 
-    def _get_by_embedding(self, include_similarity, include_input_string, **kwargs):
+    def _search_index(self, vectors, limit=10):
+        """
+        Finds the nodes closest to each vector in the in-process FAISS index of the source class.
+        All vectors are searched at once and the nodes of all results are fetched in a single query.
+
+        :param vectors: The query vectors
+        :param limit: The maximal number of nodes to return per vector
+        :return: One list of rows of (node, score, input string) per vector, best match first
+        """
+        search = get_embedding_search(self.source_class)
+
+        # keep the best scoring embedding per node, as in the vector index query
+        matches = []
+        for candidates in search.search_many(vectors, max(limit, EMBEDDING_SEARCH_CANDIDATES)):
+            best = {}
+            for uid, similarity, input_string in candidates:
+                if uid not in best:
+                    best[uid] = (similarity, input_string)
+                if len(best) == limit:
+                    break
+            matches.append(best)
+
+        nodes, _ = db.cypher_query(
+            f'MATCH (n:{self.source_class.__label__}) WHERE n.uid IN $uids RETURN n',
+            {'uids': list({uid for best in matches for uid in best})},
+            resolve_objects=True
+        )
+        nodes = {row[0].uid: row[0] for row in nodes}
+        # scores are mapped from cosine similarity to [0, 1] like the scores of the neo4j cosine vector index
+        return [
+            [
+                [nodes[uid], (1 + similarity) / 2, input_string]
+                for uid, (similarity, input_string) in best.items() if uid in nodes
+            ]
+            for best in matches
+        ]
+
+    def _query_index(self, vectors, limit=10):
+        """
+        Finds the nodes closest to each vector with the neo4j vector index, all vectors in one query.
+        Like `_search_index`, every node is returned once with its best scoring embedding.
 
-        #TODO: Needs to have big numbers for limit
+        :param vectors: The query vectors
+        :param limit: The maximal number of nodes to return per vector
+        :return: One list of rows of (node, score, input string) per vector, best match first
+        """
         query = """
-            CALL db.index.vector.queryNodes($embedding, 50, $vector)
-            YIELD node AS similarEmbedding, score
-            MATCH (similarEmbedding)-[:FOR]->(n)
-            RETURN DISTINCT n, score, similarEmbedding.input
-            ORDER BY score DESC
-            LIMIT 10
+            UNWIND range(0, size($vectors)-1) AS i
+            CALL {
+                WITH i
+                CALL db.index.vector.queryNodes($embedding, $candidates, $vectors[i])
+                YIELD node AS similarEmbedding, score
+                MATCH (similarEmbedding)-[:FOR]->(n)
+                WITH n, score, similarEmbedding.input AS input
+                ORDER BY score DESC
+                WITH n, collect([score, input])[0] AS best
+                RETURN n, best[0] AS score, best[1] AS input
+                ORDER BY score DESC
+                LIMIT $limit
+            }
+            RETURN i, n, score, input
+            ORDER BY i, score DESC
         """
+        results, _ = db.cypher_query(query, {
+            'embedding': self.source_class.embedding,
+            'vectors': list(vectors),
+            'candidates': max(limit, EMBEDDING_SEARCH_CANDIDATES),
+            'limit': limit
+        }, resolve_objects=True)
+        grouped = [[] for _ in vectors]
+        for i, n, score, input_string in results:
+            grouped[i].append([n, score, input_string])
+        return grouped
+
+    def _get_by_embeddings(self, vectors, limit=10):
+        if EMBEDDING_SEARCH_ENGINE == 'faiss':
+            try:
+                return self._search_index(vectors, limit)
+            except EmbeddingIndexUnavailable as e:
+                logging.warning(f'In-process embedding search is unavailable for {self.source_class.__label__}, '
+                                f'falling back to the neo4j vector index: {e}')
+        return self._query_index(vectors, limit)
 
-        kwargs['embedding'] = self.source_class.embedding
-        # db.cypher_query(query, {'embedding': embedding, 'topN': limit, 'vector': vector})[0][0]
-        # if limit:
-        #     self.limit = limit
-        #
-        # return self.query_cls(self).build_ast()._execute(False)
+    def _get_by_embedding(self, include_similarity, include_input_string, **kwargs):
+        results = self._get_by_embeddings([kwargs['vector']], kwargs.get('limit', 10))[0]
+        return self._format_results(results, include_similarity, include_input_string, kwargs.get('string'))
 
-        results, _ = db.cypher_query(query, kwargs, resolve_objects=True)
+    @staticmethod
+    def _format_results(results, include_similarity, include_input_string, string):
         # The following is not as elegant as it could be but had to be copied from the
         # version prior to cypher_query with the resolve_objects capability.
         # It seems that certain calls are only supposed to be focusing to the first
         # result item returned (?)
         if results:
             if include_similarity and include_input_string:
-                return [[n[0], n[1], n[2], kwargs['string']] for n in results]
+                return [[n[0], n[1], n[2], string] for n in results]
             elif include_similarity:
-                return [[n[0], n[1], n[2], kwargs['string']] for n in results]
+                return [[n[0], n[1], n[2], string] for n in results]
             elif include_input_string:
-                return [[n[0], n[2], kwargs['string']] for n in results]
+                return [[n[0], n[2], string] for n in results]
 
             else:
                 return [n[0] for n in results]
@@ -92,6 +164,35 @@ class EmbeddingNodeSet(NodeSet):
         result = self._get_by_embedding(include_similarity, include_input_string, **kwargs)
         return result
 
+    def get_by_embeddings(self, vectors, strings=None, include_similarity = False, include_input_string = False,
+                          limit=10):
+        """
+        Retrieve the closest nodes for many vectors with a single search
+        :param vectors: the query vectors (list of lists or a matrix)
+        :param strings: the strings the vectors were created from, returned with the results
+        :param limit: maximal number of nodes per vector
+        :return: one result list per vector, formatted like `get_by_embedding`
+        """
+        if len(vectors) == 0:
+            return []
+        strings = strings if strings is not None else [None] * len(vectors)
+        return [
+            self._format_results(results, include_similarity, include_input_string, string)
+            for results, string in zip(self._get_by_embeddings(vectors, limit), strings)
+        ]
+
+    def get_by_strings(self, strings, include_similarity = False, include_input_string = False, limit=10):
+        """
+        Retrieve the closest nodes for many strings, embedding all strings in one batch
+        :param strings: the query strings
+        :param limit: maximal number of nodes per string
+        :return: one result list per string, formatted like `get_by_string`
+        """
+        if not strings:
+            return []
+        return self.get_by_embeddings(request_embeddings(strings), strings, include_similarity,
+                                      include_input_string, limit)
+
 
 class UIDDjangoNode(DjangoNode):
     """
@@ -0,0 +1,228 @@
+"""
+Memory-mapped snapshot format for ontology embeddings.
+
+A snapshot is a directory holding one set of files per ontology label:
+
+ - <label>.vectors.npy: normalized float32 matrix (rows x EMBEDDING_DIMENSIONS)
+ - <label>.ids.npy: uid of the ontology node of every row
+ - <label>.embedding_uids.npy: uid of the ModelEmbedding node of every row
+ - <label>.inputs.bin / <label>.input_offsets.npy: utf-8 input string table and the row offsets into it
+
+plus a header.json describing the embedding model, dimensions and row counts. All arrays are opened with
+`mmap_mode='r'`, so every gunicorn worker maps the same page-cached file instead of holding its own copy.
+"""
+
+import json
+import logging
+import os
+import time
+
+from neomodel import db
+
+from graphutils.cache import embedding_cache_key
+from graphutils.config import EMBEDDING_MODEL, EMBEDDING_DIMENSIONS, EMBEDDING_DB_CHUNK_SIZE
+
+SNAPSHOT_VERSION = 1
+SNAPSHOT_HEADER = 'header.json'
+SNAPSHOT_FETCH_SIZE = EMBEDDING_DB_CHUNK_SIZE * 10  # rows fetched from neo4j per query during export
+
+
+def _file(path, label, name):
+    return os.path.join(path, f'{label}.{name}')
+
+
+def _replace(tmp_path):
+    os.replace(tmp_path, tmp_path[:-len('.tmp')])
+
+
+def export_label(path, label, embedding_label):
+    """
+    Writes the embeddings of one ontology label to the snapshot directory. Rows are paged from the database
+    straight into a memory-mapped file, so the export never holds all vectors as python lists.
+
+    Args:
+        path (str): The snapshot directory.
+        label (str): The label of the ontology nodes, e.g. EMMOMatter.
+        embedding_label (str): The label of their embedding nodes, e.g. MatterEmbedding.
+
+    Returns:
+        int: The number of exported rows.
+    """
+    import numpy as np
+    from graphutils.embeddings import normalize_vectors
+
+    match = f'''
+        MATCH (n:{label})<-[:FOR]-(emb:{embedding_label})
+        WHERE COALESCE(n.disable_embedding, false)=false AND size(emb.vector) = $dimensions
+    '''
+    params = {'dimensions': EMBEDDING_DIMENSIONS}
+    total = db.cypher_query(f'{match} RETURN count(emb)', params)[0][0][0]
+
+    vectors = np.lib.format.open_memmap(_file(path, label, 'vectors.npy.tmp'), mode='w+', dtype=np.float32,
+                                        shape=(total, EMBEDDING_DIMENSIONS))
+    ids, embedding_uids, offsets = [], [], [0]
+    with open(_file(path, label, 'inputs.bin.tmp'), 'wb') as inputs:
+        for skip in range(0, total, SNAPSHOT_FETCH_SIZE):
+            rows, _ = db.cypher_query(f'''
+                {match}
+                RETURN n.uid, emb.uid, emb.input, emb.vector
+                ORDER BY emb.uid, n.uid
+                SKIP $skip LIMIT $limit
+            ''', {**params, 'skip': skip, 'limit': SNAPSHOT_FETCH_SIZE})
+            # rows stored while exporting can shift the pages, never write beyond the counted size
+            rows = rows[:total - len(ids)]
+            if not rows:
+                break
+            vectors[len(ids):len(ids) + len(rows)] = normalize_vectors([row[3] for row in rows])
+            for uid, embedding_uid, input_string, _ in rows:
+                encoded = (input_string or '').encode('utf-8')
+                inputs.write(encoded)
+                offsets.append(offsets[-1] + len(encoded))
+                ids.append(uid)
+                embedding_uids.append(embedding_uid)
+    vectors.flush()
+    del vectors
+
+    # np.save appends .npy to names that do not end with it, so the temporary names are built around it
+    np.save(_file(path, label, 'ids.tmp.npy'), np.array(ids, dtype=str))
+    np.save(_file(path, label, 'embedding_uids.tmp.npy'), np.array(embedding_uids, dtype=str))
+    np.save(_file(path, label, 'input_offsets.tmp.npy'), np.array(offsets, dtype=np.int64))
+    for name in ['ids', 'embedding_uids', 'input_offsets']:
+        os.replace(_file(path, label, f'{name}.tmp.npy'), _file(path, label, f'{name}.npy'))
+    _replace(_file(path, label, 'vectors.npy.tmp'))
+    _replace(_file(path, label, 'inputs.bin.tmp'))
+    return len(ids)
+
+
+def export_embedding_snapshot(path, labels):
+    """
+    Writes a snapshot of all embeddings of the given labels. The header is written last, so readers never see
+    a header that points at incomplete files.
+
+    Args:
+        path (str): The snapshot directory, created if it does not exist.
+        labels (dict): Embedding label keyed by ontology label, e.g. {'EMMOMatter': 'MatterEmbedding'}.
+
+    Returns:
+        dict: The written header.
+    """
+    os.makedirs(path, exist_ok=True)
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'embedding_model': EMBEDDING_MODEL,
+        'dimensions': EMBEDDING_DIMENSIONS,
+        'created': time.time(),
+        'labels': {},
+    }
+    for label, embedding_label in labels.items():
+        logging.info(f'Exporting embeddings for label {label}')
+        count = export_label(path, label, embedding_label)
+        header['labels'][label] = {'embedding_label': embedding_label, 'count': count}
+
+    with open(os.path.join(path, SNAPSHOT_HEADER + '.tmp'), 'w') as f:
+        json.dump(header, f, indent=2)
+    _replace(os.path.join(path, SNAPSHOT_HEADER + '.tmp'))
+    return header
+
+
+def read_header(path):
+    with open(os.path.join(path, SNAPSHOT_HEADER)) as f:
+        return json.load(f)
+
+
+class EmbeddingSnapshot:
+    """
+    Read-only, memory-mapped view of the embeddings of one label in a snapshot.
+
+    Attributes:
+        label (str): The ontology label.
+        embedding_label (str): The label of the embedding nodes.
+        vectors (np.memmap): Normalized float32 matrix, one row per embedding.
+        ids (list): Uid of the ontology node of every row.
+        embedding_uids (list): Uid of the embedding node of every row.
+    """
+
+    def __init__(self, path, label):
+        """
+        Opens the snapshot of a label.
+
+        Args:
+            path (str): The snapshot directory.
+            label (str): The ontology label.
+
+        Raises:
+            ValueError: If the snapshot was created with another embedding model or format, or lacks the label.
+        """
+        import numpy as np
+
+        header = read_header(path)
+        if header['version'] != SNAPSHOT_VERSION:
+            raise ValueError(f'unsupported snapshot version {header["version"]}')
+        if header['embedding_model'] != EMBEDDING_MODEL or header['dimensions'] != EMBEDDING_DIMENSIONS:
+            raise ValueError(f'snapshot was created with {header["embedding_model"]} ({header["dimensions"]} dimensions)')
+        if label not in header['labels']:
+            raise ValueError(f'snapshot contains no embeddings for {label}')
+
+        count = header['labels'][label]['count']
+        self.label = label
+        self.embedding_label = header['labels'][label]['embedding_label']
+        self.vectors = np.load(_file(path, label, 'vectors.npy'), mmap_mode='r')[:count]
+        self.ids = np.load(_file(path, label, 'ids.npy')).tolist()[:count]
+        self.embedding_uids = np.load(_file(path, label, 'embedding_uids.npy')).tolist()[:count]
+        self._offsets = np.load(_file(path, label, 'input_offsets.npy'), mmap_mode='r')
+        self._inputs = np.memmap(_file(path, label, 'inputs.bin'), dtype=np.uint8, mode='r') \
+            if self._offsets[-1] else np.zeros(0, dtype=np.uint8)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def input(self, i):
+        """
+        Returns the input string of row i, decoded from the string table on demand.
+        """
+        return bytes(self._inputs[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+    def rows(self, start=0, stop=None):
+        """
+        Yields rows of (node uid, embedding uid, input, vector) in the order of the snapshot.
+        """
+        for i in range(start, len(self) if stop is None else stop):
+            yield self.ids[i], self.embedding_uids[i], self.input(i), self.vectors[i]
+
+
+def import_embedding_snapshot(path, labels=None):
+    """
+    Restores the embeddings of a snapshot into the database, e.g. to seed a fresh database without requesting
+    the embeddings again. Embedding nodes are merged on the hash of (embedding model, input) like every other
+    ingest, so restored and later ingested embeddings share one node per input, and are connected to the ontology
+    node with the stored uid; rows whose ontology node does not exist are skipped. The restored vectors are the
+    normalized float32 rows of the snapshot; for the unit length vectors of the OpenAI models these equal the
+    originals up to float32 precision.
+
+    Args:
+        path (str): The snapshot directory.
+        labels (list): The ontology labels to import, defaults to all labels of the snapshot.
+
+    Returns:
+        dict: The number of imported rows per label.
+    """
+    header = read_header(path)
+    imported = {}
+    for label in labels or header['labels']:
+        snapshot = EmbeddingSnapshot(path, label)
+        query = f'''
+            UNWIND $rows as row
+            MATCH (n:{label} {{uid: row[0]}})
+            MERGE (emb:{snapshot.embedding_label}:ModelEmbedding {{input_hash: row[4]}})
+            ON CREATE SET emb.uid = row[1], emb.input = row[2], emb.vector = row[3],
+                emb.embedding_model = $embedding_model
+            MERGE (emb)-[:FOR]->(n)
+        '''
+        for start in range(0, len(snapshot), EMBEDDING_DB_CHUNK_SIZE):
+            stop = min(start + EMBEDDING_DB_CHUNK_SIZE, len(snapshot))
+            db.cypher_query(query, {'embedding_model': EMBEDDING_MODEL, 'rows': [
+                [uid, embedding_uid, input_string, vector.tolist(), embedding_cache_key(EMBEDDING_MODEL, input_string)]
+                for uid, embedding_uid, input_string, vector in snapshot.rows(start, stop)
+            ]})
+        imported[label] = len(snapshot)
+    return imported
@@ -0,0 +1,219 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import types
+from unittest import mock
+
+import httpx
+import numpy as np
+from django.test import SimpleTestCase
+from openai import RateLimitError
+
+from graphutils import embeddingpool, embeddings, models
+from graphutils.cache import EmbeddingCache
+from graphutils.config import EMBEDDING_DIMENSIONS
+
+
+def fake_vector(text):
+    return [float(len(text)), float(sum(map(ord, text)))]
+
+
+def embedding_response(texts):
+    # the API does not guarantee the order of the items, reversing them checks that the index is used
+    return types.SimpleNamespace(data=[
+        types.SimpleNamespace(index=i, embedding=fake_vector(text)) for i, text in reversed(list(enumerate(texts)))
+    ])
+
+
+class FakeEmbeddingClient:
+    """
+    Synchronous stand-in for the OpenAI client that records the requested batches and fails the first request
+    of every batch containing one of the `fail_once` texts.
+    """
+
+    def __init__(self, fail_once=()):
+        self.requests = []
+        self.fail_once = set(fail_once)
+        self.embeddings = self
+
+    def create(self, input, model, user):
+        self.requests.append(list(input))
+        failing = self.fail_once & set(input)
+        if failing:
+            self.fail_once -= failing
+            raise ConnectionError('connection reset')
+        return embedding_response(input)
+
+
+class RequestEmbeddingsTest(SimpleTestCase):
+
+    def setUp(self):
+        patches = [
+            mock.patch.object(embeddings, 'get_embedding_cache', return_value=None),
+            mock.patch.object(embeddings._request_embedding_batch.retry, 'sleep', lambda seconds: None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_batches_keep_order_deduplicate_and_retry_failed_batch(self):
+        texts = ['steel', 'copper\n', 'aluminium', 'steel', 'brass', 'bronze', 'copper']
+        client = FakeEmbeddingClient(fail_once=['brass'])
+
+        vectors = embeddings.request_embeddings(texts, max_batch_size=2, embedding_client=client)
+
+        self.assertEqual(vectors, [fake_vector(embeddings._clean_text(text)) for text in texts])
+        self.assertEqual(client.requests, [
+            ['steel', 'copper'],
+            ['aluminium', 'brass'],
+            ['aluminium', 'brass'],
+            ['bronze'],
+        ])
+
+
+class FakeAsyncEmbeddingClient:
+    """
+    Asynchronous stand-in for the AsyncOpenAI client that answers the first `rate_limited` requests with 429 and
+    records the requested batches and the concurrency limit of the pool at every request.
+    """
+
+    def __init__(self, rate_limited=0):
+        self.rate_limited = rate_limited
+        self.requests = []
+        self.limits = []
+        self.pool = None
+        self.embeddings = self
+
+    async def create(self, input, model, user):
+        self.requests.append(list(input))
+        if self.pool is not None:
+            self.limits.append(self.pool.concurrency.limit)
+        if len(self.requests) <= self.rate_limited:
+            response = httpx.Response(429, headers={'retry-after': '0'}, request=httpx.Request('POST', 'http://api'))
+            raise RateLimitError('rate limited', response=response, body=None)
+        # later batches finish first, so the result order has to come from the batch order
+        await asyncio.sleep(0.001 * (10 - len(input[0]) % 10))
+        return embedding_response(input)
+
+
+class AsyncEmbeddingPoolTest(SimpleTestCase):
+
+    def setUp(self):
+        path = os.path.join(tempfile.mkdtemp(), 'embedding_cache.sqlite3')
+        self.cache = EmbeddingCache(path=path)
+        patch = mock.patch.object(embeddings, 'get_embedding_cache', return_value=self.cache)
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_rate_limits_shrink_and_successes_grow_concurrency(self):
+        texts = [f'material {i}' for i in range(24)]
+        client = FakeAsyncEmbeddingClient(rate_limited=2)
+
+        async def run():
+            client.pool = embeddingpool.AsyncEmbeddingPool(max_concurrency=4, max_batch_size=1,
+                                                           embedding_client=client)
+            return await client.pool.embed(texts)
+
+        vectors = asyncio.run(run())
+
+        self.assertEqual(vectors, [fake_vector(text) for text in texts])
+        # the 429s halved the limit for the following requests, the successes raised it back to the maximum
+        self.assertLess(min(client.limits), 4)
+        self.assertEqual(client.pool.concurrency.limit, 4)
+
+    def test_cached_inputs_are_not_requested(self):
+        self.cache.set_many(embeddings.EMBEDDING_MODEL, {'steel': [0.5], 'brass': [0.25]})
+        client = FakeAsyncEmbeddingClient()
+
+        vectors = embeddingpool.request_embeddings_concurrently(
+            ['steel', 'copper', 'brass', 'copper', 'bronze'], embedding_client=client
+        )
+
+        self.assertEqual(vectors, [[0.5], fake_vector('copper'), [0.25], fake_vector('copper'), fake_vector('bronze')])
+        self.assertEqual(sorted(text for batch in client.requests for text in batch), ['bronze', 'copper'])
+        self.assertEqual(self.cache.get(embeddings.EMBEDDING_MODEL, 'bronze'), fake_vector('bronze'))
+
+
+def unit_vector(axis):
+    vector = np.zeros(EMBEDDING_DIMENSIONS)
+    vector[axis] = 1
+    return vector.tolist()
+
+
+class FakeEmbeddingGraph:
+    """
+    In-memory stand-in for the queries of EmbeddingSearch: (node id, embedding uid) pairs with the input, vector
+    and update time of their embedding.
+    """
+
+    def __init__(self):
+        self.pairs = {}
+
+    def cypher_query(self, query, params=None):
+        if 'apoc.util.md5' in query:
+            pairs_hash = hashlib.md5(repr(sorted(self.pairs)).encode()).hexdigest()
+            updated = max((pair[2] for pair in self.pairs.values() if pair[2] is not None), default=0)
+            return [[len(self.pairs), pairs_hash, updated]], None
+        exclude = {tuple(pair) for pair in params['exclude_pairs']}
+        since = params['updated_since']
+        return [
+            [uid, embedding_uid, text, vector]
+            for (uid, embedding_uid), (text, vector, updated) in sorted(self.pairs.items())
+            if (uid, embedding_uid) not in exclude or (since is not None and updated is not None and updated > since)
+        ], None
+
+
+class EmbeddingSearchRefreshTest(SimpleTestCase):
+
+    def setUp(self):
+        self.graph = FakeEmbeddingGraph()
+        self.graph.pairs = {
+            ('a', 'emb-a'): ('a', unit_vector(0), None),
+            ('b', 'emb-b'): ('b', unit_vector(1), None),
+        }
+        patch = mock.patch.object(embeddings, 'db', self.graph)
+        patch.start()
+        self.addCleanup(patch.stop)
+        self.search = embeddings.EmbeddingSearch(types.SimpleNamespace(__label__='EMMOMatter'))
+
+    def test_refresh_picks_up_updated_vector(self):
+        self.graph.pairs[('a', 'emb-a')] = ('a', unit_vector(2), 1.0)
+        self.search.refresh(force=True)
+
+        self.assertEqual(self.search.search(unit_vector(2), n=1)[0][:2], ('a', 1.0))
+
+    def test_refresh_drops_pair_removed_together_with_insert(self):
+        del self.graph.pairs[('b', 'emb-b')]
+        self.graph.pairs[('c', 'emb-c')] = ('c', unit_vector(1), None)
+        self.search.refresh(force=True)
+
+        self.assertEqual(sorted(self.search.model_ids), ['a', 'c'])
+        self.assertEqual(self.search.search(unit_vector(1), n=1)[0][0], 'c')
+
+
+class EmbeddingSearchFallbackTest(SimpleTestCase):
+
+    def setUp(self):
+        self.nodes = models.EmbeddingNodeSet.__new__(models.EmbeddingNodeSet)
+        self.nodes.source_class = types.SimpleNamespace(__label__='EMMOMatter', embedding='matter_embeddings')
+        patch = mock.patch.object(models, 'EMBEDDING_SEARCH_ENGINE', 'faiss')
+        patch.start()
+        self.addCleanup(patch.stop)
+
+    def test_unavailable_index_falls_back_to_vector_index_with_limit(self):
+        unavailable = embeddings.EmbeddingIndexUnavailable('no embeddings found for EMMOMatter')
+        with mock.patch.object(models, 'get_embedding_search', side_effect=unavailable), \
+                mock.patch.object(models.db, 'cypher_query', return_value=([], None)) as cypher_query:
+            self.assertEqual(self.nodes._get_by_embeddings([[1.0]], limit=200), [[]])
+
+        self.assertEqual(cypher_query.call_args.args[1]['limit'], 200)
+
+    def test_search_errors_are_not_hidden_by_the_fallback(self):
+        search = mock.Mock(search_many=mock.Mock(side_effect=KeyError('uid')))
+        with mock.patch.object(models, 'get_embedding_search', return_value=search), \
+                mock.patch.object(models.db, 'cypher_query') as cypher_query:
+            with self.assertRaises(KeyError):
+                self.nodes._get_by_embeddings([[1.0]])
+
+        cypher_query.assert_not_called()
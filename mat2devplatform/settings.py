@@ -67,6 +67,7 @@ INSTALLED_APPS = [
     'archivist',
     'matgraph',
     'graphutils',
+    'ontologymanagement',
     'colorfield',
     'corsheaders',
     'usermanagement',
@@ -122,6 +123,7 @@ CORS_ALLOWED_ORIGINS = [
     'http://localhost:3000',
     'https://matgraph.xyz'
 ]
+CORS_EXPOSE_HEADERS = ['X-Next-Cursor']
 ROOT_URLCONF = 'mat2devplatform.urls'
 # OpenAI API Key
 TEMPLATES = [
@@ -1,7 +1,15 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_save, post_delete
 
 
 class MatchingConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'matching'
     verbose_name = "Matching"
+
+    def ready(self):
+        from matching.matcher import invalidate_node_write
+
+        # django_neomodel sends these signals for node writes, cached matching results of their labels are dropped
+        post_save.connect(invalidate_node_write, dispatch_uid='matching_invalidate_save')
+        post_delete.connect(invalidate_node_write, dispatch_uid='matching_invalidate_delete')
@@ -1,5 +1,9 @@
+import base64
+import hashlib
+import json
 import os
 
+import numpy as np
 import pandas as pd
 from dotenv import load_dotenv
 
@@ -11,9 +15,8 @@ def create_table_structure(data):
 
     # Check if combinations list is empty
     if len(combinations) == 0:
-        # Create a DataFrame with the message and save it to a CSV file
+        # Create a DataFrame with the message
         no_data_df = pd.DataFrame({"Message": ["No workflows found for your query"]})
-        no_data_df.to_csv('output_filename.csv', index=False)
         print("No workflows found for your query.")
         return no_data_df
 
@@ -39,31 +42,39 @@ def create_table_structure(data):
     df_attributes = df_attributes_raw.drop_duplicates(subset=['UID', 'Attribute'])
 
     # Pivot the attributes dataframe
-    df_pivoted = df_attributes.pivot(index='UID', columns='Attribute', values='Value').reset_index()
-    df_pivoted['UID'] = df_pivoted['UID'].fillna('N/A')
-    df_combinations = df_combinations.fillna('N/A')
-
-    # Iteratively merge with the combinations dataframe on each UID
-    for i, column in enumerate(columns):
-        merged = pd.merge(df_combinations, df_pivoted, how='left', left_on=column, right_on='UID', suffixes=('', f'_y{i+1}'))
-        # Drop the unnecessary UID column (which came from df_pivoted)
-        merged.drop('UID', axis=1, inplace=True)
-        df_combinations = merged
+    df_pivoted = df_attributes.pivot(index='UID', columns='Attribute', values='Value')
+    df_combinations = df_combinations.reset_index(drop=True)
+
+    # Look up the attributes of all columns at once and build the wide block in a single array
+    attribute_names = list(df_pivoted.columns)
+    values = np.vstack([df_pivoted.to_numpy(dtype=object), np.full((1, len(attribute_names)), np.nan, dtype=object)])
+    positions = df_pivoted.index.get_indexer(df_combinations[columns].to_numpy().ravel())
+    block = values[positions].reshape(len(df_combinations), len(columns) * len(attribute_names))
+
+    # Attributes that repeat for a later column are suffixed with its position, e.g. density_y2
+    block_columns, seen = [], set(columns)
+    for i in range(len(columns)):
+        for name in attribute_names:
+            block_columns.append(name if name not in seen else f'{name}_y{i+1}')
+        seen.update(block_columns[-len(attribute_names):])
 
     # Drop columns that have only NaNs
-    final_df = df_combinations.dropna(axis=1, how='all')
+    keep = ~pd.isna(block).all(axis=0)
+    df_block = pd.DataFrame(block[:, keep], columns=[name for name, kept in zip(block_columns, keep) if kept])
+    final_df = pd.concat([df_combinations, df_block], axis=1)
 
     # Drop all columns that contain the string 'UID'
     final_df = final_df[final_df.columns.drop(list(final_df.filter(regex='UID')))]
 
-    # Save the final DataFrame to a CSV file
-    final_df.to_csv('output_filename.csv', index=False)
-
     return final_df
 
 
 # TODO implement filtering for values!
 QUERY_BY_VALUE = """"""
+from neomodel import db
+
+from graphutils.cache import LRUCache
+from graphutils.embeddings import request_embeddings
 from matching.matcher import Matcher
 from matgraph.models.ontology import *
 
@@ -74,6 +85,11 @@ ONTOMAPPER = {"matter": "EMMOMatter",
               "parameter": "EMMOQuantity"
               }
 
+ONTOLOGY_MODELS = {"EMMOMatter": EMMOMatter,
+                   "EMMOProcess": EMMOProcess,
+                   "EMMOQuantity": EMMOQuantity
+                   }
+
 RELAMAPPER = {"IS_MANUFACTURING_INPUT": "IS_MANUFACTURING_INPUT|IS_MANUFACTURING_OUTPUT",
               "IS_MANUFACTURING_OUTPUT": "IS_MANUFACTURING_INPUT|IS_MANUFACTURING_OUTPUT",
               "HAS_PARAMETER": "HAS_PARAMETER",
@@ -101,48 +117,175 @@ RETURN = """
 $id as id
 """
 
+QUERY_TEMPLATE_CACHE_SIZE = 256  # query templates kept per process, keyed by workflow shape
+MAX_PATH_LENGTH = 8  # relationships per path between two workflow nodes
+MAX_PATHS_PER_EDGE = 100  # paths followed per workflow relationship and bound node
+STREAM_COLUMNS = ['workflow', 'position', 'name', 'attribute', 'value']
+WORKFLOW_PAGE_SIZE = 100  # combinations per page if the client requests pagination without a limit
+MAX_WORKFLOW_PAGE_SIZE = 1000  # largest page a client can request
+QUERY_TEMPLATES = LRUCache(QUERY_TEMPLATE_CACHE_SIZE)
+
+
+def encode_cursor(key):
+    return base64.urlsafe_b64encode(key.encode()).decode()
+
+
+def decode_cursor(cursor):
+    try:
+        return base64.b64decode(cursor.encode(), altchars=b'-_', validate=True).decode()
+    except ValueError:
+        raise ValueError(f'invalid cursor: {cursor}')
+
+
+def combination_key(combination):
+    """
+    Returns the sort key of a combination row: the sorted uids of its path nodes, which make up the first half of
+    the row. The order of the path nodes follows the join order, which depends on the live candidate counts, so
+    the key is built from the sorted uids to stay the same between page requests.
+    """
+    return ','.join(sorted(combination[:len(combination) // 2]))
+
+
+class WorkflowPaginator:
+    """
+    Keyset pagination of workflow combinations. Combinations are ordered by the sorted uids of their path nodes
+    (see `combination_key`) and a page starts after the last combination of the previous page, so pages are
+    stable and deep pages cost no more than the first one.
+
+    limit: The number of combinations per page.
+    start: The key of the last combination of the previous page, None for the first page.
+    """
+
+    def __init__(self, limit=WORKFLOW_PAGE_SIZE, cursor=None):
+        if not 0 < limit <= MAX_WORKFLOW_PAGE_SIZE:
+            raise ValueError(f'invalid limit: {limit}, must be between 1 and {MAX_WORKFLOW_PAGE_SIZE}')
+        self.limit = limit
+        self.start = decode_cursor(cursor) if cursor else None
+
+    def build_query_fragment(self):
+        return """
+        WITH pathNodes, apoc.text.join(apoc.coll.sort([x IN pathNodes | x.uid]), ',') AS cursor
+        WHERE $after IS NULL OR cursor > $after
+        WITH cursor, head(collect(pathNodes)) AS pathNodes
+        ORDER BY cursor
+        LIMIT $page_limit
+        """
+
+    def build_params(self):
+        return {'after': self.start, 'page_limit': self.limit}
+
+    def next_cursor(self, combinations):
+        """
+        Returns the cursor of the page following the given combinations, None if this page was the last one.
+        """
+        if len(combinations) < self.limit:
+            return None
+        return encode_cursor(max(combination_key(combination) for combination in combinations))
+
 class FabricationWorkflowMatcher(Matcher):
 
+    type = 'fabrication_workflow'
+    cache_labels = ('Matter', 'Process', 'Property', 'Parameter', 'EMMOMatter', 'EMMOProcess', 'EMMOQuantity')
 
     def __init__(self, workflow_list, count=False, **kwargs):
         print(workflow_list)
         self.query_list = [
-            {
-                **node,
-                'uid': EMMOMatter.nodes.get_by_string(string = node['attributes']['name']['value'], limit = 10)[0].uid if ONTOMAPPER[node['label']] == 'EMMOMatter' else
-                EMMOProcess.nodes.get_by_string(string = node['attributes']['name']['value'], limit = 10)[0].uid if ONTOMAPPER[node['label']] == 'EMMOProcess' else
-                EMMOQuantity.nodes.get_by_string(string = node['attributes']['name']['value'], limit = 10)[0].uid if ONTOMAPPER[node['label']] == 'EMMOQuantity' else 'nope'
-            }
-            for node in workflow_list['nodes']
+            {**node, 'uid': uid}
+            for node, uid in zip(workflow_list['nodes'], self._resolve_ontology_uids(workflow_list['nodes']))
         ]
         self.relationships = workflow_list['relationships']
+        # nodes are referred to by their position in the query, so the query does not depend on client ids
+        self.node_index = {node['id']: i for i, node in enumerate(self.query_list)}
         self.count = count
         super().__init__(**kwargs)
 
 
 
-    def _build_ontology_query(self, node):
-        node_id, label = node['id'], node['label']
-        return f"(onto_{node_id}: {ONTOMAPPER[label]} {{uid: '{node['uid']}'}})"
+    @staticmethod
+    def _resolve_ontology_uids(nodes):
+        """
+        Finds the closest ontology class for the name of every node. All names are embedded in one batch and
+        the classes of each ontology label are resolved with one vector search.
+        """
+        vectors = request_embeddings([node['attributes']['name']['value'] for node in nodes])
+        uids = ['nope'] * len(nodes)
+        for label, Model in ONTOLOGY_MODELS.items():
+            positions = [i for i, node in enumerate(nodes) if ONTOMAPPER[node['label']] == label]
+            if not positions:
+                continue
+            results = Model.nodes.get_by_embeddings([vectors[i] for i in positions], limit=10)
+            for i, result in zip(positions, results):
+                uids[i] = result[0].uid
+        return uids
+
+    @staticmethod
+    def _operator(node):
+        if node['label'].capitalize() in ('Property', 'Parameter'):
+            return OPERATOR_MAPPING[node['attributes']['value']['operator']]
+        return None
+
+    def shape_signature(self):
+        """
+        Returns everything the query text depends on: the label and value operator of every node and the
+        relationships between node positions. Workflows with the same signature share one query template.
+        """
+        nodes = tuple((node['label'], self._operator(node)) for node in self.query_list)
+        relationships = tuple(
+            (self.node_index[rel['connection'][0]], self.node_index[rel['connection'][1]], rel['rel_type'])
+            for rel in self.relationships
+        )
+        return nodes, relationships
+
+    def build_params(self):
+        """
+        Returns the values of the query template: the ontology uid of every node and the compared values.
+        """
+        params = {}
+        for i, node in enumerate(self.query_list):
+            params[f'uid_{i}'] = node['uid']
+            if self._operator(node):
+                params[f'value_{i}'] = node['attributes']['value']['value']
+        return params
+
+    def cache_key(self):
+        """
+        Returns a hash of the canonical workflow: the nodes with their resolved ontology uids and compared values
+        in sorted order and the relationships between the sorted positions, so resubmitted workflows hit the result
+        cache whatever their client ids and node order.
+        """
+        nodes = [
+            (node['label'], self._operator(node) or '', node['uid'],
+             str(node['attributes']['value']['value']) if self._operator(node) else '')
+            for node in self.query_list
+        ]
+        order = sorted(range(len(nodes)), key=lambda i: nodes[i])
+        position = {old: new for new, old in enumerate(order)}
+        relationships = sorted(
+            (position[source], position[target], RELAMAPPER[rel_type])
+            for source, target, rel_type in self.shape_signature()[1]
+        )
+        canonical = json.dumps([[nodes[i] for i in order], relationships, bool(self.count)])
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
+    def _build_ontology_query(self, node_id, label):
+        return f"(onto_{node_id}: {ONTOMAPPER[label]} {{uid: $uid_{node_id}}})"
 
     def _build_tree_query(self, node_id, label):
         return f"""CALL {{
         WITH onto_{node_id}
-        OPTIONAL MATCH (onto_{node_id})<-[:EMMO__IS_A*..]-(tree_onto_{node_id}:{ONTOMAPPER[label]})
+        OPTIONAL MATCH (onto_{node_id})<-[:EMMO__DESCENDANT_OF]-(tree_onto_{node_id}:{ONTOMAPPER[label]})
         RETURN collect(DISTINCT tree_onto_{node_id}) + collect(DISTINCT onto_{node_id}) AS combined_{node_id}
         }}
         """
 
-    def _build_find_nodes_query(self, node_id, label, attributes):
+    def _build_find_nodes_query(self, node_id, label, operator):
         label = label.capitalize()
         if label == 'Property' or label == 'Parameter':
-            value = attributes['value']['value']
-            operator = OPERATOR_MAPPING[attributes['value']['operator']]
             return f"""CALL {{
             WITH combined_{node_id}
             UNWIND combined_{node_id} AS full_onto_{node_id}
             MATCH (full_onto_{node_id})<-[:IS_A]-(node_{node_id}:{label})
-            WHERE toFloat(node_{node_id}.value) {operator} toFloat({value})
+            WHERE toFloat(node_{node_id}.value) {operator} toFloat($value_{node_id})
             RETURN collect(DISTINCT node_{node_id}) AS nodes_{node_id}
             }}
             """
@@ -154,93 +297,83 @@ class FabricationWorkflowMatcher(Matcher):
             }}
             """
 
-    def _build_path_queries(self):
-        path_queries = []
-        for i, rel in enumerate(self.relationships):
-            source, target = rel['connection']
-            rel_type = rel['rel_type']
-            path_queries.append(self._build_single_path_query(source, target, rel_type, i))
-        return path_queries
-
-    def _build_path_conditions(self, paths, uid_paths, xid_paths, relationships):
-        path_conditions = []
-        return_statements = []
-        idx_list = []
-
-        for idx, rel in enumerate(relationships):
-            idx_var = f"idx{idx}"
-            idx_list.append(idx_var)
-            source, target = rel['connection']
-            uid_path = f"uids_path_{source}_{target}"
-            path = f"path_{source}_{target}"
-            return_statements.append(f"nodes({path}[idx[{idx}]])")
-
-            # Generate path conditions by comparing this relationship to all others
-            for idx2, rel2 in enumerate(relationships):
-                if idx == idx2:
-                    continue  # Avoid self-comparison
-                source2, target2 = rel2['connection']
-                uid_path2 = f"uids_path_{source2}_{target2}"
-
-                # Construct condition strings based on source and target matches
-                if source == source2:
-                    path_conditions.append(f"{uid_path}[{idx_var}][0] = {uid_path2}[idx{idx2}][0]")
-                if target == target2:
-                    path_conditions.append(f"{uid_path}[{idx_var}][-1] = {uid_path2}[idx{idx2}][-1]")
-                if source == target2:
-                    path_conditions.append(f"{uid_path}[{idx_var}][0] = {uid_path2}[idx{idx2}][-1]")
-
-        path_condition = " AND ".join(path_conditions)
-
-        # Constructing the Cypher query with cleaner formatting
-        path_connector = f"""CALL {{
-                WITH {', '.join(uid_paths)}
-                {' '.join([f"UNWIND range(0, size({uid_path})-1) AS idx{i}" for i, uid_path in enumerate(uid_paths)])}
-                WITH *
-                WHERE {path_condition}
-                RETURN collect(DISTINCT [{', '.join(idx_list)}]) AS idxs
-            }}
-    
-            CALL {{
-                WITH idxs, {', '.join(paths)}
-                UNWIND idxs AS idx
-                RETURN apoc.coll.toSet(apoc.coll.flatten([{', '.join(return_statements)}])) AS pathNodes
-            }}
-            """
-        return path_connector
-    def _build_single_path_query(self, source, target, rel_type, index):
-        path = f"path_{source}_{target}"
-        uid_path = f"uids_path_{source}_{target}"
+    @staticmethod
+    def join_order(counts, relationships):
+        """
+        Orders the search of a workflow: every connected part starts at its node with the fewest candidates and
+        grows along relationships. Relationships between two bound nodes come first, since they only filter;
+        otherwise the relationship that binds the node with the fewest candidates is taken next.
+
+        :param counts: The number of candidate nodes per node position
+        :param relationships: (source, target, rel_type) per relationship, as in the shape signature
+        :return: Tuple of steps, ('start', node) or ('edge', relationship index)
+        """
+        steps, bound, remaining = [], set(), list(range(len(relationships)))
+        while len(bound) < len(counts):
+            start = min((i for i in range(len(counts)) if i not in bound), key=lambda i: (counts[i], i))
+            steps.append(('start', start))
+            bound.add(start)
+            while True:
+                connected = [e for e in remaining
+                             if relationships[e][0] in bound or relationships[e][1] in bound]
+                if not connected:
+                    break
+
+                def cost(e):
+                    new = [n for n in relationships[e][:2] if n not in bound]
+                    return (len(new), counts[new[0]] if new else 0, e)
+
+                edge = min(connected, key=cost)
+                steps.append(('edge', edge))
+                bound.update(relationships[edge][:2])
+                remaining.remove(edge)
+        return tuple(steps)
+
+    def _build_edge_query(self, index, source, target, rel_type, bound):
+        """
+        Extends the bound nodes along one relationship. At most $max_paths paths of at most MAX_PATH_LENGTH
+        relationships are followed per bound row, which keeps the enumeration of long manufacturing chains bounded.
+        """
+        path = f"path_{index}"
+        pattern = f"{path} = (node_{source})-[:{RELAMAPPER[rel_type]}*..{MAX_PATH_LENGTH}]->(node_{target})"
+        if source in bound and target in bound:
+            imports, condition, returns = [f"node_{source}", f"node_{target}"], "", path
+        else:
+            new = target if source in bound else source
+            old = source if new == target else target
+            imports = [f"node_{old}", f"nodes_{new}"]
+            condition = f"WHERE node_{new} IN nodes_{new}"
+            returns = f"{path}, node_{new}"
         return f"""
         CALL {{
-        WITH nodes_{source}, nodes_{target}
-        UNWIND nodes_{source} AS node_{source}
-        UNWIND nodes_{target} AS node_{target}
-        MATCH {path} = (node_{source})-[:{RELAMAPPER[rel_type]}*..8]->(node_{target})
-        WITH collect(DISTINCT {path}) AS {path}
-        RETURN {path}, [path IN {path} | [nodes(path)[0].uid, nodes(path)[-1].uid]] AS {uid_path}
+        WITH {', '.join(imports)}
+        MATCH {pattern}
+        {condition}
+        RETURN {returns}
+        LIMIT $max_paths
         }}
         """
-    def _build_path_queries_and_conditions(self):
-        paths, uid_paths, xid_paths, path_combinations = [], [], [], []
-        path_queries = []
-
-        for i, rel in enumerate(self.relationships):
-            source, target = rel['connection']
-            rel_type = rel['rel_type']
-            path = f"path_{source}_{target}"
-            uid_path = f"uids_path_{source}_{target}"
-            xid_path = f"idx_uids_path_{source}_{target}"
 
-            paths.append(path)
-            uid_paths.append(uid_path)
-            xid_paths.append(xid_path)
-            path_combinations.append(f"nodes({path})[idx{i}]")
-
-            path_queries.append(self._build_single_path_query(source, target, rel_type, i))
-
-        path_connector = self._build_path_conditions(paths, uid_paths, xid_paths, self.relationships)
-        return "\n".join(path_queries) + "\n" + path_connector
+    def _build_join_query(self, relationships, order):
+        """
+        Builds the search for workflow combinations in the given join order. Every row binds one candidate node
+        per workflow node and one path per relationship, so shared endpoints are enforced while extending
+        instead of by comparing all collected paths afterwards.
+        """
+        parts, bound, path_nodes = [], set(), []
+        for step, index in order:
+            if step == 'start':
+                parts.append(f"UNWIND nodes_{index} AS node_{index}")
+                if not any(index in rel[:2] for rel in relationships):
+                    path_nodes.append(f"[node_{index}]")
+                bound.add(index)
+            else:
+                source, target, rel_type = relationships[index]
+                parts.append(self._build_edge_query(index, source, target, rel_type, bound))
+                bound.update((source, target))
+                path_nodes.append(f"nodes(path_{index})")
+        parts.append(f"WITH apoc.coll.toSet(apoc.coll.flatten([{', '.join(path_nodes)}])) AS pathNodes")
+        return "\n".join(parts)
 
     def _build_results(self):
         return f"""
@@ -262,33 +395,125 @@ class FabricationWorkflowMatcher(Matcher):
 
         # Assuming _build_single_path_query remains unchanged
 
-    def build_query(self):
-        ontology_queries = [self._build_ontology_query(node) for node in self.query_list]
-        tree_queries = [self._build_tree_query(node['id'], node['label']) for node in self.query_list]
-        find_nodes_queries = [self._build_find_nodes_query(node['id'], node['label'], node['attributes']) for node in self.query_list]
-        path_queries_and_conditions = self._build_path_queries_and_conditions()
-        prepare_results = self._build_results()
+    def _build_rows(self):
+        """
+        Returns one row per combination instead of aggregating all combinations, so the rows can be streamed.
+        Every row lists the path nodes as [uid, ontology name, [[value, attribute], ...]].
+        """
+        return """
+        WITH DISTINCT pathNodes
+        RETURN [x IN pathNodes | [
+            x.uid,
+            head([(x)-[:IS_A]->(neighbor) | neighbor.name]),
+            [(onto)<-[:IS_A]-(x)-[:HAS_PROPERTY]->(property:Property)-[:IS_A]->(:EMMOQuantity)
+                WHERE x:Matter | [property.value, onto.name + "_" + property.name]] +
+            [(onto)<-[:IS_A]-(x)-[:HAS_PARAMETER]->(parameter:Parameter)-[:IS_A]->(parameter_label:EMMOQuantity)
+                WHERE x:Process | [parameter.value, onto.name + "_" + parameter_label.name]]
+        ]] AS nodes
+        """
+
+    def _build_candidates_query(self, nodes):
+        ontology_queries = [self._build_ontology_query(i, label) for i, (label, _) in enumerate(nodes)]
+        tree_queries = [self._build_tree_query(i, label) for i, (label, _) in enumerate(nodes)]
+        find_nodes_queries = [self._build_find_nodes_query(i, label, operator) for i, (label, operator) in enumerate(nodes)]
+        return f"""MATCH {", ".join(ontology_queries)} 
+        {" ".join(tree_queries + find_nodes_queries)}
+        """
 
-        # Combining all parts into a single query
-        final_query = f"""MATCH {", ".join(ontology_queries)} 
-        {" ".join(tree_queries + find_nodes_queries + [path_queries_and_conditions] + [prepare_results])}
+    def build_count_template(self, signature):
         """
-        print(final_query)
-        return final_query, {}
+        Builds the query returning the number of candidate nodes of every workflow node, used to plan the search.
+        """
+        nodes, _ = signature
+        return self._build_candidates_query(nodes) + \
+            f"RETURN [{', '.join(f'size(nodes_{i})' for i in range(len(nodes)))}] AS counts"
 
+    def _build_count(self):
+        """
+        Returns the number of distinct combinations without collecting their nodes and attributes. Combinations
+        are counted by the sorted uids of their path nodes, the key of `WorkflowPaginator` and `combination_key`,
+        so the same nodes joined in a different order are counted once.
+        """
+        return """
+        RETURN count(DISTINCT apoc.text.join(apoc.coll.sort([x IN pathNodes | x.uid]), ',')) AS workflows
+        """
 
+    def build_query_template(self, signature, order, output='table'):
+        """
+        Builds the query text of a workflow shape and join order. Nodes are named by position and all values
+        are parameters, so Neo4j can reuse the plan of the template for every workflow with this shape.
 
+        :param output: 'table' for the aggregated combinations and attributes (see `_build_results`), 'rows' for
+            one row per combination (see `_build_rows`) or 'count' for the number of combinations
+        """
+        nodes, relationships = signature
+        query = self._build_candidates_query(nodes) + self._build_join_query(relationships, order)
+        if output == 'count':
+            return query + self._build_count()
+        return query + "\n$pagination\n" + (self._build_rows() if output == 'rows' else self._build_results())
+
+    def _cached_template(self, key, build):
+        template = QUERY_TEMPLATES.get_many([key]).get(key)
+        if template is None:
+            template = build()
+            QUERY_TEMPLATES.set_many({key: template})
+        return template
+
+    def build_query(self, rows=False):
+        """
+        Plans and builds the workflow query. The candidate nodes of every workflow node are counted first, so
+        the search starts at the most selective node; workflows without candidates for some node cannot match.
 
+        :param rows: Build the query returning one row per combination (see `_build_rows`); ignored in count mode
+        """
+        signature = self.shape_signature()
+        params = self.build_params()
+        count_query = self._cached_template(('counts', signature), lambda: self.build_count_template(signature))
+        results, _ = db.cypher_query(count_query, params)
+        counts = results[0][0] if results else [0] * len(signature[0])
+
+        order = self.join_order(counts, signature[1])
+        output = 'count' if self.count else 'rows' if rows else 'table'
+        final_query = self._cached_template(
+            ('query', signature, order, output), lambda: self.build_query_template(signature, order, output)
+        )
+        return final_query, {**params, 'max_paths': MAX_PATHS_PER_EDGE}
+
+    def build_stream_query(self):
+        return self.build_query(rows=True)
+
+    def stream_rows(self):
+        """
+        Yields the combinations in long CSV format (see STREAM_COLUMNS) as they arrive from the database:
+        one row per attribute of every node of every combination, or one row without attribute for nodes
+        without attributes.
+        """
+        for workflow, (nodes,) in enumerate(self.stream(), 1):
+            for position, (uid, name, attributes) in enumerate(nodes, 1):
+                if not attributes:
+                    yield [workflow, position, name, '', '']
+                for value, attribute in attributes:
+                    yield [workflow, position, name, attribute, value]
+
+    def next_cursor(self):
+        """
+        Returns the cursor of the next page after `run`, None without keyset pagination or on the last page.
+        """
+        if self.count or not isinstance(self.paginator, WorkflowPaginator):
+            return None
+        return self.paginator.next_cursor(self.db_result[0][0] if self.db_result else [])
 
     def build_result(self):
 
-        # if self.count:
-        #     return self.db_results[0][0]
+        if self.count:
+            return self.db_result[0][0] if self.db_result else 0
         return create_table_structure(self.db_result)
 
     def build_results_for_report(self):
+        if self.count:
+            return [[self.result]], ['workflows']
         # Dynamic extraction
-        result = create_table_structure(self.db_result)
+        result = self.result
         return result.values.tolist(), result.columns
 
 
@@ -0,0 +1,201 @@
+"""
+Background execution of workflow matching requests.
+
+A request is stored as a MatchingJob, so the request thread returns immediately with the job id and clients poll
+the job until its result is ready. The job rows are the queue: workers claim pending jobs atomically, so every job
+runs once however many web processes or run-matching-jobs commands are working on the table. A unique constraint
+on the pending and running jobs of a request attaches identical requests to the job in flight.
+
+Jobs are run by the run-matching-jobs command, so the web processes only queue them; for development, web
+processes can run them in MATCHING_JOB_LOCAL_WORKERS threads instead.
+
+Workers record a heartbeat while they run a job. Running jobs without a heartbeat for MATCHING_JOB_STALE_AFTER
+belong to a worker that died, e.g. in a restart, and are failed so that pollers stop waiting and the request can
+be submitted again. Pending jobs survive restarts and are claimed by the next worker.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import socket
+import threading
+import traceback
+from datetime import timedelta
+
+from django.db import connection, transaction, IntegrityError
+from django.utils import timezone
+
+from matching.fabricationworkflows import FabricationWorkflowMatcher
+from matching.models import MatchingJob
+
+# worker threads per web process for development, 0 leaves the jobs to the run-matching-jobs command
+MATCHING_JOB_LOCAL_WORKERS = int(os.getenv('MATCHING_JOB_LOCAL_WORKERS', 0))
+MATCHING_JOB_SUBMIT_ATTEMPTS = 3  # attempts to queue a request whose identical job keeps finishing in between
+MATCHING_JOB_HEARTBEAT_INTERVAL = 15  # seconds between heartbeats of a running job
+MATCHING_JOB_STALE_AFTER = timedelta(minutes=2)  # running jobs without heartbeat for longer are failed
+MATCHING_JOB_POLL_INTERVAL = 2  # seconds an idle worker waits before looking for pending jobs again
+
+_local_workers = []
+_local_workers_lock = threading.Lock()
+
+
+def request_key(request):
+    """
+    Hash of the canonical JSON of a request, equal for requests that differ only in key order or whitespace.
+    """
+    return hashlib.sha256(json.dumps(request, sort_keys=True, separators=(',', ':')).encode()).hexdigest()
+
+
+def worker_name():
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}'
+
+
+def fail_stale_jobs():
+    """
+    Fails the running jobs whose worker stopped sending heartbeats.
+
+    :return: The number of failed jobs
+    """
+    return MatchingJob.objects.filter(
+        status=MatchingJob.RUNNING,
+        heartbeat__lt=timezone.now() - MATCHING_JOB_STALE_AFTER
+    ).update(
+        status=MatchingJob.FAILED,
+        progress='',
+        error='the worker running the job stopped responding',
+        updated=timezone.now()
+    )
+
+
+def submit_workflow_job(workflow):
+    """
+    Queues the matching of a workflow, unless an identical workflow is already pending or running.
+
+    :param workflow: The parsed workflow graph, as passed to FabricationWorkflowMatcher
+    :return: Tuple of (job, created)
+    """
+    key = request_key(workflow)
+    fail_stale_jobs()
+    for attempt in range(MATCHING_JOB_SUBMIT_ATTEMPTS):
+        try:
+            with transaction.atomic():
+                job = MatchingJob.objects.create(key=key, type=FabricationWorkflowMatcher.type,
+                                                 request=json.dumps(workflow))
+        except IntegrityError:
+            # an identical request is in flight; it can finish in between, then the request is submitted again
+            job = MatchingJob.objects.filter(
+                key=key, type=FabricationWorkflowMatcher.type, status__in=MatchingJob.ACTIVE
+            ).first()
+            if job is not None:
+                return job, False
+            if attempt == MATCHING_JOB_SUBMIT_ATTEMPTS - 1:
+                raise
+            continue
+        start_local_workers()
+        return job, True
+
+
+def claim_job(worker):
+    """
+    Claims the oldest pending job for a worker. Rows locked by other workers are skipped, and the status is only
+    changed if the job is still pending, so a job is claimed by exactly one worker.
+
+    :return: The claimed job or None if no job is pending
+    """
+    with transaction.atomic():
+        job = MatchingJob.objects.select_for_update(skip_locked=True) \
+            .filter(status=MatchingJob.PENDING).order_by('created').first()
+        if job is None:
+            return None
+        now = timezone.now()
+        claimed = MatchingJob.objects.filter(pk=job.pk, status=MatchingJob.PENDING).update(
+            status=MatchingJob.RUNNING, worker=worker, heartbeat=now, updated=now
+        )
+    return MatchingJob.objects.get(pk=job.pk) if claimed else None
+
+
+def _update(job, **fields):
+    """
+    Updates a job only while it is still running on this worker, so a job that was failed as stale is not
+    overwritten by the worker that lost it.
+    """
+    now = timezone.now()
+    return MatchingJob.objects.filter(pk=job.pk, status=MatchingJob.RUNNING, worker=job.worker) \
+        .update(**fields, heartbeat=now, updated=now)
+
+
+def _heartbeat(job, stop):
+    try:
+        while not stop.wait(MATCHING_JOB_HEARTBEAT_INTERVAL):
+            _update(job)
+    finally:
+        connection.close()
+
+
+def run_workflow_job(job):
+    """
+    Runs a claimed job: matches the workflow, stores the report and the CSV result, or the error if it failed.
+    """
+    stop = threading.Event()
+    heartbeat = threading.Thread(target=_heartbeat, args=(job, stop), daemon=True)
+    heartbeat.start()
+    try:
+        _update(job, progress='resolving ontology classes')
+        matcher = FabricationWorkflowMatcher(json.loads(job.request), force_report=True)
+        _update(job, progress='matching workflows')
+        matcher.run()
+        _update(job, progress='building result table')
+        result = matcher.result.to_csv(index=False)
+        _update(job, status=MatchingJob.DONE, progress='', result=result)
+    except Exception:
+        _update(job, status=MatchingJob.FAILED, progress='', error=traceback.format_exc())
+    finally:
+        stop.set()
+        heartbeat.join()
+
+
+def work(worker=None, stop=None, once=False):
+    """
+    Claims and runs pending jobs until `stop` is set.
+
+    :param worker: The name recorded on claimed jobs, defaults to host, process and thread
+    :param stop: Event ending the loop
+    :param once: Return when no job is pending instead of waiting for new ones
+    """
+    worker = worker or worker_name()
+    stop = stop or threading.Event()
+    try:
+        while not stop.is_set():
+            try:
+                fail_stale_jobs()
+                job = claim_job(worker)
+                if job is not None:
+                    run_workflow_job(job)
+                    continue
+            except Exception:
+                # a database error must not end the worker; a job it interrupted is failed once its heartbeat is stale
+                logging.exception('Matching job worker failed')
+            if once:
+                return
+            # the connection is not needed while idle, and the thread is never part of a request cycle
+            connection.close()
+            stop.wait(MATCHING_JOB_POLL_INTERVAL)
+    finally:
+        connection.close()
+
+
+def start_local_workers():
+    """
+    Starts the MATCHING_JOB_LOCAL_WORKERS worker threads of this web process on first use, so jobs run without the
+    run-matching-jobs command during development.
+    """
+    with _local_workers_lock:
+        if _local_workers:
+            return
+        for i in range(MATCHING_JOB_LOCAL_WORKERS):
+            thread = threading.Thread(target=work, name=f'matching-job-{i}', daemon=True)
+            thread.start()
+            _local_workers.append(thread)
+        if _local_workers:
+            logging.info(f'Started {len(_local_workers)} matching job workers')
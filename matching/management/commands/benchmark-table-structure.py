@@ -0,0 +1,79 @@
+import time
+
+import numpy as np
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from matching.fabricationworkflows import create_table_structure
+
+
+def merge_table_structure(data):
+    """
+    The previous implementation of `create_table_structure`, which merges the pivoted attributes once per column.
+    Kept as the reference for the benchmark.
+    """
+    combinations, attributes = data[0][0], data[0][1]
+    half_len = max(map(len, combinations)) // 2
+    columns = [f'UID_{i+1}' for i in range(half_len)] + [f'name_{i+1}' for i in range(half_len)]
+
+    df_combinations = pd.DataFrame(combinations, columns=columns).fillna('N/A').drop_duplicates(subset=columns)
+    df_attributes = pd.DataFrame(attributes, columns=['UID', 'Value', 'Attribute']).fillna('N/A')
+    df_attributes = df_attributes.drop_duplicates(subset=['UID', 'Attribute'])
+    df_pivoted = df_attributes.pivot(index='UID', columns='Attribute', values='Value').reset_index()
+
+    for i, column in enumerate(columns):
+        merged = pd.merge(df_combinations, df_pivoted, how='left', left_on=column, right_on='UID', suffixes=('', f'_y{i+1}'))
+        merged.drop('UID', axis=1, inplace=True)
+        df_combinations = merged
+
+    final_df = df_combinations.dropna(axis=1, how='all')
+    return final_df[final_df.columns.drop(list(final_df.filter(regex='UID')))]
+
+
+def synthetic_workflows(rng, nodes, combinations, attributes_per_node):
+    """
+    Builds query results of `combinations` workflows with `nodes` nodes each. Every position draws its nodes from
+    a small pool of candidates of one ontology class, so attribute names repeat across workflows and positions.
+    """
+    pools = [[f'node-{position}-{j}' for j in range(10)] for position in range(nodes)]
+    rows = []
+    for _ in range(combinations):
+        uids = [pool[i] for pool, i in zip(pools, rng.integers(0, 10, nodes))]
+        rows.append(uids + [f'Class{position % 5}' for position in range(nodes)])
+    attributes = [
+        [uid, str(rng.random()), f'Class{position % 5}_attribute{k}']
+        for position, pool in enumerate(pools) for uid in pool for k in range(attributes_per_node)
+    ]
+    return [[rows, attributes]]
+
+
+def timed(function, data, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = function(data)
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, np.median(timings)
+
+
+class Command(BaseCommand):
+    help = 'Compare the single-pass table structure with the previous per-column merges on synthetic workflows'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--nodes', type=int, nargs='+', default=[5, 10, 20, 30, 40, 50],
+                            help='workflow sizes to benchmark')
+        parser.add_argument('--combinations', type=int, default=1000, help='matched workflows per size')
+        parser.add_argument('--attributes', type=int, default=3, help='attributes per node')
+        parser.add_argument('--repeat', type=int, default=3, help='runs per size, the median is reported')
+
+    def handle(self, *args, **options):
+        rng = np.random.default_rng(0)
+        for nodes in options['nodes']:
+            data = synthetic_workflows(rng, nodes, options['combinations'], options['attributes'])
+            expected, merge_ms = timed(merge_table_structure, data, options['repeat'])
+            result, pivot_ms = timed(create_table_structure, data, options['repeat'])
+            same = expected.reset_index(drop=True).astype(object).equals(result.astype(object))
+            self.stdout.write(
+                f'{nodes} nodes, {result.shape[1]} columns: merge {merge_ms:.1f}ms, single pass {pivot_ms:.1f}ms '
+                f'({merge_ms / pivot_ms:.1f}x), identical: {same}'
+            )
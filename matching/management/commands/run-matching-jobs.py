@@ -0,0 +1,24 @@
+import threading
+
+from django.core.management.base import BaseCommand
+
+from matching.jobs import work, worker_name
+
+
+class Command(BaseCommand):
+    help = 'Run queued workflow matching jobs, the web processes only queue them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=1, help='number of jobs run at the same time')
+        parser.add_argument('--once', action='store_true', help='exit when no job is pending')
+
+    def handle(self, *args, **options):
+        threads = [
+            threading.Thread(target=lambda: work(worker_name(), once=options['once']), name=f'matching-job-{i}')
+            for i in range(options['workers'])
+        ]
+        for thread in threads:
+            thread.start()
+        self.stdout.write(f'{len(threads)} matching job workers started')
+        for thread in threads:
+            thread.join()
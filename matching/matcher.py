@@ -1,14 +1,38 @@
 import json
 import sys
 import time
+from collections import Counter
 from pprint import pprint
 
 from django.template.loader import render_to_string
 from django.utils import timezone
-from neomodel import db
+from neomodel import db, config
 
+from graphutils.cache import LRUCache
+from graphutils.config import MATCHING_RESULT_CACHE_ENTRIES, MATCHING_RESULT_CACHE_TTL
 from matching.models import MatchingReport
 
+# per-process cache of query results and the results built from them; entries are keyed by the write generations
+# of the labels a matcher reads, so writes to these labels make the older entries unreachable until they are evicted
+RESULT_CACHE = LRUCache(MATCHING_RESULT_CACHE_ENTRIES, MATCHING_RESULT_CACHE_TTL)
+LABEL_GENERATIONS = Counter()
+
+
+def invalidate_results(labels):
+    """
+    Invalidates the cached results of all matchers reading any of the labels.
+    """
+    for label in labels:
+        LABEL_GENERATIONS[label] += 1
+
+
+def invalidate_node_write(sender, **kwargs):
+    """
+    post_save/post_delete receiver invalidating the results that depend on the labels of the written node.
+    """
+    if hasattr(sender, 'inherited_labels'):
+        invalidate_results(sender.inherited_labels())
+
 
 class Matcher:
     """
@@ -17,6 +41,7 @@ class Matcher:
     """
 
     type = 'generic'  # type attribute for Matcher. It's 'generic' for base Matcher class.
+    cache_labels = ()  # labels read by the query, writes to them invalidate cached results
 
     def __init__(self, paginator=None, force_report=False):
         """
@@ -31,6 +56,9 @@ class Matcher:
         self.report = ''
         self.db_columns = None
         self.db_results = None
+        self.cache_hit = False
+        self._cache_key = None
+        self._result = None
 
     def build_query(self):
         """
@@ -39,6 +67,31 @@ class Matcher:
         """
         raise NotImplementedError()
 
+    def cache_key(self):
+        """
+        Method to build the key of the query result in the result cache.
+        Subclasses can return a hashable canonical form of their request; None disables caching.
+        """
+        return None
+
+    def _result_cache_key(self):
+        key = self.cache_key()
+        if key is None:
+            return None
+        pagination = (
+            self.paginator.build_query_fragment(), tuple(sorted(self.paginator.build_params().items()))
+        ) if self.paginator else None
+        return self.type, key, pagination, tuple(LABEL_GENERATIONS[label] for label in self.cache_labels)
+
+    def _build_paginated_query(self, query, params):
+        """
+        Helper method to fill the $pagination placeholder and add the parameters of the paginator.
+        """
+        if not self.paginator:
+            return query.replace('$pagination', ''), params
+        return query.replace('$pagination', self.paginator.build_query_fragment()), \
+            {**params, **self.paginator.build_params()}
+
     def _build_query_report(self, query, params, start, end):
         """
         Helper method to build report for the query executed.
@@ -78,6 +131,26 @@ class Matcher:
             }
         )
 
+    def build_stream_query(self):
+        """
+        Method to build the query used by `stream`.
+        Defaults to build_query; subclasses can return a query producing one row per result instead.
+        """
+        return self.build_query()
+
+    def stream(self):
+        """
+        Executes the stream query and yields the result rows from the database cursor as they arrive,
+        without holding the whole result in memory. No report is generated.
+        """
+        query, params = self._build_paginated_query(*self.build_stream_query())
+
+        if db.driver is None:
+            db.set_connection(url=config.DATABASE_URL)
+        with db.driver.session(database=db._database_name) as session:
+            for record in session.run(query, params):
+                yield record.values()
+
     def build_results_for_report(self):
         """
         Method to build results for the report.
@@ -97,21 +170,30 @@ class Matcher:
     def run(self):
         """
         Method to execute the query and generate the report.
-        """
-        query, params = self.build_query()
-
-        query = query.replace(
-            '$pagination',
-            self.paginator.build_query_fragment() if self.paginator else ''
-        )
-
-        start = time.time()
-        self.db_result, self.db_columns = db.cypher_query(query, params)
-        print(f'{query} \n \n {params}')
-        end = time.time()
-
-
-        if self.generate_report:
+        Results of identical requests are taken from the result cache without querying the database or saving
+        another report; the result built from them is cached as well, so `result` does not build it again.
+        """
+        cache_key = self._result_cache_key()
+        cached = RESULT_CACHE.get_many([cache_key]) if cache_key else {}
+        self.cache_hit = cache_key in cached
+        self._cache_key = cache_key
+
+        if self.cache_hit:
+            self.db_result, self.db_columns, self._result = cached[cache_key]
+        else:
+            query, params = self._build_paginated_query(*self.build_query())
+
+            start = time.time()
+            self.db_result, self.db_columns = db.cypher_query(query, params)
+            print(f'{query} \n \n {params}')
+            end = time.time()
+
+            self._result = None
+            if cache_key:
+                RESULT_CACHE.set_many({cache_key: (self.db_result, self.db_columns, None)})
+
+        # reports describe executed queries, a cache hit executes none and would skew their timings
+        if self.generate_report and not self.cache_hit:
             self._build_query_report(query, params, start, end)
             self._build_result_report()
             self.build_extra_reports()
@@ -133,12 +215,16 @@ class Matcher:
     @property
     def result(self):
         """
-        Property method to get the result.
+        Property method to get the result. The result is built once and stored with the cached query result.
 
         Returns:
             The result of build_result method.
         """
-        return self.build_result()
+        if self._result is None:
+            self._result = self.build_result()
+            if self._cache_key:
+                RESULT_CACHE.set_many({self._cache_key: (self.db_result, self.db_columns, self._result)})
+        return self._result
 
 
 
@@ -0,0 +1,38 @@
+from django.db import migrations, models
+
+
+def fail_duplicate_active_jobs(apps, schema_editor):
+    """
+    Older processes could start several jobs for one request, keep the newest one active.
+    """
+    MatchingJob = apps.get_model('matching', 'MatchingJob')
+    seen = set()
+    for job in MatchingJob.objects.filter(status__in=['pending', 'running']).order_by('-created'):
+        if (job.key, job.type) in seen:
+            MatchingJob.objects.filter(pk=job.pk).update(status='failed', error='duplicate of a newer job')
+        seen.add((job.key, job.type))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('matching', '0002_matchingjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='matchingjob',
+            name='worker',
+            field=models.CharField(blank=True, max_length=100),
+        ),
+        migrations.AddField(
+            model_name='matchingjob',
+            name='heartbeat',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(fail_duplicate_active_jobs, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='matchingjob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['pending', 'running'])), fields=('key', 'type'), name='unique_active_matching_job'),
+        ),
+    ]
@@ -12,4 +12,46 @@ class MatchingReport(models.Model):
     report = models.TextField()
 
     def __str__(self):
-        return f'Matching Report ({self.type}, {self.date})'
\ No newline at end of file
+        return f'Matching Report ({self.type}, {self.date})'
+
+class MatchingJob(models.Model):
+    """
+    A workflow matching request run in the background (see matching.jobs).
+
+    key: Hash of the canonical request, identical requests in flight share one job.
+    status: pending, running, done or failed.
+    progress: The current step of a running job.
+    worker: The worker that claimed the job.
+    heartbeat: Last sign of life of the worker running the job, jobs without one for too long are failed.
+    """
+
+    PENDING = 'pending'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUS_CHOICES = [(PENDING, 'Pending'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed')]
+    ACTIVE = [PENDING, RUNNING]
+
+    class Meta:
+        verbose_name = 'Matching Job'
+        verbose_name_plural = 'Matching Jobs'
+        constraints = [
+            # at most one pending or running job per request, also across web processes
+            models.UniqueConstraint(fields=['key', 'type'], condition=models.Q(status__in=['pending', 'running']),
+                                    name='unique_active_matching_job'),
+        ]
+
+    key = models.CharField(max_length=64, db_index=True)
+    type = models.CharField(max_length=60)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default=PENDING)
+    progress = models.CharField(max_length=100, blank=True)
+    request = models.TextField()
+    result = models.TextField(blank=True)
+    error = models.TextField(blank=True)
+    worker = models.CharField(max_length=100, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    created = models.DateTimeField(auto_now_add=True)
+    updated = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f'Matching Job ({self.type}, {self.status}, {self.created})'
@@ -1,6 +1,8 @@
 from django.urls import path
-from .views import workflow_matcher
+from .views import workflow_matcher, matching_job, matching_job_result
 
 urlpatterns = [
     path('api/match/fabrication-workflow', workflow_matcher, name='fabrication_workflow'),
-]
\ No newline at end of file
+    path('api/match/jobs/<int:job_id>', matching_job, name='matching_job'),
+    path('api/match/jobs/<int:job_id>/result', matching_job_result, name='matching_job_result'),
+]
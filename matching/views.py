@@ -1,8 +1,29 @@
-from django.http import JsonResponse, HttpResponse
+import csv
+
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
-from .fabricationworkflows import FabricationWorkflowMatcher
+from .fabricationworkflows import FabricationWorkflowMatcher, WorkflowPaginator, STREAM_COLUMNS, WORKFLOW_PAGE_SIZE
+from .jobs import submit_workflow_job, fail_stale_jobs, start_local_workers
+from .models import MatchingJob
 import json
-from django.shortcuts import render
+from django.shortcuts import render, get_object_or_404
+
+
+class Echo:
+    """
+    File-like object whose write returns the written value, so csv.writer produces the lines of a stream.
+    """
+
+    def write(self, value):
+        return value
+
+
+def stream_csv(columns, rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(columns)
+    for row in rows:
+        yield writer.writerow(row)
+
 
 @csrf_exempt
 def workflow_matcher(request):
@@ -15,18 +36,67 @@ def workflow_matcher(request):
         graph = params["graph"]
         parsedGraph = json.loads(graph)
 
-        matcher = FabricationWorkflowMatcher(parsedGraph, force_report=True)
+        if params.get("job"):
+            # run in the background, the client polls matching_job and downloads matching_job_result
+            job, created = submit_workflow_job(parsedGraph)
+            return JsonResponse(job_status(job), status=202)
+
+        if params.get("count"):
+            # number of matching workflows only, without collecting their nodes and attributes
+            matcher = FabricationWorkflowMatcher(parsedGraph, count=True)
+            matcher.run()
+            return JsonResponse({'count': matcher.result})
+
+        paginator = None
+        if params.get("limit") or params.get("cursor"):
+            try:
+                paginator = WorkflowPaginator(int(params.get("limit") or WORKFLOW_PAGE_SIZE), params.get("cursor"))
+            except ValueError as e:
+                return JsonResponse({'error': str(e)}, status=400)
+
+        if params.get("stream"):
+            # one row per node attribute, written while the database returns the combinations
+            matcher = FabricationWorkflowMatcher(parsedGraph, paginator=paginator)
+            return StreamingHttpResponse(stream_csv(STREAM_COLUMNS, matcher.stream_rows()), content_type='text/csv',
+                                         headers={'Content-Disposition': 'attachment; filename=workflows.csv'})
+
+        matcher = FabricationWorkflowMatcher(parsedGraph, paginator=paginator, force_report=True)
         matcher.run()
 
         # Convert the DataFrame to CSV and create an HTTP response with it
         csv_content = matcher.result.to_csv(index=False)
-        matcher.result.to_csv('output_filename.csv', index=False)
         response = HttpResponse(csv_content, content_type='text/csv',
                                 headers = {'Content-Disposition': 'attachment; filename=workflows.csv'})
+        if next_cursor := matcher.next_cursor():
+            # the client requests the following page by sending this cursor
+            response['X-Next-Cursor'] = next_cursor
         return response
     else:
         return JsonResponse({'error': 'Only POST method is allowed.'}, status=405)
 
 
+def job_status(job):
+    return {
+        'job': job.pk,
+        'status': job.status,
+        'progress': job.progress,
+        'error': job.error,
+        'created': job.created.isoformat(),
+        'updated': job.updated.isoformat(),
+    }
+
+
+def matching_job(request, job_id):
+    # running jobs of a dead worker are failed; with MATCHING_JOB_LOCAL_WORKERS this process runs pending jobs too
+    fail_stale_jobs()
+    start_local_workers()
+    job = get_object_or_404(MatchingJob, pk=job_id)
+    return JsonResponse(job_status(job))
 
 
+def matching_job_result(request, job_id):
+    job = get_object_or_404(MatchingJob, pk=job_id)
+    if job.status != MatchingJob.DONE:
+        return JsonResponse(job_status(job), status=409)
+    return HttpResponse(job.result, content_type='text/csv',
+                        headers={'Content-Disposition': 'attachment; filename=workflows.csv'})
@@ -19,10 +19,26 @@ from datetime import datetime
 
 from django_neomodel import classproperty
 from neomodel import StringProperty, RelationshipTo, ZeroOrMore, \
-    RelationshipFrom, BooleanProperty
+    RelationshipFrom, BooleanProperty, db
 
+from graphutils.cache import LRUCache
+from graphutils.config import ONTOLOGY_HIERARCHY_CACHE_ENTRIES, ONTOLOGY_HIERARCHY_CACHE_TTL
 from graphutils.models import EmbeddingNodeSet, UIDDjangoNode
 
+SUBCLASSES = 'subclasses'
+SUPERCLASSES = 'superclasses'
+HIERARCHY_PATTERNS = {
+    SUBCLASSES: '(n)<-[:EMMO__DESCENDANT_OF]-(m)',
+    SUPERCLASSES: '(n)-[:EMMO__DESCENDANT_OF]->(m)',
+}
+
+# per-process cache of get_hierarchies results, cleared when the ontology closure is rebuilt
+HIERARCHY_CACHE = LRUCache(ONTOLOGY_HIERARCHY_CACHE_ENTRIES, ONTOLOGY_HIERARCHY_CACHE_TTL)
+
+
+def clear_hierarchy_cache():
+    HIERARCHY_CACHE.clear()
+
 
 class CausalObject(UIDDjangoNode):
     """
@@ -52,35 +68,71 @@ class OntologyNode(UIDDjangoNode):
     def nodes(cls):
         return EmbeddingNodeSet(cls)
 
-    def get_subclasses(self, uids):
-        prompt = f"""
-        // Part 1: Return details of `n`
-        MATCH (n:{self._meta.object_name})
-        WHERE n.uid IN {uids}
-        RETURN n.uid AS uid, n.name AS name
-        UNION ALL
-        // Part 2: Return details of `m`
-        MATCH (n:{self._meta.object_name})<-[:EMMO__IS_A*]-(m)
-        WHERE n.uid IN {uids}
-        RETURN DISTINCT m.uid AS uid, m.name AS name
+    @classmethod
+    def get_hierarchies(cls, uids, direction=SUBCLASSES):
+        """
+        Returns the subclasses (or superclasses) of many root classes, answered from the per-process hierarchy
+        cache where possible and with one parameterised query over the EMMO__DESCENDANT_OF closure otherwise.
+
+        :param uids: The uids of the root classes
+        :param direction: SUBCLASSES or SUPERCLASSES
+        :return: Dict of root uid to a list of (uid, name) of the root followed by its sub- or superclasses;
+            uids that do not exist are left out
+        """
+        label = cls._meta.object_name
+        keys = [(label, direction, uid) for uid in dict.fromkeys(uids)]
+        hierarchies = {key[2]: value for key, value in HIERARCHY_CACHE.get_many(keys).items()}
+        missing = [uid for _, _, uid in keys if uid not in hierarchies]
+        if missing:
+            pattern = HIERARCHY_PATTERNS[direction]
+            results, meta = db.cypher_query(f"""
+            UNWIND $uids AS uid
+            MATCH (n:{label} {{uid: uid}})
+            RETURN n.uid AS uid, n.name AS name, [{pattern} | [m.uid, m.name]] AS related
+            """, {'uids': missing})
+            fetched = {
+                uid: [(uid, name)] + [(related_uid, related_name) for related_uid, related_name in related]
+                for uid, name, related in results
+            }
+            HIERARCHY_CACHE.set_many({(label, direction, uid): value for uid, value in fetched.items()})
+            hierarchies.update(fetched)
+        return {uid: list(hierarchies[uid]) for _, _, uid in keys if uid in hierarchies}
+
+    @classmethod
+    def _flatten_hierarchies(cls, uids, direction):
+        hierarchies = cls.get_hierarchies(uids, direction).values()
+        roots = [hierarchy[0] for hierarchy in hierarchies]
+        related = dict.fromkeys(node for hierarchy in hierarchies for node in hierarchy[1:])
+        return roots + list(related)
+
+    @classmethod
+    def get_subclasses(cls, uids):
+        """
+        Returns (uid, name) of the given classes followed by all of their distinct subclasses.
+        """
+        return cls._flatten_hierarchies(uids, SUBCLASSES)
+
+    @classmethod
+    def get_superclasses(cls, uids):
+        """
+        Returns (uid, name) of the given classes followed by all of their distinct superclasses.
+        """
+        return cls._flatten_hierarchies(uids, SUPERCLASSES)
+
+    @classmethod
+    def get_similar(cls, uids, min_similarity=0.0):
+        """
+        Returns the classes connected to the given classes by the precomputed SIMILAR relationships
+        (see the update-ontology-similarities command), most similar first.
         """
-        results, meta = self.cypher(prompt)
-        return [(node[0], node[1]) for node in results]
-
-    def get_superclasses(self, uids):
-        prompt = f"""
-        // Part 1: Return details of `n`
-        MATCH (n:{self._meta.object_name})
-        WHERE n.uid IN {uids}
-        RETURN n.uid AS uid, n.name AS name
-        UNION ALL
-        // Part 2: Return details of `m`
-        MATCH (n:{self._meta.object_name})-[:EMMO__IS_A*]->(m)
-        WHERE n.uid IN {uids}
-        RETURN DISTINCT m.uid AS uid, m.name AS name
+        query = f"""
+        MATCH (n:{cls._meta.object_name})-[rel:SIMILAR]-(m:{cls._meta.object_name})
+        WHERE n.uid IN $uids AND NOT m.uid IN $uids AND rel.similarity >= $min_similarity
+        RETURN m.uid AS uid, m.name AS name, max(rel.similarity) AS similarity
+        ORDER BY similarity DESC
         """
-        results, meta = self.cypher(prompt)
-        return [(node[0], node[1]) for node in results]
+        results, meta = db.cypher_query(query, {'uids': list(uids), 'min_similarity': min_similarity})
+        return [(node[0], node[1], node[2]) for node in results]
 
     name = StringProperty()
     uri = StringProperty()
@@ -1,5 +1,9 @@
-from neomodel import StringProperty, FloatProperty, ArrayProperty, RelationshipTo, OneOrMore
+from datetime import datetime, timezone
 
+from neomodel import StringProperty, FloatProperty, ArrayProperty, RelationshipTo, OneOrMore, DateTimeProperty
+
+from graphutils.cache import embedding_cache_key
+from graphutils.config import EMBEDDING_MODEL
 from graphutils.models import UIDDjangoNode
 
 
@@ -19,6 +23,18 @@ class ModelEmbedding(UIDDjangoNode):
         required=True  # This field must be populated
     )
     input = StringProperty(required=True)  # The original input used to generate the vector
+    embedding_model = StringProperty()  # The model that generated the vector
+    input_hash = StringProperty(index=True)  # Hash of (embedding_model, input), one embedding node per hash
+    updated = DateTimeProperty()  # Time of the last save, tells the embedding search that the vector changed
+
+    def pre_save(self):
+        """
+        Sets the content address of the embedding, so identical inputs share one node, and the update time.
+        """
+        super().pre_save()
+        self.updated = datetime.now(timezone.utc)
+        self.embedding_model = self.embedding_model or EMBEDDING_MODEL
+        self.input_hash = embedding_cache_key(self.embedding_model, self.input)
 
 
 
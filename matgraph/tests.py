@@ -1,3 +1,49 @@
-from django.test import TestCase
+import uuid
 
-# Create your tests here.
+from django.db.models import signals
+from django.test import SimpleTestCase, TestCase
+
+from graphutils.cache import embedding_cache_key
+from graphutils.config import EMBEDDING_MODEL
+from matgraph.models.embeddings import MatterEmbedding
+
+
+class ModelEmbeddingHookTest(SimpleTestCase):
+
+    def test_save_hooks_set_hash_and_send_signals(self):
+        sent = []
+
+        def receiver(sender, instance, created, **kwargs):
+            sent.append(created)
+
+        signals.post_save.connect(receiver, sender=MatterEmbedding)
+        try:
+            embedding = MatterEmbedding(input='steel', vector=[0.1, 0.2])
+            embedding.pre_save()
+            embedding.post_save()
+        finally:
+            signals.post_save.disconnect(receiver, sender=MatterEmbedding)
+
+        self.assertEqual(embedding.embedding_model, EMBEDDING_MODEL)
+        self.assertEqual(embedding.input_hash, embedding_cache_key(EMBEDDING_MODEL, 'steel'))
+        self.assertIsNotNone(embedding.updated)
+        self.assertEqual(sent, [True])
+
+
+class ModelEmbeddingSaveTest(TestCase):
+
+    def setUp(self):
+        self.input = f'test embedding {uuid.uuid4().hex}'
+
+    def tearDown(self):
+        for embedding in MatterEmbedding.nodes.filter(input=self.input):
+            embedding.delete()
+
+    def test_save_through_orm(self):
+        embedding = MatterEmbedding(input=self.input, vector=[0.1, 0.2]).save()
+        embedding.vector = [0.3, 0.4]
+        embedding.save()
+
+        stored = MatterEmbedding.nodes.get(uid=embedding.uid)
+        self.assertEqual(stored.input_hash, embedding_cache_key(EMBEDDING_MODEL, self.input))
+        self.assertEqual(stored.vector, [0.3, 0.4])
@@ -3,12 +3,18 @@ import os
 import pandas as pd
 from dotenv import load_dotenv
 from neomodel import db
-from pandarallel import pandarallel
 
-from graphutils.config import EMBEDDING_FETCHING_PROCESSES
-from graphutils.embeddings import request_embedding
+from graphutils.cache import embedding_cache_key
+from graphutils.config import EMBEDDING_DB_CHUNK_SIZE, EMBEDDING_STAGE_SIZE, EMBEDDING_MODEL
+from graphutils.embeddingpool import request_embeddings_concurrently
+from matching.matcher import invalidate_results
 from matgraph.models.ontology import EMMOMatter, EMMOProcess, EMMOQuantity
 
+EMBEDDING_LABELS = {
+    'EMMOMatter': 'MatterEmbedding',
+    'EMMOProcess': 'ProcessEmbedding',
+    'EMMOQuantity': 'QuantityEmbedding',
+}
 
 def build_cypher_query(Model, fetch_properties, fetch_filter='', unwind_alternative_labels=False, id_property='uid'):
     """
@@ -67,90 +73,130 @@ def apply_combine_func(df_all, combine_func, fetch_properties, unwind_alternativ
         print(item['name'])
         labels = []
         labels.append(item['name'])
-        labels.append(item['description'].replace("'", "").replace('[', '').replace(']', ''))
-        for alt_label in item['alternative_labels']:
+        # the light commands fetch neither descriptions nor alternative labels
+        if item.get('description'):
+            labels.append(item['description'].replace("'", "").replace('[', '').replace(']', ''))
+        for alt_label in item.get('alternative_labels', []):
             labels.append(alt_label.replace("'", ""))
         return labels
     df_all["combined"] = df_all.apply(combine, axis=1)
     return df_all
 
-def fetch_embedding_from_db(input_string):
+def fetch_existing_embeddings(Model, id_property='uid'):
     """
-    Fetches an embedding from the Neo4j database given an input string.
+    Fetches which inputs are already embedded for the nodes of a model with a single query.
 
-    :param input_string: The input string used to fetch the corresponding embedding.
-    :return: The fetched embedding or None if not found.
+    :param Model: The model whose embeddings should be fetched
+    :param id_property: The id property of the model
+    :return: Set of (node id, input string) pairs that already have an embedding
     """
-
-    # Build the Cypher query to fetch the embedding
-    query = f"MATCH (n:ModelEmbedding) WHERE n.input = '{input_string}' RETURN n.vector"
-
-    # Execute the Cypher query
+    query = f'''
+        MATCH (n:{Model.__label__})<-[:FOR]-(emb:ModelEmbedding)
+        RETURN n.{id_property}, emb.input
+    '''
     results, meta = db.cypher_query(query)
+    return {(row[0], row[1]) for row in results}
 
-    # # If a result was found, return the embedding
-    # if results:
-    #     # The query returns a list of results, each of which is a tuple. The embedding is the first element of the tuple.
-    #     # Therefore, we return the first element of the first result.
-    #     return results[0][0]
+def remove_existing_inputs(df_all, existing, id_property):
+    """
+    Removes the inputs that are already embedded from the combined lists and drops rows without missing inputs.
 
-    # If no result was found, return None
-    return None
+    :param df_all: DataFrame with the id_property and 'combined' columns
+    :param existing: Set of (node id, input string) pairs that already have an embedding
+    :param id_property: The id property of the model
+    :return: DataFrame holding only the missing inputs
+    """
+    df_all['combined'] = [
+        [text for text in texts if (uid, text) not in existing]
+        for uid, texts in zip(df_all[id_property], df_all['combined'])
+    ]
+    return df_all[df_all['combined'].apply(len) > 0]
 
-def iterate_over_inputs(input_list):
-    embeddings =[]
-    for input in input_list:
-        if fetch_embedding_from_db(input) == None:
-            embeddings.append(request_embedding(input))
-    return embeddings
+def embed_combined(combined):
+    """
+    Embeds the combined inputs of all rows with batched, concurrent requests.
 
-def apply_embedding(df_all, resume):
-    pandarallel.initialize(nb_workers=EMBEDDING_FETCHING_PROCESSES, progress_bar=True, use_memory_fs=False)
-    if resume:
-        df_all['embedding'] = df_all['combined'].apply(lambda x: iterate_over_inputs(x))
-    else:
-        df_all['embedding'] = df_all.combined.swifter.apply(request_embedding)
+    :param combined: Series holding one list of input strings per row
+    :return: List holding one list of vectors per row, aligned with the input strings
+    """
+    inputs = [text for texts in combined for text in texts]
+    vectors = iter(request_embeddings_concurrently(inputs))
+    return [[next(vectors) for _ in texts] for texts in combined]
+
+def apply_embedding(df_all):
+    df_all['embedding'] = embed_combined(df_all['combined'])
     return df_all
 
 def generate_ingest_query(Model, id_property):
     """
     Generates a Cypher query to ingest data into a Neo4j database.
 
+    Embedding nodes are merged on the hash of (embedding model, input), so an input that is shared by several
+    nodes is stored once and connected to all of them.
+
     :param Model: The Django model for which data is to be ingested
     :param id_property: The id property of the model
     :return: Cypher query as a string
     """
+    embedding_label = EMBEDDING_LABELS.get(Model.__label__, 'ModelEmbedding')
     return f'''
                 UNWIND $vectors as row
                 MATCH
                     (n:{Model.__label__} {{{id_property}: row[0]}})
                 MERGE
-                    (emb:ModelEmbedding {{vector: row[1], input: row[2]}})-[:FOR]->(n)
+                    (emb:{embedding_label}:ModelEmbedding {{input_hash: row[3]}})
                 ON CREATE SET
-                    emb.uid = RandomUUID()
+                    emb.uid = RandomUUID(),
+                    emb.vector = row[1],
+                    emb.input = row[2],
+                    emb.embedding_model = $embedding_model
+                MERGE
+                    (emb)-[:FOR]->(n)
 
             '''
 
-def ingest_data_into_db(chunks, db, query):
+def explode_embeddings(df, id_property):
+    """
+    Turns one row per node with aligned lists of inputs and vectors into one (uid, vector, input) row per embedding.
+
+    :param df: DataFrame with the id_property, 'combined' and 'embedding' columns
+    :param id_property: The id property of the model
+    :return: DataFrame with the columns id_property, 'embedding' and 'combined'
+    """
+    exploded = df[[id_property, 'embedding', 'combined']].explode(['embedding', 'combined'], ignore_index=True)
+    return exploded.dropna(subset=['embedding', 'combined'])
+
+def ingest_data_into_db(df, db, query, chunk_size=EMBEDDING_DB_CHUNK_SIZE):
     """
     Ingests data into a Neo4j database using a provided Cypher query.
 
-    :param chunks: The data to be ingested
+    :param df: The exploded (uid, vector, input) rows to be ingested
     :param db: The database connection object
     :param query: The Cypher query to be executed
+    :param chunk_size: The number of rows per UNWIND batch
     """
-    current = 1
-    for chunk in chunks:
-        current += 1
-        db_rows = [ # to python array
-            [r[0], r[1], r[2]] for r in chunk.to_records(index=False)
+    uids, vectors, inputs = df.iloc[:, 0].tolist(), df.iloc[:, 1].tolist(), df.iloc[:, 2].tolist()
+    for start in range(0, len(uids), chunk_size):
+        stop = start + chunk_size
+        db_rows = [
+            [uid, vector, text, embedding_cache_key(EMBEDDING_MODEL, text)]
+            for uid, vector, text in zip(uids[start:stop], vectors[start:stop], inputs[start:stop])
         ]
-        db.cypher_query(query, {'vectors': db_rows})
+        db.cypher_query(query, {'vectors': db_rows, 'embedding_model': EMBEDDING_MODEL})
 
 def get_embeddings_for_model(cmd, Model, fetch_properties, combine_func, fetch_filter='', required_properties=None, resume=True, id_property='uid', unwind_alternative_labels=False):
     """
      Retrieve and store embeddings for the specified model using OpenAI's API.
 
+     Nodes are processed in stages of EMBEDDING_STAGE_SIZE rows: every stage is embedded, exploded into one row per
+     (uid, input, vector) triple and written in UNWIND batches of EMBEDDING_DB_CHUNK_SIZE before the next stage
+     starts, so memory use does not grow with the size of the ontology.
+
+     With resume, the (uid, input) pairs that already have an embedding are fetched in one query and skipped. As
+     every finished stage is committed to the database, the stored embeddings are the checkpoint: an interrupted
+     run continues with the first stage that was not written. Cached matching results reading the model are
+     invalidated after every stage.
+
      Args:
          cmd: A command object to handle logging and output.
          Model: The model class for which embeddings should be fetched.
@@ -158,7 +204,7 @@ def get_embeddings_for_model(cmd, Model, fetch_properties, combine_func, fetch_f
          combine_func: A function to combine fetched properties before sending them for embedding generation.
          fetch_filter (str, optional): A Cypher query filter to apply when fetching nodes. Defaults to ''.
          required_properties (list, optional): A list of properties that must be present for a node to be processed. Defaults to None.
-         resume (bool, optional): Whether to resume the process by skipping nodes that already have embeddings. Defaults to True.
+         resume (bool, optional): Whether to resume the process by skipping inputs that already have embeddings. Defaults to True.
          id_property (str, optional): The property to use as the unique identifier for nodes. Defaults to 'uid'.
          unwind_alternative_labels (bool, optional): Whether to create a separate embedding for every label. Defaults to False.
      """
@@ -171,40 +217,40 @@ def get_embeddings_for_model(cmd, Model, fetch_properties, combine_func, fetch_f
     if processable == 0:
         return
 
-    # Apply your functions
     df_all = apply_combine_func(df_all, combine_func, fetch_properties, unwind_alternative_labels)
-    df_all = apply_embedding(df_all, resume)
-
-    # Filter out rows where 'embedding' is an empty list
-    df_all = df_all[df_all['embedding'].apply(len) > 0]
-
-    # Continue with your existing code
-    list_length = len(df_all['embedding'][0])
-    min_length = min([len(x) for x in df_all['embedding']])
-
-    # Create a list to hold each chunk dataframe
-    chunks = []
-
-    for i in range(list_length):
-        # Create a new dataframe for each element in the lists
-        chunk_df = df_all[[id_property]].copy()  # Copy the id_property column
+    if resume:
+        existing = fetch_existing_embeddings(Model, id_property)
+        df_all = remove_existing_inputs(df_all, existing, id_property)
+        # cmd.stdout.write(f'{len(df_all.index)} nodes with missing embeddings')
+    query = generate_ingest_query(Model, id_property)
 
-        # Safely extract elements from 'embedding', handling out-of-range indices
-        chunk_df['embedding_element_' + str(i)] = df_all['embedding'].apply(
-            lambda x: x[i] if i < len(x) else x[0])  # Changed fallback from x[0] to None
+    for start in range(0, len(df_all.index), EMBEDDING_STAGE_SIZE):
+        df_stage = apply_embedding(df_all.iloc[start:start + EMBEDDING_STAGE_SIZE].copy())
+        ingest_data_into_db(explode_embeddings(df_stage, id_property), db, query)
+        invalidate_results([*Model.inherited_labels(), EMBEDDING_LABELS.get(Model.__label__, 'ModelEmbedding')])
 
-        # Safely extract elements from 'combined', handling out-of-range indices
-        chunk_df['combined_element_' + str(i)] = df_all['combined'].apply(
-            lambda x: x[i] if i < len(x) else x[0])  # Changed fallback from x[0] to None
+    # cmd.stdout.write(cmd.style.SUCCESS('Successfully stored embeddings in db'))
 
-        # Append this new dataframe to the chunks list
-        chunks.append(chunk_df)
 
-    # Continue with the rest of your code
-    query = generate_ingest_query(Model, id_property)
-    ingest_data_into_db(chunks, db, query)
+def get_embeddings_for_ontology(cmd, resume=False):
+    """
+    Retrieve and store the embeddings of all ontology branches: one embedding per name, description and
+    alternative label of every matter, process and quantity class.
 
-    # cmd.stdout.write(cmd.style.SUCCESS('Successfully stored embeddings in db'))
+    Args:
+        cmd: A command object to handle logging and output.
+        resume (bool, optional): Whether to skip inputs that already have embeddings. Defaults to False.
+    """
+    for Model in (EMMOMatter, EMMOProcess, EMMOQuantity):
+        cmd.stdout.write(f'Getting embeddings for {Model.__label__}')
+        get_embeddings_for_model(
+            cmd,
+            Model=Model,
+            fetch_properties=['name', 'description'],
+            combine_func=lambda s: s['name'],
+            resume=resume,
+            unwind_alternative_labels=True
+        )
 
 
 
@@ -0,0 +1,63 @@
+import time
+
+import numpy as np
+from django.core.management.base import BaseCommand
+
+from graphutils.embeddings import EmbeddingSearch, CompressedEmbeddingSearch, normalize_vectors
+from matgraph.models.ontology import EMMOMatter, EMMOProcess, EMMOQuantity
+
+
+def recall_at_k(exact, approximate):
+    """
+    Share of the exact top-k ids that are also returned by the approximate search, averaged over all queries.
+    """
+    return np.mean([
+        len({row[0] for row in e} & {row[0] for row in a}) / max(len(e), 1)
+        for e, a in zip(exact, approximate)
+    ])
+
+
+def latencies(search, queries, k):
+    timings = []
+    for query in queries:
+        start = time.perf_counter()
+        search.search(query, k)
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.mean(timings), np.percentile(timings, 95)
+
+
+class Command(BaseCommand):
+    help = 'Compare recall@k and latency of the compressed embedding indexes against the exact search'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--k', type=int, default=10, help='number of results per query')
+        parser.add_argument('--queries', type=int, default=200, help='number of sampled queries per label')
+        parser.add_argument(
+            '--noise',
+            type=float,
+            default=0.02,
+            help='gaussian noise added to the sampled stored vectors, so queries are not exact copies'
+        )
+
+    def handle(self, *args, **options):
+        k = options['k']
+        rng = np.random.default_rng(0)
+
+        for Model in [EMMOMatter, EMMOProcess, EMMOQuantity]:
+            exact = EmbeddingSearch(Model)
+            rows = rng.choice(len(exact.model_ids), min(options['queries'], len(exact.model_ids)), replace=False)
+            vectors = exact.vectors(rows)
+            queries = normalize_vectors(vectors + rng.normal(scale=options['noise'], size=vectors.shape))
+            exact_results = exact.search_many(queries, k)
+            mean, p95 = latencies(exact, queries, k)
+            self.stdout.write(f'{Model.__label__} ({len(exact.model_ids)} embeddings)')
+            self.stdout.write(f'  exact: recall@{k} 1.000, {mean:.2f}ms mean, {p95:.2f}ms p95')
+
+            for compression in ['sq8', 'pca']:
+                search = CompressedEmbeddingSearch(Model, compression=compression)
+                if search.compressed is None:
+                    self.stdout.write(f'  {compression}: too few embeddings to compress')
+                    continue
+                recall = recall_at_k(exact_results, search.search_many(queries, k))
+                mean, p95 = latencies(search, queries, k)
+                self.stdout.write(f'  {compression}: recall@{k} {recall:.3f}, {mean:.2f}ms mean, {p95:.2f}ms p95')
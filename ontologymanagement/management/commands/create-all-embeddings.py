@@ -2,7 +2,7 @@ from importlib import import_module
 
 from django.core.management.base import BaseCommand, CommandError
 
-from dbcommunication.ai.createEmbeddings import get_embeddings_for_model
+from ontologymanagement.createEmbeddings import get_embeddings_for_model
 
 
 class Command(BaseCommand):
@@ -1,6 +1,6 @@
 from importlib import import_module
 
-from dbcommunication.ai.createEmbeddings import get_embeddings_for_model
+from ontologymanagement.createEmbeddings import get_embeddings_for_model
 from django.core.management.base import BaseCommand, CommandError
 from django.apps import apps
 class Command(BaseCommand):
@@ -0,0 +1,91 @@
+from django.core.management.base import BaseCommand
+from neomodel import db
+
+from graphutils.cache import embedding_cache_key
+from graphutils.config import EMBEDDING_MODEL, EMBEDDING_DB_CHUNK_SIZE
+from ontologymanagement.createEmbeddings import EMBEDDING_LABELS
+
+BYTES_PER_FLOAT = 8  # neo4j stores float arrays as 64 bit doubles
+
+
+class Command(BaseCommand):
+    help = 'Collapse duplicate embedding nodes into one node per (embedding model, input) and report the reclaimed bytes'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='only report the duplicates, do not change the database'
+        )
+
+    def set_input_hashes(self, label):
+        """
+        Sets input_hash and embedding_model on embeddings created before they were content addressed.
+        Embeddings without a model are assumed to be created with the current EMBEDDING_MODEL.
+        """
+        results, _ = db.cypher_query(f'''
+            MATCH (emb:{label})
+            WHERE emb.input_hash IS NULL AND emb.input IS NOT NULL
+            RETURN DISTINCT emb.input, COALESCE(emb.embedding_model, $model)
+        ''', {'model': EMBEDDING_MODEL})
+        rows = [[text, model, embedding_cache_key(model, text)] for text, model in results]
+        for start in range(0, len(rows), EMBEDDING_DB_CHUNK_SIZE):
+            db.cypher_query(f'''
+                UNWIND $rows as row
+                MATCH (emb:{label} {{input: row[0]}})
+                WHERE emb.input_hash IS NULL AND COALESCE(emb.embedding_model, $model) = row[1]
+                SET emb.embedding_model = row[1], emb.input_hash = row[2]
+            ''', {'rows': rows[start:start + EMBEDDING_DB_CHUNK_SIZE], 'model': EMBEDDING_MODEL})
+
+    def count_duplicates(self, label):
+        results, _ = db.cypher_query(f'''
+            MATCH (emb:{label})
+            WITH COALESCE(emb.input_hash, emb.input) AS hash, collect(emb)[1..] AS duplicates
+            UNWIND duplicates AS duplicate
+            RETURN count(duplicate), sum(size(duplicate.vector)), sum(size(duplicate.input))
+        ''')
+        return results[0]
+
+    def collapse_duplicates(self, label):
+        """
+        Keeps one embedding per hash, moves the FOR relationships of the others to it and deletes them.
+        Runs in batches of hashes, so a single transaction never holds all duplicates.
+        """
+        nodes, floats, characters = 0, 0, 0
+        while True:
+            results, _ = db.cypher_query(f'''
+                MATCH (emb:{label})
+                WHERE emb.input_hash IS NOT NULL
+                WITH emb.input_hash AS hash, collect(emb) AS embeddings
+                WHERE size(embeddings) > 1
+                WITH embeddings[0] AS keep, embeddings[1..] AS duplicates
+                LIMIT $batch
+                UNWIND duplicates AS duplicate
+                OPTIONAL MATCH (duplicate)-[:FOR]->(n)
+                WITH keep, duplicate, collect(n) AS targets,
+                     size(duplicate.vector) AS floats, size(duplicate.input) AS characters
+                FOREACH (n IN targets | MERGE (keep)-[:FOR]->(n))
+                DETACH DELETE duplicate
+                RETURN count(duplicate), sum(floats), sum(characters)
+            ''', {'batch': EMBEDDING_DB_CHUNK_SIZE})
+            deleted, deleted_floats, deleted_characters = results[0]
+            if not deleted:
+                return nodes, floats, characters
+            nodes += deleted
+            floats += deleted_floats or 0
+            characters += deleted_characters or 0
+
+    def handle(self, *args, **options):
+        total_bytes = 0
+        for label in EMBEDDING_LABELS.values():
+            if options['dry_run']:
+                nodes, floats, characters = self.count_duplicates(label)
+            else:
+                self.set_input_hashes(label)
+                nodes, floats, characters = self.collapse_duplicates(label)
+            reclaimed = (floats or 0) * BYTES_PER_FLOAT + (characters or 0)
+            total_bytes += reclaimed
+            self.stdout.write(f'{label}: {nodes} duplicate embeddings, {reclaimed / 1e6:.1f} MB')
+
+        verb = 'Would reclaim' if options['dry_run'] else 'Reclaimed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} about {total_bytes / 1e6:.1f} MB of vector and input data.'))
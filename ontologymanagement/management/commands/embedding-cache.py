@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from graphutils.cache import get_embedding_cache
+
+
+class Command(BaseCommand):
+    help = 'Show the size of the persistent embedding cache or clear it'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='remove all cached embeddings'
+        )
+
+    def handle(self, *args, **options):
+        cache = get_embedding_cache()
+        if cache is None:
+            raise CommandError('The embedding cache is disabled (EMBEDDING_CACHE_PATH is empty).')
+        if options['clear']:
+            cache.clear()
+            self.stdout.write(self.style.SUCCESS('Cleared the embedding cache.'))
+        for key, value in cache.stats().items():
+            self.stdout.write(f'{key}: {value}')
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from graphutils.config import EMBEDDING_SNAPSHOT_PATH
+from graphutils.snapshot import export_embedding_snapshot, import_embedding_snapshot
+from ontologymanagement.createEmbeddings import EMBEDDING_LABELS
+
+
+class Command(BaseCommand):
+    help = 'Export ontology embeddings to a memory-mapped snapshot or import a snapshot into the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('action', choices=['export', 'import'])
+        parser.add_argument(
+            '--path',
+            default=EMBEDDING_SNAPSHOT_PATH,
+            help='snapshot directory (defaults to EMBEDDING_SNAPSHOT_PATH)'
+        )
+
+    def handle(self, *args, **options):
+        path = options['path']
+        if not path:
+            raise CommandError('No snapshot path given and EMBEDDING_SNAPSHOT_PATH is not set.')
+
+        if options['action'] == 'export':
+            header = export_embedding_snapshot(path, EMBEDDING_LABELS)
+            for label, info in header['labels'].items():
+                self.stdout.write(f'{label}: {info["count"]} embeddings')
+            self.stdout.write(self.style.SUCCESS(f'Successfully wrote embedding snapshot to {path}'))
+        else:
+            for label, count in import_embedding_snapshot(path).items():
+                self.stdout.write(f'{label}: {count} embeddings')
+            self.stdout.write(self.style.SUCCESS(f'Successfully imported embedding snapshot from {path}'))
@@ -1,6 +1,6 @@
 from django.core.management.base import BaseCommand
 
-from dbcommunication.ai.embeddings import get_embeddings_for_ontology
+from ontologymanagement.createEmbeddings import get_embeddings_for_ontology
 
 
 class Command(BaseCommand):
@@ -14,6 +14,10 @@ class Command(BaseCommand):
             CREATE INDEX skill_similarity IF NOT EXISTS FOR ()-[r:SIMILAR]-() ON (r.similarity)
         ''')
 
+        db.cypher_query('''
+            CREATE INDEX emmo_descendant_depth IF NOT EXISTS FOR ()-[r:EMMO__DESCENDANT_OF]-() ON (r.depth)
+        ''')
+
         db.cypher_query('''
             CREATE INDEX requires_relevance IF NOT EXISTS FOR ()-[r:REQUIRES]-() ON (r.relevance)
         ''')
@@ -0,0 +1,15 @@
+from django.core.management import BaseCommand
+
+from ontologymanagement.ontologyClosure import rebuild_all_closures, CLOSURE_LABELS
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the EMMO__DESCENDANT_OF closure relationships of the ontology hierarchies'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--labels', nargs='+', default=CLOSURE_LABELS, choices=CLOSURE_LABELS,
+                            help='The ontology labels to rebuild the closure for')
+
+    def handle(self, *args, **options):
+        for label, count in rebuild_all_closures(options['labels']).items():
+            self.stdout.write(f'{label}: {count} EMMO__DESCENDANT_OF relationships')
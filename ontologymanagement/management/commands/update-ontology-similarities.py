@@ -0,0 +1,19 @@
+from django.core.management import BaseCommand
+
+from ontologymanagement.similarity import update_similarities, ONTOLOGY_LABELS, ONTOLOGY_TOP_K
+
+
+class Command(BaseCommand):
+    help = 'Calculate the top-k SIMILAR relationships between ontology classes based on their embeddings'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--labels', nargs='+', default=ONTOLOGY_LABELS, choices=ONTOLOGY_LABELS,
+                            help='The ontology labels to calculate the similarities for')
+        parser.add_argument('--top-k', type=int, default=ONTOLOGY_TOP_K,
+                            help='The number of similar classes stored per class')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only recalculate classes with new embeddings and their neighbours')
+
+    def handle(self, *args, **options):
+        for label in options['labels']:
+            update_similarities(self, label=label, incremental=options['incremental'], top_k=options['top_k'])
@@ -1,10 +1,14 @@
 from django.core.management import BaseCommand
 
-from skills.ai.similarity import update_similarities
+from ontologymanagement.similarity import update_similarities
 
 
 class Command(BaseCommand):
     help = 'Calculate skill similarities based on embeddings'
 
+    def add_arguments(self, parser):
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only calculate the similarities of embeddings added since the last run')
+
     def handle(self, *args, **options):
-        update_similarities(self)
+        update_similarities(self, incremental=options['incremental'])
@@ -0,0 +1,76 @@
+"""
+Materialised transitive closure of the EMMO__IS_A hierarchies.
+
+Every class is connected to each of its ancestors by an EMMO__DESCENDANT_OF relationship holding the length of
+the shortest EMMO__IS_A path between them, so subtree and ancestor lookups are a single relationship hop instead
+of a variable-length traversal. The closure is computed in Python from the EMMO__IS_A edges of one label and
+replaced in one transaction; it is rebuilt after every ontology import.
+"""
+
+from collections import deque
+
+from neomodel import db
+
+from matching.matcher import invalidate_results
+from matgraph.models.abstractclasses import clear_hierarchy_cache
+
+CLOSURE_LABELS = ['EMMOMatter', 'EMMOProcess', 'EMMOQuantity']
+CLOSURE_BATCH_SIZE = 5000  # closure relationships created per statement
+
+
+def compute_closure(edges):
+    """
+    Computes all (descendant, ancestor, depth) pairs of a hierarchy with one breadth-first search per class.
+
+    :param edges: Pairs of (child uid, parent uid)
+    :return: List of [descendant uid, ancestor uid, shortest distance]
+    """
+    parents = {}
+    for child, parent in edges:
+        parents.setdefault(child, []).append(parent)
+
+    closure = []
+    for descendant in parents:
+        depths = {descendant: 0}
+        queue = deque([descendant])
+        while queue:
+            uid = queue.popleft()
+            for parent in parents.get(uid, []):
+                if parent not in depths:
+                    depths[parent] = depths[uid] + 1
+                    closure.append([descendant, parent, depths[parent]])
+                    queue.append(parent)
+    return closure
+
+
+def rebuild_closure(label):
+    """
+    Replaces the EMMO__DESCENDANT_OF relationships of a label with the closure of its current EMMO__IS_A edges.
+
+    :param label: The ontology label, e.g. EMMOMatter
+    :return: The number of closure relationships
+    """
+    edges, _ = db.cypher_query(f'''
+        MATCH (child:{label})-[:EMMO__IS_A]->(parent:{label})
+        RETURN child.uid, parent.uid
+    ''')
+    closure = compute_closure(edges)
+
+    with db.transaction:
+        db.cypher_query(f'''
+            MATCH (:{label})-[rel:EMMO__DESCENDANT_OF]->(:{label})
+            DELETE rel
+        ''')
+        for start in range(0, len(closure), CLOSURE_BATCH_SIZE):
+            db.cypher_query(f'''
+                UNWIND $rows as row
+                MATCH (descendant:{label} {{uid: row[0]}}), (ancestor:{label} {{uid: row[1]}})
+                CREATE (descendant)-[:EMMO__DESCENDANT_OF {{depth: row[2]}}]->(ancestor)
+            ''', {'rows': closure[start:start + CLOSURE_BATCH_SIZE]})
+    clear_hierarchy_cache()
+    invalidate_results([label])
+    return len(closure)
+
+
+def rebuild_all_closures(labels=CLOSURE_LABELS):
+    return {label: rebuild_closure(label) for label in labels}
@@ -1,4 +1,7 @@
 import ast
+import asyncio
+import hashlib
+import json
 from json import JSONDecodeError
 
 from django.conf import settings
@@ -7,22 +10,84 @@ from langchain.chains.ernie_functions import create_structured_output_runnable
 from langchain_core.prompts import ChatPromptTemplate, FewShotChatMessagePromptTemplate
 from langchain_openai import ChatOpenAI
 from owlready2 import *
-from owlready2 import get_ontology, Thing
+from owlready2 import Thing
 
-from graphutils.config import CHAT_GPT_MODEL
-from graphutils.embeddings import request_embedding
-from graphutils.models import AlternativeLabel
-from matgraph.models.embeddings import MatterEmbedding, ProcessEmbedding, QuantityEmbedding
+from neomodel import db
+
+from graphutils.cache import embedding_cache_key
+from graphutils.config import CHAT_GPT_MODEL, EMBEDDING_MODEL, EMBEDDING_DB_CHUNK_SIZE, \
+    ONTOLOGY_ENRICHMENT_CONCURRENCY, ONTOLOGY_ENRICHMENT_CHECKPOINT_INTERVAL, ONTOLOGY_FOLDER
+from graphutils.embeddings import request_embeddings
+from matching.matcher import invalidate_results
 from matgraph.models.ontology import EMMOMatter, EMMOQuantity, EMMOProcess
+from ontologymanagement.createEmbeddings import generate_ingest_query, EMBEDDING_LABELS
+from ontologymanagement.ontologyClosure import rebuild_closure
+from ontologymanagement.ontologyStore import OntologyStore
 from ontologymanagement.schema import OntologyClass
 from ontologymanagement.setupMessages import MATTER_ONTOLOGY_ASSISTANT_MESSAGES, QUANTITY_ONTOLOGY_ASSISTANT_MESSAGES, \
     PROCESS_ONTOLOGY_ASSISTANT_MESSAGES
 
-
-def convert_alternative_labels(onto):
-    onto_path = os.path.join("/home/mdreger/Documents/MatGraphAI/Ontology/", onto)
-    onto_path_alt = os.path.join("/home/mdreger/Documents/MatGraphAI/Ontology/alt_list", onto)
-    ontology = get_ontology(onto_path_alt).load()
+ONTOLOGY_IMPORT_BATCH_SIZE = 1000  # rows per UNWIND statement during the import
+
+
+def prompt_version(setup_message, examples=None):
+    """
+    Hash of the prompt and output schema, so cached labels are not reused after the prompt changes.
+    """
+    return hashlib.sha256(
+        json.dumps([repr(setup_message), repr(examples), OntologyClass.schema()], sort_keys=True, default=str)
+        .encode('utf-8')
+    ).hexdigest()[:16]
+
+
+class LabelCache:
+    """
+    Append-only JSON lines file of generated class labels, keyed by class name and prompt version. Every result
+    is flushed when it arrives, so finished requests survive a crash of the enrichment run.
+    """
+
+    def __init__(self, path, version):
+        self.path = path
+        self.version = version
+        self.entries = {}
+        if os.path.exists(path):
+            line = ''
+            with open(path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except JSONDecodeError:
+                        # a line cut off by a crash
+                        continue
+                    if entry.get('version') == version:
+                        self.entries[entry['class']] = entry['output']
+                if line and not line.endswith('\n'):
+                    # start the next entry on a new line after a cut off one
+                    with open(path, 'a') as f:
+                        f.write('\n')
+
+    def get(self, class_name):
+        output = self.entries.get(class_name)
+        return OntologyClass(**output) if output is not None else None
+
+    def set(self, class_name, output):
+        self.entries[class_name] = output.dict()
+        with open(self.path, 'a') as f:
+            f.write(json.dumps({'class': class_name, 'version': self.version, 'output': output.dict()}) + '\n')
+
+
+def class_fingerprint(uri, name, comment, labels, parents):
+    """
+    Hash of everything the import writes for a class, used to detect changed classes between imports.
+    """
+    return hashlib.sha256(
+        json.dumps([uri, name, comment, sorted(labels), sorted(parents)]).encode('utf-8')
+    ).hexdigest()
+
+
+def convert_alternative_labels(onto, ontology_folder=ONTOLOGY_FOLDER):
+    onto_path = os.path.join(ontology_folder, onto)
+    ontology = OntologyStore(os.path.join(ontology_folder, "alt_list")).load(onto)
 
     # Define the new alternative_label property
     # Define the new alternative_label property
@@ -48,8 +113,9 @@ def convert_alternative_labels(onto):
 
 
 class OntologyManager:
-    def __init__(self, ontology_folder="/home/mdreger/Documents/MatGraphAI/Ontology/"):
+    def __init__(self, ontology_folder=ONTOLOGY_FOLDER, llm=None):
         self.ontology_folder = ontology_folder
+        self._store = None
         self.file_to_model = {
             "matter.owl": EMMOMatter,
             "quantities.owl": EMMOQuantity,
@@ -64,35 +130,96 @@ class OntologyManager:
             "quantities.owl": QUANTITY_ONTOLOGY_ASSISTANT_MESSAGES,
             "manufacturing.owl": PROCESS_ONTOLOGY_ASSISTANT_MESSAGES,
         }
+        self._llm = llm
+        self._chains = {}
+        self._loop = None
+
+    @property
+    def store(self):
+        """
+        The persistent owlready2 world shared by all operations of this manager.
+        """
+        if self._store is None:
+            self._store = OntologyStore(self.ontology_folder)
+        return self._store
+
+    @property
+    def llm(self):
+        if self._llm is None:
+            self._llm = ChatOpenAI(model_name=CHAT_GPT_MODEL, openai_api_key=os.getenv("OPENAI_API_KEY"))
+        return self._llm
+
+    def run_async(self, coroutine):
+        """
+        Runs a coroutine in the event loop of this manager. The async client of the chat model is bound to the loop
+        of its first request, so all label generation runs share one loop instead of a new one per asyncio.run.
+        """
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(coroutine)
+
+    def get_chain(self, setup_message, examples=None):
+        """
+        Returns the structured output chain for the setup message, built once and shared by all calls.
+        """
+        key = prompt_version(setup_message, examples)
+        if key not in self._chains:
+            prompt = ChatPromptTemplate.from_messages(setup_message)
+
+            if examples:
+                print("Examples provided")
+                print(examples)
+                example_prompt = ChatPromptTemplate.from_messages([('human', "{input}"), ('ai', "{output}")])
+                few_shot_prompt = FewShotChatMessagePromptTemplate(example_prompt=example_prompt, examples=examples)
+                prompt = ChatPromptTemplate.from_messages([setup_message[0], few_shot_prompt, *setup_message[1:]])
+
+            self._chains[key] = create_structured_output_runnable(OntologyClass, self.llm, prompt).with_config(
+                {"run_name": "ontology-label-generation"})
+        return self._chains[key]
 
     def get_labels(self, class_name, setup_message, examples=None):
         """Performs the initial extraction of relationships using GPT-4."""
-
-        llm = ChatOpenAI(model_name=CHAT_GPT_MODEL, openai_api_key=os.getenv("OPENAI_API_KEY"))
-        setup_message = setup_message
-        prompt = ChatPromptTemplate.from_messages(setup_message)
-
-        if examples:
-            print("Examples provided")
-            print(examples)
-            example_prompt = ChatPromptTemplate.from_messages([('human', "{input}"), ('ai', "{output}")])
-            few_shot_prompt = FewShotChatMessagePromptTemplate(example_prompt=example_prompt, examples=examples)
-            prompt = ChatPromptTemplate.from_messages([setup_message[0], few_shot_prompt, *setup_message[1:]])
-
-        chain = create_structured_output_runnable(OntologyClass, llm, prompt).with_config(
-            {"run_name": f"{label}-generation"})
-        ontology_class = chain.invoke({"input": class_name})
-        return ontology_class
-
-    def update_ontology(self, ontology_file):
+        return self.get_chain(setup_message, examples).invoke({"input": class_name})
+
+    async def generate_labels(self, class_names, setup_message, examples=None):
+        """
+        Requests the labels of many classes concurrently, with at most ONTOLOGY_ENRICHMENT_CONCURRENCY requests
+        in flight. Yields (class name, OntologyClass) in the order the requests finish; failed classes are
+        reported and skipped.
+        """
+        chain = self.get_chain(setup_message, examples)
+        semaphore = asyncio.Semaphore(ONTOLOGY_ENRICHMENT_CONCURRENCY)
+
+        async def run(class_name):
+            async with semaphore:
+                try:
+                    return class_name, await chain.ainvoke({"input": class_name})
+                except JSONDecodeError:
+                    print(f"Invalid JSON response for class: {class_name}")
+                except Exception as e:
+                    print(f"Label generation failed for class: {class_name}: {e}")
+                return class_name, None
+
+        for result in asyncio.as_completed([run(class_name) for class_name in class_names]):
+            class_name, output = await result
+            if output is not None:
+                yield class_name, output
+
+    def update_ontology(self, ontology_file, only_missing=False):
+        """
+        Generates names, descriptions and alternative labels for the classes of an ontology file (only for the
+        classes that have none yet with only_missing). Generated labels are appended to a cache file next to the
+        ontology, keyed by class name and prompt version, and the ontology is saved every
+        ONTOLOGY_ENRICHMENT_CHECKPOINT_INTERVAL classes, so an interrupted run resumes without repeating finished
+        requests.
+        """
         if ontology_file == "matter.owl":
             return
 
+        setup_message = self.SETUP_MESSAGE[ontology_file]
+        cache = LabelCache(self.store.path(ontology_file) + ".labels.jsonl", prompt_version(setup_message))
 
-        ontology_path1 = os.path.join(self.ontology_folder, ontology_file)
-        ontology_path = os.path.join(self.ontology_folder, ontology_file)
-
-        onto = get_ontology(ontology_path).load()
+        onto = self.store.load(ontology_file)
         with onto:
             class alternative_label(AnnotationProperty):
                 domain = [Thing]
@@ -102,123 +229,245 @@ class OntologyManager:
                 range = [str]
             class description_name(AnnotationProperty):
                 domain = [Thing]
-                range = str
-            for cls in onto.classes():
-                if not cls.onto_name:
-                    print(f"Need to update class: {cls.name}")
-                try:
-                    output = self.get_labels(cls.name, self.SETUP_MESSAGE[ontology_file])
-                    print(cls.name, output.name, output.alternative_labels)
-                    cls.alternative_labels = str(output.alternative_labels)
-                    cls.onto_name = cls.name
-                    cls.description_name = output.description.replace("'", "")
-                except JSONDecodeError:
-                    print(f"Invalid JSON response for class: {cls.name}")
-
-            onto.save(ontology_path1, format="rdfxml")
-
-    def import_to_neo4j(self, ontology_file):
-        print("Import to Neo4j", ontology_file)
-
-        ontology_path = os.path.join(self.ontology_folder, ontology_file)
-        onto = get_ontology(ontology_path).load()
-
-        with onto:
-            pass
+                range = [str]
 
+            def apply(cls, output):
+                print(cls.name, output.name, output.alternative_labels)
+                cls.alternative_labels = str(output.alternative_labels)
+                cls.onto_name = cls.name
+                cls.description_name = output.description.replace("'", "")
+
+            classes = {cls.name: cls for cls in onto.classes() if not (only_missing and cls.onto_name)}
+            pending = []
+            for name, cls in classes.items():
+                output = cache.get(name)
+                if output is None:
+                    pending.append(name)
+                else:
+                    apply(cls, output)
+            print(f"Need to update {len(classes)} classes, {len(pending)} without cached labels")
+
+            async def enrich():
+                completed = 0
+                async for name, output in self.generate_labels(pending, setup_message):
+                    cache.set(name, output)
+                    apply(classes[name], output)
+                    completed += 1
+                    if completed % ONTOLOGY_ENRICHMENT_CHECKPOINT_INTERVAL == 0:
+                        self.store.save(onto, ontology_file)
+
+            if pending:
+                self.run_async(enrich())
+            self.store.save(onto, ontology_file)
+
+    @staticmethod
+    def compile_ontology(onto):
+        """
+        Compiles the classes of an ontology into the row batches written by `write_ontology`.
+
+        :param onto: The loaded owlready2 ontology
+        :return: Dict of the rows of classes (with their fingerprint), alternative labels, subclass edges and
+            embedding texts
+        """
+        rows = {'classes': {}, 'labels': [], 'subclasses': [], 'texts': []}
         for cls in onto.classes():
-
             class_name = str(cls.name).title()
             class_uri = str(cls.iri)
             class_comment = str(cls.comment).replace("'","").replace("[","").replace("]","") if cls.comment else None
-            print(cls.name)
-            try:
-                cls_instance = self.file_to_model[ontology_file].nodes.get(uri=class_uri)
-                cls_instance.name = class_name.title()
-                cls_instance.validated_labels = True
-                cls_instance.validated_ontology = True
-                cls_instance.description = class_comment
-                cls_instance.save()
-            except:
-                cls_instance = self.file_to_model[ontology_file](uri=class_uri, name=class_name,
-                                                                 description=class_comment)
-                cls_instance.save()
-            EMBEDDING_MODEL_MAPPER = {
-                "matter.owl": MatterEmbedding,
-                "quantities.owl": QuantityEmbedding,
-                "manufacturing.owl": ProcessEmbedding
-            }
-            try:
-                embedding_name = EMBEDDING_MODEL_MAPPER[ontology_file].nodes.get(input=class_name)
-                embedding_description = EMBEDDING_MODEL_MAPPER[ontology_file].nodes.get(input=class_comment)
-                if not cls_instance.is_connected(embedding_node):
-                    secondary_embedding_name = EMBEDDING_MODEL_MAPPER[ontology_file](input=embedding_name.input,
-                                                                                      vector=embedding_name.vector)
-                    secondary_embedding_description = EMBEDDING_MODEL_MAPPER[ontology_file](input=embedding_description.input,
-                                                                                             vector=embedding_description.vector)
-                    cls_instance.model_embedding.connect(secondary_embedding_name)
-                    cls_instance.model_embedding.connect(secondary_embedding_description)
-            except:
-                vector_name = request_embedding(class_name)
-                embedding_name = EMBEDDING_MODEL_MAPPER[ontology_file](vector=vector_name, input=class_name).save()
-                cls_instance.model_embedding.connect(embedding_name)
-                vector_description = request_embedding(class_comment)
-                embedding_description = EMBEDDING_MODEL_MAPPER[ontology_file](vector=vector_description,
-                                                                              input=class_comment).save()
-                cls_instance.model_embedding.connect(embedding_description)
-            if cls.alternative_labels:
+            rows['classes'][class_uri] = [class_uri, class_name, class_comment]
+            rows['texts'] += [[class_uri, text] for text in (class_name, class_comment) if text]
 
+            if cls.alternative_labels:
                 for label in ast.literal_eval(cls.alternative_labels[0]):
-                    alt_label = str(label)
-                    label = label.title()
-                    try:
-                        alternative_label_node = AlternativeLabel.nodes.get(label=alt_label)
-                        if not cls_instance.alternative_label.is_connected(alternative_label_node):
-                            secondary_label_node = AlternativeLabel(label=alt_label)
-                            secondary_label_node.save()
-                            cls_instance.alternative_label.connect(secondary_label_node)
-                    except:
-                        alternative_label_node = AlternativeLabel(label=alt_label)
-                        alternative_label_node.save()
-                        cls_instance.alternative_label.connect(alternative_label_node)
-                    try:
-                        embedding_node = EMBEDDING_MODEL_MAPPER[ontology_file](input=label)
-                        if not cls_instance.is_connected(embedding_node):
-                            secondary_embedding_node =EMBEDDING_MODEL_MAPPER[ontology_file](input= embedding_node.input, vector=embedding_node.vector)
-                            cls_instance.model_embedding.connect(secondary_embedding_node)
-                    except:
-                        vector = request_embedding(label)
-                        embedding_node = EMBEDDING_MODEL_MAPPER[ontology_file](vector=vector, input=label).save()
-                        cls_instance.model_embedding.connect(embedding_node)
-
-            # Add subclass relationships
+                    rows['labels'].append([class_uri, str(label)])
+                    rows['texts'].append([class_uri, str(label).title()])
+
             for subclass in cls.subclasses():
-                subclass_name = str(subclass.name)
-                subclass_uri = str(subclass.iri)
-                subclass_comment = str(subclass.comment) if subclass.comment else None
-                # print(f"Creating subclass_instance with kwargs: {subclass_name=}, {subclass_comment=}, {subclass_uri=}")
-                try:
-                    subclass_instance = self.file_to_model[ontology_file].nodes.get(uri=subclass_uri)
-                    subclass_instance.name = subclass_name
-                    subclass_instance.description = subclass_comment
-                    subclass_instance.save()
-                    subclass_instance.emmo_subclass.connect(cls_instance)
-
-                except:
-                    subclass_instance = self.file_to_model[ontology_file](uri=subclass_uri, name=subclass_name,
-                                                                          description=subclass_comment)
-                    subclass_instance.save()
-                    subclass_instance.emmo_subclass.connect(cls_instance)
-
-    def update_all_ontologies(self):
+                rows['subclasses'].append([
+                    str(subclass.iri), class_uri, str(subclass.name),
+                    str(subclass.comment) if subclass.comment else None
+                ])
+
+        parents = {}
+        for child, parent, _, _ in rows['subclasses']:
+            parents.setdefault(child, []).append(parent)
+        labels = {}
+        for uri, label in rows['labels']:
+            labels.setdefault(uri, []).append(label)
+        for uri, row in rows['classes'].items():
+            row.append(class_fingerprint(*row, labels.get(uri, []), parents.get(uri, [])))
+        return rows
+
+    @staticmethod
+    def write_ontology(Model, rows, removed=()):
+        """
+        Writes compiled ontology rows with a few UNWIND statements in one transaction. Classes are merged on their
+        uri; the embeddings of texts without an embedding node are requested in batches before the transaction.
+        The subclass edges, alternative labels and embedding relationships of the written classes are replaced,
+        and embeddings that are no longer connected to any class are deleted. Cached matching results reading the
+        ontology are invalidated.
+
+        :param Model: The ontology node class, e.g. EMMOMatter
+        :param rows: The rows returned by `compile_ontology`, or a selection of them
+        :param removed: The uris of classes to delete
+        """
+        labels = ':'.join(Model.inherited_labels())
+        embedding_label = EMBEDDING_LABELS[Model.__label__]
+        texts = list(dict.fromkeys(text for _, text in rows['texts']))
+        hashes = {text: embedding_cache_key(EMBEDDING_MODEL, text) for text in texts}
+        existing, _ = db.cypher_query(
+            f'MATCH (emb:{embedding_label}) WHERE emb.input_hash IN $hashes RETURN emb.input_hash',
+            {'hashes': list(hashes.values())}
+        )
+        existing = {row[0] for row in existing}
+        missing = [text for text in texts if hashes[text] not in existing]
+        vectors = dict(zip(missing, request_embeddings(missing))) if missing else {}
+
+        uris = list(rows['classes'])
+        with db.transaction:
+            for start in range(0, len(removed), ONTOLOGY_IMPORT_BATCH_SIZE):
+                db.cypher_query(f'''
+                    UNWIND $uris as uri
+                    MATCH (n:{Model.__label__} {{uri: uri}})
+                    OPTIONAL MATCH (n)-[:HAS_LABEL]->(label:AlternativeLabel)
+                    DETACH DELETE label, n
+                ''', {'uris': list(removed)[start:start + ONTOLOGY_IMPORT_BATCH_SIZE]})
+
+            for start in range(0, len(uris), ONTOLOGY_IMPORT_BATCH_SIZE):
+                batch = {'uris': uris[start:start + ONTOLOGY_IMPORT_BATCH_SIZE]}
+                db.cypher_query(f'''
+                    UNWIND $uris as uri
+                    MATCH (n:{Model.__label__} {{uri: uri}})-[rel:EMMO__IS_A]->()
+                    DELETE rel
+                ''', batch)
+                db.cypher_query(f'''
+                    UNWIND $uris as uri
+                    MATCH (n:{Model.__label__} {{uri: uri}})-[:HAS_LABEL]->(label:AlternativeLabel)
+                    DETACH DELETE label
+                ''', batch)
+                db.cypher_query(f'''
+                    UNWIND $uris as uri
+                    MATCH (n:{Model.__label__} {{uri: uri}})<-[rel:FOR]-(:{embedding_label})
+                    DELETE rel
+                ''', batch)
+
+            for start in range(0, len(rows['classes']), ONTOLOGY_IMPORT_BATCH_SIZE):
+                db.cypher_query(f'''
+                    UNWIND $rows as row
+                    MERGE (n:{labels} {{uri: row[0]}})
+                    ON CREATE SET
+                        n.uid = replace(randomUUID(), '-', ''),
+                        n.validated_labels = false,
+                        n.validated_ontology = false
+                    ON MATCH SET
+                        n.validated_labels = true,
+                        n.validated_ontology = true
+                    SET n.name = row[1], n.description = row[2], n.fingerprint = row[3]
+                ''', {'rows': list(rows['classes'].values())[start:start + ONTOLOGY_IMPORT_BATCH_SIZE]})
+
+            for start in range(0, len(rows['subclasses']), ONTOLOGY_IMPORT_BATCH_SIZE):
+                db.cypher_query(f'''
+                    UNWIND $rows as row
+                    MATCH (parent:{Model.__label__} {{uri: row[1]}})
+                    MERGE (n:{labels} {{uri: row[0]}})
+                    ON CREATE SET
+                        n.uid = replace(randomUUID(), '-', ''),
+                        n.name = row[2],
+                        n.description = row[3],
+                        n.validated_labels = false,
+                        n.validated_ontology = false
+                    MERGE (n)-[:EMMO__IS_A]->(parent)
+                ''', {'rows': rows['subclasses'][start:start + ONTOLOGY_IMPORT_BATCH_SIZE]})
+
+            # every class gets its own AlternativeLabel node per label, shared label nodes are not reused
+            for start in range(0, len(rows['labels']), ONTOLOGY_IMPORT_BATCH_SIZE):
+                db.cypher_query(f'''
+                    UNWIND $rows as row
+                    MATCH (n:{Model.__label__} {{uri: row[0]}})
+                    MERGE (n)-[:HAS_LABEL]->(label:AlternativeLabel {{label: row[1]}})
+                    ON CREATE SET label.primary = false
+                ''', {'rows': rows['labels'][start:start + ONTOLOGY_IMPORT_BATCH_SIZE]})
+
+            embedding_rows = [
+                [uri, vectors.get(text), text, hashes[text]] for uri, text in rows['texts']
+            ]
+            query = generate_ingest_query(Model, 'uri')
+            for start in range(0, len(embedding_rows), EMBEDDING_DB_CHUNK_SIZE):
+                db.cypher_query(query, {
+                    'vectors': embedding_rows[start:start + EMBEDDING_DB_CHUNK_SIZE],
+                    'embedding_model': EMBEDDING_MODEL
+                })
+
+            db.cypher_query(f'''
+                MATCH (emb:{embedding_label})
+                WHERE NOT (emb)-[:FOR]->()
+                DELETE emb
+            ''')
+        invalidate_results([*Model.inherited_labels(), embedding_label])
+
+    @staticmethod
+    def diff_ontology(Model, rows):
+        """
+        Compares the fingerprints of the compiled classes with the fingerprints stored on the imported classes.
+
+        :return: Tuple of (uris of added or changed classes, uris of removed classes)
+        """
+        stored, _ = db.cypher_query(
+            f'MATCH (n:{Model.__label__}) WHERE n.fingerprint IS NOT NULL RETURN n.uri, n.fingerprint'
+        )
+        stored = dict(stored)
+        changed = {uri for uri, row in rows['classes'].items() if stored.get(uri) != row[3]}
+        removed = [uri for uri in stored if uri not in rows['classes']]
+        return changed, removed
+
+    @staticmethod
+    def select_rows(rows, uris):
+        """
+        Selects the rows of the given classes. Subclass edges are selected by their subclass, edges to subclasses
+        outside the ontology by their parent.
+        """
+        return {
+            'classes': {uri: row for uri, row in rows['classes'].items() if uri in uris},
+            'labels': [row for row in rows['labels'] if row[0] in uris],
+            'subclasses': [
+                row for row in rows['subclasses']
+                if row[0] in uris or (row[0] not in rows['classes'] and row[1] in uris)
+            ],
+            'texts': [row for row in rows['texts'] if row[0] in uris],
+        }
+
+    def import_to_neo4j(self, ontology_file, full=False):
+        """
+        Synchronizes the classes of an ontology file with the database. Only classes whose fingerprint changed
+        since the last import are written, so only their new texts are embedded; classes that were removed from
+        the file are deleted.
+
+        :param ontology_file: The name of the file in the ontology folder
+        :param full: Write all classes, regardless of their fingerprints
+        """
+        print("Import to Neo4j", ontology_file)
+
+        onto = self.store.load(ontology_file)
+
+        Model = self.file_to_model[ontology_file]
+        rows = self.compile_ontology(onto)
+        changed, removed = self.diff_ontology(Model, rows)
+        if full:
+            changed = set(rows['classes'])
+        print(f"{len(rows['classes'])} classes, {len(changed)} added or changed, {len(removed)} removed")
+        if changed or removed:
+            self.write_ontology(Model, self.select_rows(rows, changed), removed)
+            print(f"{rebuild_closure(Model.__label__)} EMMO__DESCENDANT_OF relationships")
+
+    def update_all_ontologies(self, only_missing=False):
         ontologies = [f for f in os.listdir(self.ontology_folder) if f.endswith(".owl")]
         for ontology_file in ontologies:
-            self.update_ontology(ontology_file)
+            self.update_ontology(ontology_file, only_missing)
 
-    def import_all_ontologies(self):
+    def import_all_ontologies(self, full=False):
         ontologies = [f for f in os.listdir(self.ontology_folder) if f.endswith(".owl")]
         for ontology_file in ontologies:
-            self.import_to_neo4j(ontology_file)
+            self.import_to_neo4j(ontology_file, full)
 
 
 def main():
@@ -236,9 +485,8 @@ def main():
 
     os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mat2devplatform.settings")
     api_key = settings.OPENAI_API_KEY
-    ontology_folder = "/home/mdreger/Documents/MatGraphAI/Ontology/"
 
-    ontology_manager = OntologyManager(ontology_folder)
+    ontology_manager = OntologyManager()
     # ontology_manager.update_ontology("quantities.owl")
     ontology_manager.import_to_neo4j("quantities.owl")
     # ontology_manager.update_ontology("matter.owl")
@@ -0,0 +1,95 @@
+"""
+Persistent owlready2 world for the ontology tooling.
+
+Parsing the RDF/XML of the EMMO files takes long, so the parsed triples are kept in owlready2's SQLite quadstore
+next to the ontology files. Reopening the quadstore is fast; a .owl file is parsed again only when its content
+hash differs from the hash recorded at its last load.
+"""
+
+import hashlib
+import json
+import os
+
+from owlready2 import World
+
+from graphutils.config import ONTOLOGY_STORE_NAME
+
+
+def file_hash(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class OntologyStore:
+    """
+    One persistent owlready2 world holding all ontology files of a folder.
+
+    Attributes:
+        ontology_folder (str): The folder of the .owl files.
+        world (World): The owlready2 world backed by the quadstore.
+    """
+
+    def __init__(self, ontology_folder, store_path=None):
+        """
+        Opens (or creates) the quadstore of the folder.
+
+        Args:
+            ontology_folder (str): The folder of the .owl files.
+            store_path (str): The quadstore file, defaults to ONTOLOGY_STORE_NAME inside the folder.
+        """
+        self.ontology_folder = ontology_folder
+        store_path = store_path or os.path.join(ontology_folder, ONTOLOGY_STORE_NAME)
+        self._hash_path = store_path + '.hashes.json'
+        self.world = World(filename=store_path)
+        self._hashes = {}
+        if os.path.exists(self._hash_path):
+            with open(self._hash_path) as f:
+                self._hashes = json.load(f)
+        self._loaded = {}
+
+    def path(self, ontology_file):
+        return os.path.join(self.ontology_folder, ontology_file)
+
+    def _record(self, ontology_file, onto):
+        self._hashes[ontology_file] = {'hash': file_hash(self.path(ontology_file)), 'iri': onto.base_iri}
+        self.world.save()
+        with open(self._hash_path + '.tmp', 'w') as f:
+            json.dump(self._hashes, f, indent=2)
+        os.replace(self._hash_path + '.tmp', self._hash_path)
+
+    def load(self, ontology_file):
+        """
+        Returns the ontology of a file, parsing the file only if it changed since it was stored.
+
+        Args:
+            ontology_file (str): The file name relative to the ontology folder.
+
+        Returns:
+            Ontology: The loaded ontology, shared by all callers of this store.
+        """
+        if ontology_file in self._loaded:
+            return self._loaded[ontology_file]
+
+        path = self.path(ontology_file)
+        stored = self._hashes.get(ontology_file)
+        if stored and stored['hash'] == file_hash(path) and stored['iri'] in self.world.ontologies:
+            onto = self.world.ontologies[stored['iri']]
+        else:
+            # the ontology is renamed to the base iri declared in the file, which is recorded for the next open
+            onto = self.world.get_ontology(stored['iri'] if stored else path)
+            with open(path, 'rb') as f:
+                onto.load(fileobj=f, reload=True)
+            self._record(ontology_file, onto)
+        self._loaded[ontology_file] = onto
+        return onto
+
+    def save(self, onto, ontology_file):
+        """
+        Writes the ontology back to its file and commits the quadstore, so the rewritten file is not parsed
+        again on the next load.
+        """
+        onto.save(self.path(ontology_file), format="rdfxml")
+        self._record(ontology_file, onto)
@@ -6,7 +6,7 @@ from pprint import pprint
 from dotenv import load_dotenv
 from neomodel import db
 
-from dbcommunication.ai.createEmbeddings import request_embedding
+from graphutils.embeddings import request_embedding
 from graphutils.embeddings import EmbeddingSearch
 from matgraph.models.ontology import EMMOMatter
 # loads embeddings for a model into RAM and enables fast search using FAISS
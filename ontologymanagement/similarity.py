@@ -5,12 +5,17 @@ import faiss
 import numpy as np
 from neomodel import db
 
-from skills.ai.config import EMBEDDING_DIMENSIONS
+from graphutils.config import EMBEDDING_DIMENSIONS
+from graphutils.embeddings import normalize_vectors
 
 MAX_VALUE = 1.0
 OVERALL_THRESHOLD = 0.85
 INITIAL_CALCULATION = 400 # how many similarities to calculate per skill (before applying thresholds)
-CHUNK_SIZE = 30000  # db write, before filtering
+BLOCK_SIZE = 2000  # embeddings searched per block
+INGEST_SIZE = 5000  # relationships merged per transaction
+FETCH_SIZE = 5000  # embeddings fetched per query
+ONTOLOGY_TOP_K = 10  # similar classes stored per ontology class
+ONTOLOGY_LABELS = ['EMMOMatter', 'EMMOProcess', 'EMMOQuantity']
 
 
 def scale(similarity):
@@ -19,79 +24,216 @@ def scale(similarity):
         MAX_VALUE
     )
 
-def ingest(similarities):
 
-    db.cypher_query('''
-        UNWIND $similarities as similarity
-        MATCH
-          (skill1:Skill {uid: similarity[0]}),
-          (skill2:Skill {uid: similarity[1]})
-        CREATE
-          (skill1)-[rel:SIMILAR {similarity: similarity[2]}]->(skill2)
-    ''', {
-        'similarities': similarities
-    })
-
-def update_similarities(cmd):
-
-    cmd.stdout.write('fetching embeddings...')
-
-    results, meta = db.cypher_query('''
-        MATCH (skill:Skill)<-[:FOR]-(emb:ModelEmbedding)
-        RETURN skill.uid as uid, emb.vector as vector
-    ''')
-
-    cmd.stdout.write('converting to np arrays')
-    embeddings = np.array([
-        np.array(row[1]) for row in results
-    ])
-
-
-    print('creating vector index...', end='')
+def scale_array(similarities):
+    """
+    Vectorised version of `scale`.
+    """
+    scaled = np.minimum((similarities - OVERALL_THRESHOLD) * (1 / (MAX_VALUE - OVERALL_THRESHOLD)), MAX_VALUE)
+    return np.where(similarities < OVERALL_THRESHOLD, 0, scaled)
+
+
+def ingest(similarities, label='Skill'):
+    """
+    Upserts SIMILAR relationships, so re-running the calculation updates edges instead of duplicating them.
+    A pair keeps its best score, since an incremental run only sees the embedding pairs involving new embeddings.
+
+    :param similarities: Rows of (source uid, target uid, similarity)
+    :param label: The label of the connected nodes
+    """
+    for start in range(0, len(similarities), INGEST_SIZE):
+        db.cypher_query(f'''
+            UNWIND $similarities as similarity
+            MATCH
+              (node1:{label} {{uid: similarity[0]}}),
+              (node2:{label} {{uid: similarity[1]}})
+            MERGE
+              (node1)-[rel:SIMILAR]->(node2)
+            SET
+              rel.similarity = CASE
+                WHEN rel.similarity IS NULL OR rel.similarity < similarity[2] THEN similarity[2]
+                ELSE rel.similarity
+              END
+        ''', {
+            'similarities': similarities[start:start + INGEST_SIZE]
+        })
+
+
+def fetch_embeddings(label):
+    """
+    Fetches the embeddings of all nodes with the label page by page into a normalized float32 matrix.
+    Rows are sorted by node uid, so all embeddings of a node are adjacent. Embeddings are shared by nodes with
+    the same input, so a row is a (node, embedding) pair and its dirty flag is kept on their FOR relationship.
+
+    :param label: The label of the nodes
+    :return: Tuple of (sorted unique node uids, node index per row, matrix, embedding uids, dirty mask per row)
+    """
+    match = f'''
+        MATCH (n:{label})<-[link:FOR]-(emb:ModelEmbedding)
+        WHERE size(emb.vector) = $dimensions
+    '''
+    params = {'dimensions': EMBEDDING_DIMENSIONS}
+    total = db.cypher_query(f'{match} RETURN count(emb)', params)[0][0][0]
+
+    matrix = np.empty((total, EMBEDDING_DIMENSIONS), dtype=np.float32)
+    uids, embedding_uids, dirty = [], [], []
+    for skip in range(0, total, FETCH_SIZE):
+        rows, _ = db.cypher_query(f'''
+            {match}
+            RETURN n.uid, emb.uid, emb.vector, COALESCE(link.similarity_computed, false)
+            ORDER BY n.uid, emb.uid
+            SKIP $skip LIMIT $limit
+        ''', {**params, 'skip': skip, 'limit': FETCH_SIZE})
+        rows = rows[:total - len(uids)]
+        if not rows:
+            break
+        matrix[len(uids):len(uids) + len(rows)] = normalize_vectors([row[2] for row in rows])
+        uids += [row[0] for row in rows]
+        embedding_uids += [row[1] for row in rows]
+        dirty += [not row[3] for row in rows]
+
+    matrix = matrix[:len(uids)]
+    node_uids, node_index = np.unique(np.array(uids, dtype=str), return_inverse=True)
+    # np.unique sorts the uids; sort the rows the same way so every node occupies one contiguous range of rows
+    order = np.argsort(node_index, kind='stable')
+    return (node_uids.tolist(), node_index[order], matrix[order], [embedding_uids[i] for i in order],
+            np.array(dirty, dtype=bool)[order])
+
+
+def block_similarities(index, matrix, node_index, rows, incremental, top_k=None):
+    """
+    Searches the neighbours of a block of rows and keeps the relevant node pairs.
+
+    In the full calculation every pair is computed from both of its nodes, so only the pairs whose source node
+    sorts after (or equals) the target node are kept; exact matches of a node with itself are kept on purpose,
+    they are very important for the matching algorithm. In the incremental calculation only the new embeddings
+    are searched, so every pair is kept in that canonical direction regardless of which side is new.
+
+    With top_k the relationships are directed instead: every source node keeps its top_k most similar other
+    nodes, whatever their order.
+
+    :return: Arrays of (source node, target node, scaled similarity), one entry per node pair with its best score
+    """
+    D, I = index.search(matrix[rows], INITIAL_CALCULATION)
+    source = np.repeat(node_index[rows], I.shape[1])
+    target_rows = I.ravel()
+    valid = target_rows >= 0
+    source, target, similarity = source[valid], node_index[target_rows[valid]], scale_array(D.ravel()[valid])
+
+    if top_k:
+        mask = (similarity > 0) & (source != target)
+    else:
+        if incremental:
+            source, target = np.maximum(source, target), np.minimum(source, target)
+        mask = (similarity > 0) & (source >= target)
+    source, target, similarity = source[mask], target[mask], similarity[mask]
+
+    # a pair of nodes can be found through several of their embeddings, keep the best one
+    order = np.argsort(-similarity, kind='stable')
+    pairs = source[order].astype(np.int64) * len(node_index) + target[order]
+    _, first = np.unique(pairs, return_index=True)
+    keep = order[first]
+    source, target, similarity = source[keep], target[keep], similarity[keep]
+
+    if top_k:
+        # rank the targets of every source node by similarity and cut each group after top_k
+        order = np.lexsort((-similarity, source))
+        source, target, similarity = source[order], target[order], similarity[order]
+        group_start = np.flatnonzero(np.r_[True, source[1:] != source[:-1]])
+        rank = np.arange(len(source)) - np.repeat(group_start, np.diff(np.r_[group_start, len(source)]))
+        source, target, similarity = source[rank < top_k], target[rank < top_k], similarity[rank < top_k]
+    return source, target, similarity
+
+
+def block_ranges(node_index, rows, block_size=BLOCK_SIZE):
+    """
+    Splits the rows into blocks of about block_size rows that do not split the embeddings of one node.
+    """
+    start = 0
+    while start < len(rows):
+        stop = min(start + block_size, len(rows))
+        while stop < len(rows) and node_index[rows[stop]] == node_index[rows[stop - 1]]:
+            stop += 1
+        yield rows[start:stop]
+        start = stop
+
+
+def remove_outgoing(uids, label):
+    """
+    Removes the SIMILAR relationships starting at the nodes, before their top-k neighbours are stored again.
+    """
+    for start in range(0, len(uids), INGEST_SIZE):
+        db.cypher_query(f'''
+            UNWIND $uids as uid
+            MATCH (:{label} {{uid: uid}})-[rel:SIMILAR]->()
+            DELETE rel
+        ''', {'uids': uids[start:start + INGEST_SIZE]})
+
+
+def mark_computed(pairs, label):
+    """
+    Marks (node uid, embedding uid) pairs as processed on their FOR relationship.
+    """
+    for start in range(0, len(pairs), INGEST_SIZE):
+        db.cypher_query(f'''
+            UNWIND $pairs as pair
+            MATCH (:{label} {{uid: pair[0]}})<-[link:FOR]-(:ModelEmbedding {{uid: pair[1]}})
+            SET link.similarity_computed = true
+        ''', {'pairs': pairs[start:start + INGEST_SIZE]})
+
+
+def update_similarities(cmd, label='Skill', incremental=False, top_k=None):
+    """
+    Calculates SIMILAR relationships between the nodes of a label from their embeddings.
+
+    The neighbours are searched in blocks of BLOCK_SIZE embeddings, filtered with NumPy masks and merged into
+    the database block by block, so only one block of search results is held in memory at a time.
+
+    :param cmd: The management command, used for output
+    :param label: The label of the nodes
+    :param incremental: Only search the neighbours of embeddings that were not processed before
+    :param top_k: Store directed relationships to the top_k most similar nodes of every node instead of one
+        relationship per similar pair. The previous relationships of the recalculated nodes are replaced.
+    """
+
+    cmd.stdout.write(f'fetching embeddings for {label}...')
+    node_uids, node_index, matrix, embedding_uids, dirty = fetch_embeddings(label)
+    if not len(node_uids):
+        cmd.stdout.write('no embeddings found')
+        return
+
+    cmd.stdout.write('creating vector index...')
     index = faiss.IndexFlatIP(EMBEDDING_DIMENSIONS)
-    index.add(embeddings)
-    print('done')
-
+    index.add(matrix)
+
+    rows = np.flatnonzero(dirty) if incremental else np.arange(len(node_index))
+    if incremental and top_k and len(rows):
+        # new nodes can enter the top k of their neighbours, so the neighbours are recalculated as well. Top k is
+        # not symmetric: a node can rank a new node among its top k although the new node does not rank it among
+        # its own, so every neighbour above the threshold is recalculated, not only the truncated top k
+        affected = set(node_index[rows].tolist())
+        for block in block_ranges(node_index, rows):
+            source, target, _ = block_similarities(index, matrix, node_index, block, incremental)
+            affected.update(source.tolist())
+            affected.update(target.tolist())
+        rows = np.flatnonzero(np.isin(node_index, list(affected)))
+    cmd.stdout.write(f'{len(rows)} of {len(node_index)} embeddings to process')
+    if not len(rows):
+        return
 
-    print('calculating similarities...', end='')
     start = time.time()
-    D, I = index.search(
-        embeddings,
-        INITIAL_CALCULATION
-    )
-    end = time.time()
-    print(f'took {int((end-start)*1000)}ms')
-
-
-    counter = 0
-
-    print('done')
-
-    similarities = []
-
-    cnt = 0
-    for i in range(0, len(D)):
-
-        print(f'filtering and storing data... { round(cnt/len(D)*100) }%', end='\r')
-        cnt += 1
-
-        uid = results[i][0]
-
-        similarities += [
-            [
-                uid,
-                results[I[i][i2]][0],
-                scale(D[i][i2]) if i >= I[i][i2] else 0  # remove duplicates; very important to keep exact matches i=I for the matching algorithm
-            ]
-            for i2 in range(0, len(D[i]))
-        ]
-
-        if len(similarities) > CHUNK_SIZE or i == len(D)-1:
-
-            # remove non-relevant similarities
-            similarities = list(filter(lambda elm: elm[2] > 0, similarities))
-
-            # commit to db
-            ingest(similarities)
-
-            similarities = []
\ No newline at end of file
+    processed, relationships = 0, 0
+    for block in block_ranges(node_index, rows):
+        source, target, similarity = block_similarities(index, matrix, node_index, block, incremental, top_k)
+        if top_k:
+            remove_outgoing([node_uids[i] for i in np.unique(node_index[block])], label)
+        ingest([
+            [node_uids[s], node_uids[t], float(v)] for s, t, v in zip(source, target, similarity)
+        ], label)
+        mark_computed([[node_uids[node_index[i]], embedding_uids[i]] for i in block], label)
+
+        processed += len(block)
+        relationships += len(source)
+        print(f'calculating and storing similarities... {round(processed / len(rows) * 100)}%', end='\r')
+
+    cmd.stdout.write(f'stored {relationships} similarities, took {int(time.time() - start)}s')
@@ -0,0 +1,140 @@
+import asyncio
+import json
+import os
+import re
+import tempfile
+import types
+from typing import Any
+from unittest import mock
+
+import numpy as np
+from django.test import SimpleTestCase
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from owlready2 import World, Thing, AnnotationProperty
+
+from graphutils.config import EMBEDDING_DIMENSIONS
+from ontologymanagement import similarity
+from ontologymanagement.ontologyManager import OntologyManager
+
+
+def unit_vector(degrees):
+    vector = np.zeros(EMBEDDING_DIMENSIONS)
+    vector[0], vector[1] = np.cos(np.radians(degrees)), np.sin(np.radians(degrees))
+    return vector.tolist()
+
+
+class FakeGraph:
+    """
+    In-memory stand-in for the queries of `update_similarities`: one embedding per node, FOR relationships with
+    their processed flag and SIMILAR relationships.
+    """
+
+    def __init__(self):
+        self.vectors = {}
+        self.computed = {}
+        self.similar = {}
+
+    def add(self, uid, degrees, computed):
+        self.vectors[uid] = unit_vector(degrees)
+        self.computed[uid] = computed
+
+    def targets(self, uid):
+        return {target for source, target in self.similar if source == uid}
+
+    def cypher_query(self, query, params=None):
+        if 'RETURN count(emb)' in query:
+            return [[len(self.vectors)]], None
+        if 'SKIP $skip' in query:
+            rows = [[uid, f'emb-{uid}', vector, self.computed[uid]] for uid, vector in sorted(self.vectors.items())]
+            return rows[params['skip']:params['skip'] + params['limit']], None
+        if 'DELETE rel' in query:
+            self.similar = {pair: value for pair, value in self.similar.items() if pair[0] not in params['uids']}
+        elif 'MERGE' in query:
+            for source, target, value in params['similarities']:
+                self.similar[(source, target)] = max(self.similar.get((source, target), value), value)
+        elif 'similarity_computed = true' in query:
+            for uid, _ in params['pairs']:
+                self.computed[uid] = True
+        return [], None
+
+
+class IncrementalTopKTest(SimpleTestCase):
+
+    def run_update(self, graph, incremental):
+        command = types.SimpleNamespace(stdout=types.SimpleNamespace(write=lambda message: None))
+        with mock.patch.object(similarity, 'db', graph), mock.patch('builtins.print'):
+            similarity.update_similarities(command, label='EMMOMatter', incremental=incremental, top_k=1)
+
+    def test_new_node_enters_top_k_of_existing_node_asymmetrically(self):
+        graph = FakeGraph()
+        graph.add('a', 0, computed=False)
+        graph.add('b', 30, computed=False)
+        graph.add('c', 17, computed=False)
+        self.run_update(graph, incremental=False)
+        self.assertEqual(graph.targets('a'), {'c'})
+
+        # n is closer to a than c is, but n ranks c (2 degrees away) above a (15 degrees away)
+        graph.add('n', 15, computed=False)
+        self.run_update(graph, incremental=True)
+
+        self.assertEqual(graph.targets('n'), {'c'})
+        self.assertEqual(graph.targets('a'), {'n'})
+
+
+class FakeLabelModel(BaseChatModel):
+    """
+    Chat model answering label requests with a function call. Like the httpx client of ChatOpenAI, it is bound
+    to the event loop of its first request and fails in any other loop.
+    """
+
+    loop: Any = None
+
+    @property
+    def _llm_type(self):
+        return 'fake-labels'
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        raise NotImplementedError
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        loop = asyncio.get_running_loop()
+        if self.loop is None:
+            self.loop = loop
+        elif self.loop is not loop:
+            raise RuntimeError('attached to a different loop')
+        name = re.search(r'class: (\w+)', ' '.join(message.content for message in messages)).group(1)
+        arguments = {'output': {'name': name, 'description': f'{name} description', 'alternative_labels': [name]}}
+        message = AIMessage(content='', additional_kwargs={
+            'function_call': {'name': '_OutputFormatter', 'arguments': json.dumps(arguments)}
+        })
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+
+class OntologyEnrichmentTest(SimpleTestCase):
+
+    def write_ontology(self, folder, ontology_file, class_names):
+        onto = World().get_ontology(f'http://example.org/{ontology_file}')
+        with onto:
+            # declared by the EMMO files the labels are generated for
+            type('alternative_labels', (AnnotationProperty,), {})
+            for name in class_names:
+                type(name, (Thing,), {})
+        onto.save(os.path.join(folder, ontology_file), format='rdfxml')
+
+    def test_enriches_ontology_files_in_sequence(self):
+        folder = tempfile.mkdtemp()
+        self.write_ontology(folder, 'quantities.owl', ['Temperature', 'Pressure'])
+        self.write_ontology(folder, 'manufacturing.owl', ['Sintering', 'Milling'])
+        manager = OntologyManager(ontology_folder=folder, llm=FakeLabelModel())
+
+        with mock.patch('builtins.print'):
+            manager.update_all_ontologies()
+
+        for ontology_file in ('quantities.owl', 'manufacturing.owl'):
+            onto = manager.store.load(ontology_file)
+            self.assertEqual(
+                {cls.name: list(cls.onto_name) for cls in onto.classes()},
+                {cls.name: [cls.name] for cls in onto.classes()}
+            )